@@ -5,23 +5,39 @@ Created by Dave Williams on 2013.11.07
 
 background.py provides access to background subtraction mechanisms and their
 associated parameters.
+
+For a compact video (one opened with compact=True) the background is rounded
+to the type of the video frames and subtraction saturates in that type,
+rather than everything being carried about as float64. The absolute
+foreground found this way is within one grey level, at every pixel, of that
+found by the float path once the latter has been rounded for segmentation.
 """
 
 import copy
 import numpy as np
+import cv2
+# Local imports
+import instrument
 
 
-def create_background_object(video_object):
+def create_background_object(video_object, model=None):
     """Create a background subtraction object from a passed video object."""
-    return Background(video_object)
+    return Background(video_object, model)
 
 
 class Background(object):
     """Remember the background model for a video file."""
-    def __init__(self, vid):
-        """Get goin'."""
+    def __init__(self, vid, model=None):
+        """Get goin'.
+
+        A background model found before, say one that was cached, can be
+        passed as model to save finding it again.
+        """
         self.video = copy.copy(vid)  # So current frame changes won't propagate
-        self._first_ten = self._naive_background()
+        self.compact = getattr(vid, 'compact', False)
+        if model is None:
+            model = self._naive_background()
+        self._first_ten = model
 
     def _naive_background(self):
         """Find the mean of the first ten frames.
@@ -29,11 +45,13 @@ class Background(object):
         Takes:
             Nothing
         Gives:
-            frame_mean - the mean of the first ten frames
+            frame_mean - the mean of the first ten frames, rounded to the
+                         frame type for compact videos
         """
-        frames = [self.video.find_and_read(i) for i in range(10)]
-        frame_mean = np.array(frames).mean(0)
-        # frame_mean = np.uint8(np.round(np.array(frames).mean(0)))
+        frames = np.array([self.video.find_and_read(i) for i in range(10)])
+        frame_mean = frames.mean(0)
+        if self.compact:
+            frame_mean = frame_mean.round().astype(frames.dtype)
         return frame_mean
 
     def background_image(self, frame_ind=None):
@@ -50,12 +68,53 @@ class Background(object):
         """
         return self._first_ten
 
+    @instrument.timed('background.subtract_frame')
+    def subtract_frame(self, frame, frame_ind=None, absolute=True,
+                       buffers=None):
+        """Return a non-thresholded background-subtracted version of a frame.
+
+        This works on a frame that has already been read from the video, so
+        that callers reading frames in order needn't seek for each one.
+        Takes:
+            frame - the frame, as read from the video
+            frame_ind - frame number of the passed frame (None)
+            absolute - whether to return the absolute value of the foreground,
+                       a value of False will allow negative values (True)
+            buffers - a FrameBuffers to write the result into, or None for a
+                      new array (None)
+        Gives:
+            frame - the background subtracted frame, zeroed outside any
+                    polygonal region of interest of the video
+        """
+        background = self.background_image(frame_ind)
+        if self.compact and absolute:
+            out_type = frame.dtype
+        elif self.compact:
+            out_type = np.int16 if frame.dtype.itemsize == 1 else np.int32
+        else:
+            out_type = np.result_type(frame, background)
+        out = None
+        if buffers is not None:
+            out = buffers.get('foreground', frame.shape, out_type)
+        if self.compact and absolute:
+            frame = cv2.absdiff(frame, background, dst=out)
+        elif self.compact:
+            frame = np.subtract(frame, background, out=out, dtype=out_type)
+        else:
+            frame = np.subtract(frame, background, out=out)
+            if absolute:
+                frame = np.abs(frame, out=frame)
+        roi = getattr(self.video, 'roi', None)
+        if roi is not None:
+            roi.apply_mask(frame)
+        return frame
+
     def subtract_background(self, frame_ind, absolute=True):
         """Return a non-thresholded background-subtracted version of frame i.
 
         Note that the returned frame will not necessarily be in a format
         amenable to OpenCV usage, as it will be a numpy array of floats rather
-        than 8 bit unsigned integers.
+        than 8 bit unsigned integers, unless the video is compact.
 
         Takes:
             frame_ind - frame number for which to find subtracted version
@@ -64,16 +123,39 @@ class Background(object):
         Gives:
             frame - the background subtracted frame
         """
-        frame = np.subtract(self.video.find_and_read(frame_ind),
-                            self.background_image(frame_ind))
-        if absolute:
-            frame = np.abs(frame)
-        return frame
+        return self.subtract_frame(self.video.find_and_read(frame_ind),
+                                   frame_ind, absolute)
 
-    def subtracted_frames(self):
-        """Create a generator of background subtracted frames."""
-        frame_number = 0
+    def subtracted_frames(self, sequential=True, start=0, stop=None,
+                          buffers=None):
+        """Create a generator of background subtracted frames.
+
+        By default the video is decoded once, front to back, through its
+        next method rather than seeking to each frame in turn. Seeking is
+        slow for most formats, so only ask for it if you need it.
+        Takes:
+            sequential - read frames in order rather than seeking to each
+                         (True)
+            start - the first frame to give (0)
+            stop - the frame to stop before, the video end if None (None)
+            buffers - a FrameBuffers to decode and subtract frames through,
+                      in which case each frame given is only good until the
+                      next one is asked for (None)
+        Gives:
+            frame - each background subtracted frame in turn
+        """
         video_length = int(self.video.length)
-        while frame_number < video_length:
-            yield self.subtract_background(frame_number)
-            frame_number += 1
+        if stop is None or stop > video_length:
+            stop = video_length
+        if not sequential:
+            for frame_number in range(start, stop):
+                yield self.subtract_background(frame_number)
+            return
+        self.video.seek(start)
+        frame = None
+        for frame_number in range(start, stop):
+            try:
+                frame = self.video.next(None if buffers is None else frame)
+            except StopIteration:
+                return
+            yield self.subtract_frame(frame, frame_number, buffers=buffers)
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" batch.py
+
+batch.py tracks every video in a directory, spread over a pool of worker
+processes with one video to each. The paths found in each video are written
+out next to it, to a track store or as a directory of CSV files. Progress
+is kept in a manifest file so that an interrupted batch, when started
+again, skips the videos it has already finished.
+"""
+
+import os
+import json
+import shutil
+import traceback
+import multiprocessing
+# Local imports
+import track
+import segment
+import contour
+import path
+import trackstore
+import fileutil
+
+
+VIDEO_EXTENSIONS = ('avi', 'mov', 'mp4', 'tif', 'tiff')
+MANIFEST_NAME = 'hvtrack_manifest.json'
+
+# The batch's stop Event, in each worker process, see _start_worker
+_stop = None
+
+
+def find_videos(directory):
+    """Give the sorted names of the videos we can track in a directory."""
+    is_video = lambda name: name.split('.')[-1].lower() in VIDEO_EXTENSIONS
+    return sorted(name for name in os.listdir(directory)
+                  if is_video(name) and
+                  os.path.isfile(os.path.join(directory, name)))
+
+
+def path_output_directory(out_dir, video_name):
+    """Give the directory the paths of a video are written to."""
+    return os.path.join(out_dir, os.path.splitext(video_name)[0]+'_paths')
+
+
+def store_output_name(out_dir, video_name):
+    """Give the track store file the paths of a video are written to."""
+    return os.path.join(out_dir, os.path.splitext(video_name)[0]+'.tracks')
+
+
+def write_store(path_obj, paths, filename):
+    """Write a list of paths out to a track store.
+
+    The store is written under a temporary name and only moved into place
+    once every path is in, so it is never found half done.
+    Takes:
+        path_obj - the Path the paths were found with
+        paths - list of paths to write
+        filename - the store file, replaced if it already exists
+    Gives:
+        None
+    """
+    partial = filename+'.partial'
+    with trackstore.TrackStoreWriter(partial) as store:
+        for one_path in paths:
+            store.append(path_obj.path_table(one_path))
+    fileutil.replace_file(partial, filename)
+
+
+def write_paths(path_obj, paths, directory):
+    """Write each of a list of paths out to its own file in a directory.
+
+    The directory is filled under a temporary name and only moved into
+    place once every path is written, so it is never found half done.
+    Takes:
+        path_obj - the Path the paths were found with
+        paths - list of paths to write
+        directory - where to put them, replaced if it already exists
+    Gives:
+        None
+    """
+    partial = directory+'.partial'
+    if os.path.exists(partial):
+        shutil.rmtree(partial)
+    os.makedirs(partial)
+    for path_ind, one_path in enumerate(paths):
+        path_obj.save_path_centers(
+            os.path.join(partial, 'path_%04i.csv'%path_ind), one_path)
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.rename(partial, directory)
+
+
+class Manifest(object):
+    """Remember which videos of a batch are done, failed or under way.
+
+    The manifest is a JSON file mapping each video name to a dict with at
+    least its 'state', and is rewritten in full on every change.
+    """
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    IN_PROGRESS = 'in progress'
+
+    def __init__(self, filename):
+        """Load the manifest from filename, or start an empty one."""
+        self.filename = filename
+        self.entries = {}
+        if os.path.exists(filename):
+            with open(filename) as manifest_file:
+                self.entries = json.load(manifest_file)
+
+    def state(self, video_name):
+        """Give the state of a video, None if we've not seen it before."""
+        return self.entries.get(video_name, {}).get('state')
+
+    def mark(self, video_name, state, **details):
+        """Set the state of a video, with any details, and save."""
+        entry = dict(details)
+        entry['state'] = state
+        self.entries[video_name] = entry
+        self.save()
+
+    def save(self):
+        """Write the manifest out, replacing the old copy only once done."""
+        temporary = self.filename+'.tmp'
+        with open(temporary, 'w') as manifest_file:
+            json.dump(self.entries, manifest_file, indent=2, sort_keys=True)
+        fileutil.replace_file(temporary, self.filename)
+
+
+def _start_worker(stop):
+    """Keep the batch's stop Event where _track_one can see it."""
+    global _stop
+    _stop = stop
+
+
+def _track_one(args):
+    """Track a single video and write out its paths, in a worker process.
+
+    The video is given up on, between frames, once the batch is stopped.
+    Takes:
+        args - tuple of the video's name, its directory, the output
+               directory, the Segment, Contour and Path to use and whether
+               to write CSV files rather than a track store
+    Gives:
+        video_name - the name of the video
+        path_count - the number of paths written, None on failure or if
+                     the batch was stopped
+        error - the traceback of a failure, None otherwise
+    """
+    video_name, directory, out_dir, seg_obj, con_obj, path_obj, csv = args
+    cancel = None if _stop is None else _stop.is_set
+    if cancel is not None and cancel():
+        return video_name, None, None
+    try:
+        paths = track.track_video(os.path.join(directory, video_name),
+                                  seg_obj, con_obj, path_obj, cancel=cancel)
+        if paths is None:
+            return video_name, None, None
+        if csv:
+            write_paths(path_obj, paths,
+                        path_output_directory(out_dir, video_name))
+        else:
+            write_store(path_obj, paths,
+                        store_output_name(out_dir, video_name))
+        return video_name, len(paths), None
+    except Exception:
+        return video_name, None, traceback.format_exc()
+
+
+def process_directory(directory, seg_obj=None, con_obj=None, path_obj=None,
+                      processes=None, out_dir=None, retry_failed=True,
+                      csv=False, cancel=None):
+    """Track every video in a directory, resuming any earlier attempt.
+
+    Videos already marked completed in the manifest are skipped. Those
+    left in progress, by a batch that was interrupted or cancelled, are
+    started again.
+    Takes:
+        directory - the directory holding the videos
+        seg_obj - Segment to use, defaults if None (None)
+        con_obj - Contour to use, defaults if None (None)
+        path_obj - Path to use, defaults if None (None)
+        processes - number of worker processes, one per core if None (None)
+        out_dir - where paths and the manifest go, directory if None (None)
+        retry_failed - whether to try videos which failed before (True)
+        csv - whether to write a directory of CSV files per video rather
+              than a track store (False)
+        cancel - a callable, asked every so often, which stops the batch
+                 when it gives True, videos under way being given up on
+                 between frames; None to never stop early (None)
+    Gives:
+        manifest - the Manifest of the batch
+    """
+    seg_obj = segment.create_segment_object() if seg_obj is None else seg_obj
+    con_obj = contour.create_contour_object() if con_obj is None else con_obj
+    path_obj = path.create_path_object() if path_obj is None else path_obj
+    out_dir = directory if out_dir is None else out_dir
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    manifest = Manifest(os.path.join(out_dir, MANIFEST_NAME))
+    skip = [Manifest.COMPLETED] + ([] if retry_failed else [Manifest.FAILED])
+    todo = [name for name in find_videos(directory)
+            if manifest.state(name) not in skip]
+    if len(todo) == 0:
+        return manifest
+    for name in todo:
+        manifest.mark(name, Manifest.IN_PROGRESS)
+    jobs = [(name, directory, out_dir, seg_obj, con_obj, path_obj, csv)
+            for name in todo]
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    stop = multiprocessing.Event()
+    pool = multiprocessing.Pool(min(processes, len(jobs)), _start_worker,
+                                (stop,))
+    try:
+        results = pool.imap_unordered(_track_one, jobs)
+        for job in jobs:
+            while True:
+                if cancel is not None and cancel():
+                    stop.set()
+                try:
+                    name, path_count, error = results.next(timeout=0.25)
+                    break
+                except multiprocessing.TimeoutError:
+                    pass
+            if error is not None:
+                manifest.mark(name, Manifest.FAILED, error=error)
+            elif path_count is not None:
+                manifest.mark(name, Manifest.COMPLETED, paths=path_count)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return manifest
@@ -0,0 +1,423 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" benchmark.py
+
+benchmark.py times tracking on synthetic videos, so that a change to any of
+the video, background, segment, contour or path stages can be measured. The
+videos are made deterministically from a seed: blobs drifting and bouncing
+about over a still, textured background, with speckle noise sprinkled over
+every frame. Each is written as TIFF and AVI at the resolutions and lengths
+asked for, then each stage is timed on its own as well as tracking end to
+end. Every video is benchmarked in a fresh worker process so that the peak
+resident memory reported is that video's alone.
+
+Results are saved as JSON, along with the commit and library versions they
+were taken with, and two results files can be compared with --compare.
+"""
+
+import os
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+import numpy as np
+import cv2
+try:
+    import resource
+except ImportError:
+    resource = None  # windows has no getrusage, so no peak memory
+# Local imports
+import tiffstack
+import video
+import background
+import segment
+import contour
+import path
+import track
+import buffers as buffers_module
+
+
+STAGES = ('decode', 'subtract', 'segment', 'contour', 'path')
+
+
+def synthetic_frames(width=640, height=480, length=200, blobs=5, radius=8,
+                     speed=3.0, noise=0.01, seed=0):
+    """Generate the frames of a synthetic video, the same for the same seed.
+
+    Takes:
+        width - frame width in pixels (640)
+        height - frame height in pixels (480)
+        length - number of frames (200)
+        blobs - number of bright round blobs moving about (5)
+        radius - radius of the blobs in pixels (8)
+        speed - distance each blob moves per frame in pixels (3.0)
+        noise - fraction of each frame's pixels set to random values (0.01)
+        seed - seed for the random background, blobs and noise (0)
+    Gives:
+        frame - each uint8 grayscale frame in turn, always the same array
+                overwritten, so copy any frame you want to keep
+    """
+    rand = np.random.RandomState(seed)
+    still = rand.randint(40, 60, (height, width)).astype(np.uint8)
+    low, high = np.array([radius, radius]), np.array([width, height])-radius
+    position = low + rand.rand(blobs, 2)*(high-low)
+    angle = rand.rand(blobs)*2*np.pi
+    velocity = speed*np.column_stack((np.cos(angle), np.sin(angle)))
+    speckles = int(noise*width*height)
+    frame = np.empty_like(still)
+    for frame_ind in range(length):
+        frame[...] = still
+        for x, y in position:
+            cv2.circle(frame, (int(round(x)), int(round(y))), radius, 200, -1)
+        rows = rand.randint(0, height, speckles)
+        cols = rand.randint(0, width, speckles)
+        frame[rows, cols] = rand.randint(0, 256, speckles)
+        yield frame
+        position += velocity
+        bounced = (position < low) | (position > high)
+        velocity[bounced] *= -1
+        position = np.clip(position, low, high)
+
+
+def write_synthetic_video(filename, frames, fps=30):
+    """Write frames to a TIFF stack, or an MJPEG AVI, by file extension.
+
+    Takes:
+        filename - the file to write, ending .tif, .tiff or .avi
+        frames - iterable of uint8 grayscale frames
+        fps - frame rate of an AVI (30)
+    Gives:
+        length - the number of frames written
+    """
+    if filename.split('.')[-1].lower() in ('tif', 'tiff'):
+        return tiffstack.write_tiff_stack(filename, frames)
+    writer, length = None, 0
+    for frame in frames:
+        if writer is None:
+            height, width = frame.shape
+            writer = cv2.VideoWriter(filename, video.fourcc(*'MJPG'),
+                                     fps, (width, height), True)
+            if not writer.isOpened():
+                raise IOError("Can't write video to %s"%filename)
+        writer.write(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+        length += 1
+    if writer is not None:
+        writer.release()
+    return length
+
+
+def peak_rss():
+    """Give the peak resident memory of this process so far, in MB."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    in_bytes = platform.system() == 'Darwin'  # linux gives kilobytes
+    return peak/(1024.0**2 if in_bytes else 1024.0)
+
+
+def time_stages(filename, seg_obj, con_obj, path_obj):
+    """Time each stage of tracking a video, frame by frame, in one pass.
+
+    Takes:
+        filename - the video to track
+        seg_obj - the Segment to use
+        con_obj - the Contour to use
+        path_obj - the Path to use
+    Gives:
+        seconds - dict of the total time spent in each of STAGES, plus
+                  'background' for building the background model
+        frames - the number of frames tracked
+        detections - the number of objects detected over all frames
+        paths - the number of paths found
+    """
+    seconds = dict((stage, 0.0) for stage in STAGES)
+    tick = time.time()
+    vid = video.open_video_file(filename)
+    bkg = background.create_background_object(vid)
+    seconds['background'] = time.time()-tick
+    buffers = buffers_module.FrameBuffers()
+    path_obj.forget_paths()
+    vid.seek(0)
+    frames, detections = 0, 0
+    while True:
+        tick = time.time()
+        try:
+            frame = vid.next()
+        except StopIteration:
+            break
+        tock = time.time()
+        seconds['decode'] += tock-tick
+        img = bkg.subtract_frame(frame, frames, buffers=buffers)
+        tick = time.time()
+        seconds['subtract'] += tick-tock
+        seg_img = seg_obj.segment(img, buffers)
+        tock = time.time()
+        seconds['segment'] += tock-tick
+        found = con_obj.detect(seg_img, seg_obj.scale)
+        tick = time.time()
+        seconds['contour'] += tick-tock
+        path_obj.add_frame(found, frames)
+        seconds['path'] += time.time()-tick
+        frames += 1
+        detections += len(found)
+    tick = time.time()
+    paths = path_obj.finalize()
+    seconds['path'] += time.time()-tick
+    vid.release()
+    return seconds, frames, detections, len(paths)
+
+
+def _rates(seconds, frames):
+    """Give seconds taken, frames per second and ms per frame for a stage."""
+    return {'seconds': seconds,
+            'fps': frames/seconds if seconds > 0 else None,
+            'ms_per_frame': 1000.0*seconds/frames if frames > 0 else None}
+
+
+def _run_case(args):
+    """Make one synthetic video and benchmark it, in a worker process.
+
+    The best time of the repeats is kept for each stage, as the one least
+    disturbed by whatever else the machine was doing.
+    Takes:
+        args - tuple of the case settings dict, the directory to write the
+               video to, the number of repeats, and the Segment, Contour
+               and Path to track with
+    Gives:
+        result - dict of the case settings and its timings
+    """
+    case, work_dir, repeat, seg_obj, con_obj, path_obj = args
+    name = 'synthetic_%(width)ix%(height)i_%(length)i.%(format)s'%case
+    filename = os.path.join(work_dir, name)
+    tick = time.time()
+    write_synthetic_video(filename, synthetic_frames(
+        case['width'], case['height'], case['length'], case['blobs'],
+        case['radius'], case['speed'], case['noise'], case['seed']))
+    result = dict(case)
+    result['write_seconds'] = time.time()-tick
+    best, end_to_end = None, None
+    for attempt in range(repeat):
+        seconds, frames, detections, paths = time_stages(
+            filename, seg_obj, con_obj, path_obj)
+        if best is None:
+            best = seconds
+        else:
+            best = dict((stage, min(best[stage], seconds[stage]))
+                        for stage in best)
+        tick = time.time()
+        track.track_video(filename, seg_obj, con_obj, path_obj)
+        took = time.time()-tick
+        end_to_end = took if end_to_end is None else min(end_to_end, took)
+    result['frames'] = frames
+    result['detections'] = detections
+    result['paths'] = paths
+    result['background_seconds'] = best.pop('background')
+    result['stages'] = dict((stage, _rates(best[stage], frames))
+                            for stage in STAGES)
+    result['end_to_end'] = _rates(end_to_end, frames)
+    result['peak_rss_mb'] = peak_rss()
+    result['file_mb'] = os.path.getsize(filename)/1024.0**2
+    return result
+
+
+def _commit():
+    """Give the git commit the code is at, or None if we can't tell."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                           cwd=here, stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes=((320, 240), (640, 480)), lengths=(200,),
+                   formats=('tif', 'avi'), blobs=5, radius=8, speed=3.0,
+                   noise=0.01, seed=0, repeat=3, seg_obj=None, con_obj=None,
+                   path_obj=None, work_dir=None):
+    """Benchmark tracking on synthetic videos of every size, length and format.
+
+    Takes:
+        sizes - sequence of (width, height) to make videos at
+        lengths - sequence of video lengths, in frames
+        formats - sequence of file extensions, 'tif' and/or 'avi'
+        blobs, radius, speed, noise, seed - see synthetic_frames
+        repeat - times to time each video, the best being kept (3)
+        seg_obj - Segment to use, defaults if None (None)
+        con_obj - Contour to use, defaults if None (None)
+        path_obj - Path to use, defaults if None (None)
+        work_dir - where to keep the videos, a temporary directory which is
+                   removed afterwards if None (None)
+    Gives:
+        results - dict of the machine, versions and settings and a list
+                  of the results of each case
+    """
+    seg_obj = segment.create_segment_object() if seg_obj is None else seg_obj
+    con_obj = contour.create_contour_object() if con_obj is None else con_obj
+    path_obj = path.create_path_object() if path_obj is None else path_obj
+    remove = work_dir is None
+    work_dir = tempfile.mkdtemp(prefix='hvtrack_') if remove else work_dir
+    if not os.path.exists(work_dir):
+        os.makedirs(work_dir)
+    cases = [{'format': fmt, 'width': width, 'height': height,
+              'length': length, 'blobs': blobs, 'radius': radius,
+              'speed': speed, 'noise': noise, 'seed': seed}
+             for fmt in formats for width, height in sizes
+             for length in lengths]
+    jobs = [(case, work_dir, repeat, seg_obj, con_obj, path_obj)
+            for case in cases]
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)  # fresh per case
+    try:
+        case_results = pool.map(_run_case, jobs)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        if remove:
+            shutil.rmtree(work_dir)
+    return {'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': _commit(),
+            'machine': platform.platform(),
+            'processor': platform.processor(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'segment': _settings_of(seg_obj, track._SEGMENT_OPTIONS),
+            'contour': _settings_of(con_obj, track._CONTOUR_OPTIONS),
+            'path': _settings_of(path_obj, track._PATH_OPTIONS),
+            'cases': case_results}
+
+
+def _settings_of(obj, names):
+    """Give the settings of a Segment, Contour or Path as a dict."""
+    aliases = {'open_x': 'open_kernel_x', 'open_y': 'open_kernel_y',
+               'levels': 'pyramid_levels'}
+    return dict((name, getattr(obj, aliases.get(name, name), None))
+                for name in names)
+
+
+def _case_label(case):
+    """Give a short label naming a benchmark case."""
+    return '%(format)s %(width)ix%(height)i x%(length)i'%case
+
+
+def compare_results(before, after):
+    """Compare the speed of each stage between two sets of results.
+
+    Cases are matched up by format, size and length; those only in one
+    set are left out.
+    Takes:
+        before - results, as given by run_benchmarks, to compare against
+        after - results to compare
+    Gives:
+        rows - list of (case label, stage, fps before, fps after, speedup)
+    """
+    key = lambda case: (case['format'], case['width'], case['height'],
+                        case['length'])
+    earlier = dict((key(case), case) for case in before['cases'])
+    rows = []
+    for case in after['cases']:
+        old = earlier.get(key(case))
+        if old is None:
+            continue
+        for stage in STAGES + ('end_to_end',):
+            get = lambda res: (res['end_to_end'] if stage == 'end_to_end'
+                               else res['stages'][stage])['fps']
+            was, now = get(old), get(case)
+            speedup = now/was if was and now else None
+            rows.append((_case_label(case), stage, was, now, speedup))
+    return rows
+
+
+def _format_fps(fps):
+    """Format a frame rate for a table, blank if there isn't one."""
+    return '%10s'%('' if fps is None else '%.1f'%fps)
+
+
+def print_results(results):
+    """Print a table of the frame rate of each stage of each case."""
+    print "%-22s"%'case' + ''.join('%10s'%stage for stage in STAGES) + \
+        '%10s%10s'%('total', 'peak MB')
+    for case in results['cases']:
+        print "%-22s"%_case_label(case) + \
+            ''.join(_format_fps(case['stages'][stage]['fps'])
+                    for stage in STAGES) + \
+            _format_fps(case['end_to_end']['fps']) + \
+            _format_fps(case['peak_rss_mb'])
+
+
+def print_comparison(rows):
+    """Print a table of compare_results."""
+    print "%-22s%12s%10s%10s%10s"%('case', 'stage', 'fps was', 'fps now',
+                                   'speedup')
+    for label, stage, was, now, speedup in rows:
+        print "%-22s%12s"%(label, stage) + _format_fps(was) + \
+            _format_fps(now) + '%10s'%('' if speedup is None
+                                       else '%.2fx'%speedup)
+
+
+def parse_arguments(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Time each stage of tracking on synthetic videos.")
+    parser.add_argument('-o', '--output', default='hvtrack_benchmark.json',
+                        help="JSON file to save results to")
+    parser.add_argument('-c', '--config', help="JSON file of tracking "
+                        "options, as taken by track.py")
+    parser.add_argument('--sizes', default='320x240,640x480',
+                        help="frame sizes, as WIDTHxHEIGHT,...")
+    parser.add_argument('--lengths', default='200',
+                        help="video lengths in frames, as N,...")
+    parser.add_argument('--formats', default='tif,avi',
+                        help="video formats to write, of tif and avi")
+    parser.add_argument('--blobs', type=int, default=5)
+    parser.add_argument('--radius', type=int, default=8)
+    parser.add_argument('--speed', type=float, default=3.0)
+    parser.add_argument('--noise', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="times to time each video, keeping the best")
+    parser.add_argument('--keep', help="directory to keep the videos in")
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help="compare two results files instead")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Benchmark, or compare benchmarks, from the command line."""
+    args = parse_arguments(argv)
+    if args.compare is not None:
+        loaded = []
+        for filename in args.compare:
+            with open(filename) as results_file:
+                loaded.append(json.load(results_file))
+        print_comparison(compare_results(*loaded))
+        return
+    config = {}
+    if args.config is not None:
+        with open(args.config) as config_file:
+            config = json.load(config_file)
+    options = lambda names: dict((name, config.get(name)) for name in names)
+    results = run_benchmarks(
+        [tuple(int(v) for v in size.split('x'))
+         for size in args.sizes.split(',')],
+        [int(length) for length in args.lengths.split(',')],
+        args.formats.split(','), args.blobs, args.radius, args.speed,
+        args.noise, args.seed, args.repeat,
+        segment.Segment(**options(track._SEGMENT_OPTIONS)),
+        contour.Contour(**options(track._CONTOUR_OPTIONS)),
+        path.Path(**options(track._PATH_OPTIONS)), args.keep)
+    with open(args.output, 'w') as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+    print_results(results)
+    print "Saved results to %s"%args.output
+
+
+if __name__ == '__main__':
+    main()
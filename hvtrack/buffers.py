@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" buffers.py
+
+buffers.py keeps the frame sized arrays the pipeline works through, so that
+each is allocated when the first frame comes through and reused for every
+frame after. Stages which are handed a FrameBuffers write their results into
+it, rather than into new arrays, which means a result is only good until the
+same stage handles the next frame. Copy anything you need to keep.
+"""
+
+import numpy as np
+
+
+class FrameBuffers(object):
+    """Named arrays, made on first use and reused while they still fit."""
+    def __init__(self):
+        self._buffers = {}
+
+    def get(self, name, shape, dtype):
+        """Give the buffer of a name, remaking it if its shape or type differ.
+
+        Takes:
+            name - what the buffer is for, unique to each use
+            shape - the shape the buffer needs to be
+            dtype - the type the buffer needs to be
+        Gives:
+            buffer - an array of that shape and type, with whatever contents
+                     it was last left with
+        """
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != tuple(shape) or buf.dtype != dtype:
+            buf = np.empty(shape, dtype)
+            self._buffers[name] = buf
+        return buf
+
+    def forget(self):
+        """Drop all the buffers, say before frames change size."""
+        self._buffers = {}
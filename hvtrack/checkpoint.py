@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" checkpoint.py
+
+checkpoint.py saves, every so often, enough of the state of a tracking run
+that a run which dies part way through can carry on from where it got to
+rather than starting again from the first frame. A checkpoint holds the
+next frame to track, the live and ended paths, what the motion gate knew
+of the frames before and how much had been written out to the track store
+when it was taken. It is tied to the video, by a
+fingerprint of the file, and to the tracking settings, so that it is only
+ever resumed by a run that would have got the same results.
+"""
+
+import os
+import cPickle
+# Local imports
+import video
+import fileutil
+
+
+VERSION = 2
+
+# Types of the settings which make up a run's identity
+_SETTING_TYPES = (int, long, float, bool, basestring, tuple, type(None))
+
+
+def _settings_of(obj):
+    """Give the public, simple valued attributes of an object, sorted."""
+    return sorted((name, value) for name, value in vars(obj).items()
+                  if not name.startswith('_') and
+                  isinstance(value, _SETTING_TYPES))
+
+
+def run_settings(seg_obj, con_obj, path_obj, roi=None, compact=False,
+                 gate=None, search=None):
+    """Give the settings of a run which change the paths it finds.
+
+    Takes:
+        seg_obj - the Segment of the run
+        con_obj - the Contour of the run
+        path_obj - the Path of the run, or None to leave it out
+        roi - the roi.ROI of the run, or None (None)
+        compact - whether the video was read compactly (False)
+        gate - the gate.MotionGate of the run, or None (None)
+        search - the localsearch.LocalSearch of the run, or None (None)
+    Gives:
+        settings - a dict of the settings, equal for runs that are alike
+    """
+    region = None
+    if roi is not None:
+        polygon = None if roi.polygon is None else roi.polygon.tolist()
+        region = ((roi.left, roi.top, roi.width, roi.height), polygon)
+    return {'segment': _settings_of(seg_obj),
+            'contour': _settings_of(con_obj),
+            'path': None if path_obj is None else _settings_of(path_obj),
+            'roi': region,
+            'compact': bool(compact),
+            'gate': None if gate is None else _settings_of(gate),
+            'search': None if search is None else _settings_of(search)}
+
+
+class Checkpoint(object):
+    """Save and load the checkpoints of a run on a single video."""
+    def __init__(self, filename, video_filename, settings):
+        """Get ready to checkpoint a run.
+
+        Takes:
+            filename - the checkpoint file
+            video_filename - the video being tracked
+            settings - the run's settings, as given by run_settings
+        """
+        self.filename = filename
+        self.identity = {'video': video.file_fingerprint(video_filename),
+                         'settings': settings}
+
+    def load(self):
+        """Give the last checkpoint saved, if it is of this same run.
+
+        Gives:
+            checkpoint - dict of 'frame', the next frame to track,
+                         'path_state', as from Path.state, 'gate_state',
+                         as from MotionGate.state, 'paths_written' and
+                         'store_rows', the rows then in the track store;
+                         or None if there's no usable checkpoint
+        """
+        if not os.path.exists(self.filename):
+            return None
+        try:
+            with open(self.filename, 'rb') as checkpoint_file:
+                saved = cPickle.load(checkpoint_file)
+        except (EOFError, cPickle.UnpicklingError, ValueError):
+            return None
+        if (saved.get('version') != VERSION or
+                saved.get('identity') != self.identity):
+            return None
+        return saved
+
+    def save(self, frame, path_state, paths_written, store_rows=0,
+             gate_state=None):
+        """Save a checkpoint, replacing the last one only once it's written.
+
+        Takes:
+            frame - the next frame to be tracked
+            path_state - the Path's state, from Path.state
+            paths_written - the number of paths written out so far
+            store_rows - the number of rows in the track store so far (0)
+            gate_state - the MotionGate's state, from MotionGate.state, or
+                         None for an ungated run (None)
+        Gives:
+            None
+        """
+        saved = {'version': VERSION, 'identity': self.identity,
+                 'frame': frame, 'path_state': path_state,
+                 'paths_written': paths_written, 'store_rows': store_rows,
+                 'gate_state': gate_state}
+        temporary = self.filename+'.tmp'
+        with open(temporary, 'wb') as checkpoint_file:
+            cPickle.dump(saved, checkpoint_file, cPickle.HIGHEST_PROTOCOL)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        fileutil.replace_file(temporary, self.filename)
+
+    def remove(self):
+        """Remove the checkpoint, once the run it is of has finished."""
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
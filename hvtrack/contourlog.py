@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" contourlog.py
+
+contourlog.py keeps the contour log of a tracking run, the objects detected
+in each frame, without holding the lot in memory. Only the most recent
+frames are held; older ones are spilled to append-only files on disk and
+read back through memory maps. The log behaves like a list of Detections,
+one per frame, so it can be handed to Path.contours_to_paths as it is.
+
+On disk a log is three files sharing a base name:
+    .points - int32 (x, y) points of every contour, one after another
+    .contours - for each contour its detection record and where its
+                points start in .points and how many there are
+    .frames - for each frame the number of contours up to its end, and
+              whether the raw contours were kept or only their records
+"""
+
+import os
+import shutil
+import tempfile
+import collections
+import numpy as np
+# Local imports
+import contour
+
+
+CONTOUR_DTYPE = np.dtype([('record', contour.DETECTION_DTYPE),
+                          ('start', '<i8'), ('count', '<i8')])
+POINT_DTYPE = np.dtype('<i4')
+FRAME_DTYPE = np.dtype([('end', '<i8'), ('kept', '<i8')])
+
+
+class ContourLog(object):
+    """The detections of each frame, the older of them kept on disk."""
+    def __init__(self, filename=None, window=1000):
+        """Start an empty log.
+
+        Takes:
+            filename - base name of the files to spill to, a temporary
+                       directory, removed on close, is used if None (None)
+            window - the number of most recent frames to keep in memory
+                     (1000)
+        """
+        self._temporary = None
+        if filename is None:
+            self._temporary = tempfile.mkdtemp(prefix='hvtrack_log_')
+            filename = os.path.join(self._temporary, 'contours')
+        self.filename = filename
+        self.window = window
+        self._recent = collections.deque()  # Detections not yet spilled
+        self._spilled = 0       # frames on disk
+        self._contours = 0      # contours on disk
+        self._points = 0        # points on disk
+        self._files = dict((ext, open(filename+ext, 'wb')) for ext in
+                           ('.points', '.contours', '.frames'))
+        self._maps = {}         # memory maps of the files, by extension
+
+    def __len__(self):
+        return self._spilled + len(self._recent)
+
+    def __iter__(self):
+        for frame_ind in range(len(self)):
+            yield self[frame_ind]
+
+    def __getitem__(self, ind):
+        """Give the Detections of a frame, or a list of them for a slice."""
+        if isinstance(ind, slice):
+            return self.frames(*ind.indices(len(self))[:2])
+        if ind < 0:
+            ind += len(self)
+        if not 0 <= ind < len(self):
+            raise IndexError("Frame %i isn't in the log"%ind)
+        if ind >= self._spilled:
+            return self._recent[ind-self._spilled]
+        return self._read(ind)
+
+    def append(self, detections):
+        """Add the objects detected in the next frame.
+
+        Takes:
+            detections - a Detections, or a list of raw contours which are
+                         measured to make one
+        Gives:
+            None
+        """
+        if not isinstance(detections, contour.Detections):
+            detections = contour.Contour.measure_contours(detections)
+        self._recent.append(detections)
+        while len(self._recent) > self.window:
+            self._spill(self._recent.popleft())
+
+    def frames(self, start, stop):
+        """Give a list of the Detections of frames start to stop."""
+        return [self[frame_ind] for frame_ind in range(start, stop)]
+
+    def _spill(self, detections):
+        """Append a frame's detections to the files on disk."""
+        entries = np.zeros(len(detections), CONTOUR_DTYPE)
+        entries['record'] = detections.records
+        if detections.contours is not None:
+            counts = [len(outline) for outline in detections.contours]
+            entries['count'] = counts
+            entries['start'] = self._points + np.cumsum([0]+counts[:-1])
+            for outline in detections.contours:
+                self._files['.points'].write(
+                    np.ascontiguousarray(outline, POINT_DTYPE).tostring())
+            self._points += sum(counts)
+        else:
+            entries['start'] = self._points
+        self._files['.contours'].write(entries.tostring())
+        self._contours += len(entries)
+        self._files['.frames'].write(np.array(
+            [(self._contours, detections.contours is not None)],
+            FRAME_DTYPE).tostring())
+        self._spilled += 1
+
+    def _map(self, ext, dtype, length):
+        """Give a memory map of a file at least length long."""
+        mapped = self._maps.get(ext)
+        if mapped is None or len(mapped) < length:
+            self._files[ext].flush()
+            size = os.path.getsize(self.filename+ext)//dtype.itemsize
+            if size == 0:  # an empty file can't be mapped
+                mapped = np.zeros(0, dtype)
+            else:
+                mapped = np.memmap(self.filename+ext, dtype, 'r',
+                                   shape=(size,))
+            self._maps[ext] = mapped
+        return mapped
+
+    def _read(self, ind):
+        """Read the Detections of a spilled frame back through memory maps."""
+        frames = self._map('.frames', FRAME_DTYPE, self._spilled)
+        first = 0 if ind == 0 else frames['end'][ind-1]
+        entries = self._map('.contours', CONTOUR_DTYPE,
+                            self._contours)[first:frames['end'][ind]]
+        contours = None
+        if frames['kept'][ind]:
+            points = self._map('.points', POINT_DTYPE, 2*self._points)
+            contours = [points[2*start:2*(start+count)].reshape(-1, 1, 2)
+                        for start, count in zip(entries['start'],
+                                                entries['count'])]
+        return contour.Detections(entries['record'], contours)
+
+    def close(self):
+        """Close the files, removing them if they were temporary."""
+        for spill_file in self._files.values():
+            spill_file.close()
+        self._maps = {}
+        if self._temporary is not None:
+            shutil.rmtree(self._temporary, True)
+            self._temporary = None
@@ -0,0 +1,22 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" fileutil.py
+
+fileutil.py holds the file handling shared by the modules that write
+results out: the track store, the batch manifest, checkpoints and the
+stage cache. Each writes under a temporary name and moves the finished
+file into place, so nothing is ever found half written.
+"""
+
+import os
+
+
+def replace_file(temporary, filename):
+    """Move a finished file into place, over any older copy.
+
+    The rename replaces filename in one step; Windows won't rename over a
+    file, so there the old copy is removed first.
+    """
+    if os.name == 'nt' and os.path.exists(filename):
+        os.remove(filename)
+    os.rename(temporary, filename)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" gate.py
+
+gate.py spares segmentation and contouring the frames in which nothing
+is happening. It sits between background subtraction and segmentation and
+looks at a small, block averaged, copy of each background subtracted frame,
+which costs a fraction of thresholding and opening the full frame. Two
+measures of a static frame are offered:
+    difference - the largest absolute change of any pixel of the small copy
+                 since the last frame that was detected in; a static frame
+                 is given that frame's detections again
+    energy - the largest foreground of any pixel of the small copy; a
+             static frame is one of an empty arena and is given no
+             detections
+Taking the largest block rather than the mean over the frame keeps a single
+small mover in a large arena from being averaged away. Block averaging
+knocks down pixel noise, but the energy threshold must still be set above
+the foreground that noise leaves in an empty arena. The first frame is
+always detected in, as is any frame once max_skip static frames have gone
+by in a row.
+"""
+
+import numpy as np
+import cv2
+# Local imports
+import contour
+import instrument
+
+
+def create_gate_object():
+    """Create a motion gate with default parameters."""
+    return MotionGate()
+
+
+class MotionGate(object):
+    """Pick out the static frames which needn't be segmented."""
+    def __init__(self, threshold=None, factor=None, measure=None,
+                 max_skip=None):
+        """Initialize the values we will use to gate frames.
+
+        Takes:
+            threshold - the grey level, of the most changed block, below
+                        which a frame is static
+            factor - how many pixels across each block averaged into one
+                     pixel of the small copy is
+            measure - 'difference' or 'energy', as described above
+            max_skip - the most static frames to skip in a row, no limit
+                       if zero
+        Gives:
+            None
+        """
+        # Default values
+        self._threshold_default = 2.0
+        self._factor_default = 8
+        self._measure_default = 'difference'
+        self._max_skip_default = 0
+        # Set current values from passed values
+        default_if_none = lambda val, de: de if val is None else val
+        self.threshold = default_if_none(threshold, self._threshold_default)
+        self.factor = default_if_none(factor, self._factor_default)
+        self.measure = default_if_none(measure, self._measure_default)
+        self.max_skip = default_if_none(max_skip, self._max_skip_default)
+        if self.measure not in ('difference', 'energy'):
+            raise ValueError("Unknown measure %s"%self.measure)
+        self.reset()
+
+    def reset(self):
+        """Forget the frames seen so far, ready for a new run."""
+        self._reference = None  # small copy of the last frame detected in
+        self._previous = None   # that frame's detections
+        self._pending = None    # small copy of the frame being gated
+        self._in_a_row = 0
+        self._checked = 0
+        self._skipped = 0
+
+    def state(self):
+        """Give what the gate knows of the frames so far, to save it.
+
+        The counts are left out, being of a single run.
+        Gives:
+            state - dict of the small copy and the detections of the last
+                    frame detected in, and the static frames since
+        """
+        previous = None
+        if self._previous is not None:
+            previous = (self._previous.records, self._previous.contours)
+        return {'reference': self._reference, 'previous': previous,
+                'in_a_row': self._in_a_row}
+
+    def restore(self, state):
+        """Carry on gating from a state given by the state method."""
+        self._reference = state['reference']
+        self._previous = None
+        if state['previous'] is not None:
+            self._previous = contour.Detections(*state['previous'])
+        self._in_a_row = state['in_a_row']
+
+    def counts(self):
+        """Give the number of frames checked and how many were skipped."""
+        return self._checked, self._skipped
+
+    def add_counts(self, checked, skipped):
+        """Add counts of frames gated elsewhere, as by a worker process."""
+        self._checked += checked
+        self._skipped += skipped
+
+    def small(self, img):
+        """Give a block averaged float32 copy of a frame.
+
+        The frame is shrunk in its own type, so only the small copy is
+        made anew; integer frames have their block means rounded. OpenCV
+        can't shrink int32, the foreground of 16 bit video, so that alone
+        is converted first.
+        """
+        height, width = img.shape[:2]
+        size = (max(1, width//self.factor), max(1, height//self.factor))
+        if img.dtype == np.int32:
+            img = img.astype(np.float32)
+        return cv2.resize(img, size,
+                          interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    def change(self, small):
+        """Give a small copy's change, as the measure sees it."""
+        if self.measure == 'energy':
+            return float(small.max())
+        if self._reference is None or self._reference.shape != small.shape:
+            return float('inf')
+        return float(cv2.absdiff(small, self._reference).max())
+
+    @instrument.timed('gate.static_detections')
+    def static_detections(self, img):
+        """Give the detections of a frame if it is static, else None.
+
+        A frame that isn't static should then be detected in and its
+        detections handed to remember.
+        Takes:
+            img - the background subtracted frame
+        Gives:
+            detections - a Detections for a static frame, otherwise None
+        """
+        self._checked += 1
+        self._pending = self.small(img)
+        static = self.change(self._pending) < self.threshold
+        if self._previous is None:  # nothing detected in yet
+            static = False
+        if self.max_skip and self._in_a_row >= self.max_skip:
+            static = False
+        if not static:
+            return None
+        self._skipped += 1
+        self._in_a_row += 1
+        instrument.count('frames skipped')
+        if self.measure == 'energy':
+            return contour.Detections()
+        return self._previous
+
+    def remember(self, detections):
+        """Keep the detections of a frame that static_detections let by."""
+        self._reference = self._pending
+        self._previous = detections
+        self._in_a_row = 0
@@ -10,14 +10,20 @@ import Tkinter as tk
 import ttk
 import tkFileDialog
 import numpy as np
-from PIL import Image, ImageTk, ImageEnhance
+import cv2
+from PIL import Image, ImageTk
 import os
+import threading
+import traceback
+import Queue
 # Local imports
 import video
-import background
 import segment
 import contour
 import path
+import batch
+import contourlog
+import stagecache
 
 
 # Utility function
@@ -63,6 +69,8 @@ class SegmentFrame(ttk.Frame):
         open_x_entry = ttk.Entry(self, width=7)
         open_y_label = ttk.Label(self, text="Opening Y")
         open_y_entry = ttk.Entry(self, width=7)
+        levels_label = ttk.Label(self, text="Pyramid levels")
+        levels_entry = ttk.Entry(self, width=7)
         ## Pack widgets
         segment_label.grid(row=1, column=1, padx=5, pady=15,
                           columnspan=3, sticky=tk.W)
@@ -72,14 +80,18 @@ class SegmentFrame(ttk.Frame):
         open_x_entry.grid(row=2, column=4, padx=5, pady=5)
         open_y_label.grid(row=2, column=5, padx=5, pady=5)
         open_y_entry.grid(row=2, column=6, padx=5, pady=5)
+        levels_label.grid(row=3, column=1, padx=5, pady=5)
+        levels_entry.grid(row=3, column=2, padx=5, pady=5)
         ## Set default values
         set_entry(thresh_entry, self.segment.thresh_area)
         set_entry(open_x_entry, self.segment.open_kernel_x)
         set_entry(open_y_entry, self.segment.open_kernel_y)
+        set_entry(levels_entry, self.segment.pyramid_levels)
         ## Bind widgets
         self.thresh_entry = bind_entry(thresh_entry, self.thresh_call)
         self.open_x_entry = bind_entry(open_x_entry, self.open_x_call)
         self.open_y_entry = bind_entry(open_y_entry, self.open_y_call)
+        self.levels_entry = bind_entry(levels_entry, self.levels_call)
 
     # Set values function calls
     def thresh_call(self, *args):
@@ -91,6 +103,9 @@ class SegmentFrame(ttk.Frame):
     def open_y_call(self, *args):
         self.segment.set_open_kernal_y(self.open_y_entry.get())
 
+    def levels_call(self, *args):
+        self.segment.set_pyramid_levels(self.levels_entry.get())
+
 
 class ContourFrame(ttk.Frame):
     """Configure a contour instance."""
@@ -213,10 +228,19 @@ class PathFrame(ttk.Frame):
 
 
 class ImageFrame(ttk.Frame):
-    """Display an image."""
+    """Display an image.
+
+    Displaying is done into a single PhotoImage, through buffers which are
+    made once and reused, so that showing a frame allocates next to nothing.
+    """
     def __init__(self, parent, size=None):
         self.size = (600,480) if size is None else size
         self.contrast = 10
+        ## Display buffers, in (height, width) order
+        self._scaled = None  # resized image, made to match the image type
+        self._gray = np.zeros(self.size[::-1], np.uint8)  # as 8 bit
+        self._shown = np.zeros(self.size[::-1], np.uint8)  # contrast enhanced
+        self._tables = {}  # contrast look up tables, by image mean
         ## GUI setup
         ttk.Frame.__init__(self, parent)
         self.parent = parent
@@ -231,7 +255,7 @@ class ImageFrame(ttk.Frame):
         image_frame_label = ttk.Label(self, text="Video display")
         contrast_label = ttk.Label(self, text="Contrast enhancement")
         contrast_entry = ttk.Entry(self, width=10)
-        photo = ImageTk.PhotoImage(Image.fromarray(np.zeros(self.size).T))
+        photo = ImageTk.PhotoImage('L', self.size)
         image_label = ttk.Label(self)
         image_label.configure(image=photo)
         image_label.image = photo  # keep ref to prevent garbage collection
@@ -247,11 +271,28 @@ class ImageFrame(ttk.Frame):
         set_entry(contrast_entry, self.contrast)
         ## Bind widgets
         self.image_label = image_label
+        self.photo = photo
         self.contrast_entry = bind_entry(contrast_entry, self.contrast_call)
 
     def contrast_call(self, *args):
         """Write the entry value to the contrast variable."""
-        self.contrast = self.contrast_entry.get()
+        try:
+            self.contrast = float(self.contrast_entry.get())
+        except ValueError:
+            set_entry(self.contrast_entry, self.contrast)
+        self._tables = {}
+
+    def _contrast_table(self, mean):
+        """Give the look up table enhancing contrast about a mean intensity.
+
+        This does what PIL's ImageEnhance.Contrast does, pushing each
+        intensity away from the image mean by the contrast factor, but for
+        all 256 intensities at once. Tables are kept for reuse.
+        """
+        if mean not in self._tables:
+            levels = mean + self.contrast*(np.arange(256) - mean)
+            self._tables[mean] = np.uint8(np.clip(levels, 0, 255).round())
+        return self._tables[mean]
 
     def update_image(self, image):
         """Update the displayed image with the passed image, scaled.
@@ -262,12 +303,18 @@ class ImageFrame(ttk.Frame):
         Gives:
             None
         """
-        pil_img = Image.fromarray(image).resize(self.size).convert("L")
-        enhancer = ImageEnhance.Contrast(pil_img)
-        tk_img = ImageTk.PhotoImage(enhancer.enhance(self.contrast))
-        self.image_label.configure(image=tk_img)
-        self.image_label.image = tk_img  # prevent garbage collection
-        self.update()  # allow the frame to complete its updates
+        if self._scaled is None or self._scaled.dtype != image.dtype:
+            self._scaled = np.zeros(self.size[::-1], image.dtype)
+        cv2.resize(image, self.size, dst=self._scaled,
+                   interpolation=cv2.INTER_NEAREST)
+        if self._scaled.dtype == np.uint8:
+            gray = self._scaled
+        else:
+            gray = cv2.convertScaleAbs(self._scaled, dst=self._gray)
+        mean = int(cv2.mean(gray)[0] + 0.5)
+        cv2.LUT(gray, self._contrast_table(mean), dst=self._shown)
+        self.photo.paste(Image.frombuffer('L', self.size, self._shown,
+                                          'raw', 'L', 0, 1))
         return
 
 
@@ -277,6 +324,15 @@ class Interface(ttk.Frame):
         ## Set the GUI state
         self.filename = None
         self.directory = None
+        self.paths = None
+        self.contour_log = None  # a contourlog.ContourLog of the last file
+        self.log_window = 1000  # frames of the contour log kept in memory
+        self.cache = stagecache.StageCache()  # so re-runs skip stages
+        ## Tracking runs on a worker thread, talking to us through a queue
+        self._worker = None
+        self._messages = Queue.Queue()
+        self._cancel = threading.Event()
+        self.refresh_interval = 100  # ms between checks for news, so 10 Hz
         ## Set up links to persistent processing classes
         self.segment = segment.create_segment_object()
         self.contour = contour.create_contour_object()
@@ -311,6 +367,9 @@ class Interface(ttk.Frame):
         #Quit
         quitButton = ttk.Button(self, text="Quit", command=self.quit)
         quitButton.pack(side=tk.LEFT, padx=5, pady=5)
+        #Cancel
+        cancelButton = ttk.Button(self, text="Cancel", command=self.cancel)
+        cancelButton.pack(side=tk.LEFT, padx=5, pady=5)
         #Video
         videoLabel = ttk.Label(self.video_f, text="Video")
         fileLabel = ttk.Label(self.video_f, text="File:")
@@ -327,37 +386,120 @@ class Interface(ttk.Frame):
         dirLabel.grid(row=3, column=1, padx=5, pady=5)
         dirEntry.grid(row=3, column=2, padx=5, pady=5)
         dirButton.grid(row=3, column=3, padx=5, pady=5)
+        self.progress_label = ttk.Label(self.video_f, text="")
+        self.progress_label.grid(row=4, column=1, padx=5, pady=5,
+                                 columnspan=3, sticky=tk.W)
 
     def askOpen(self):
         """Ask for a file, then run the tracker on it"""
         fname = tkFileDialog.askopenfilename()
-        self.run_file(fname)
+        if fname:
+            self.run_file(fname)
         print fname
     
     def askDir(self):
         """Ask for a directory, then run the tracker on it"""
         dirname = tkFileDialog.askdirectory()
-        hummertracker.dir_to_traces(dirname)
+        if dirname:
+            self._start_worker(lambda: batch.process_directory(
+                dirname, self.segment, self.contour, self.path,
+                cancel=self._cancel.is_set))
         print dirname
 
+    def cancel(self):
+        """Ask the running tracker, if there is one, to stop."""
+        self._cancel.set()
+
+    def _post(self, kind, content=None):
+        """Send a message from the worker thread to the interface."""
+        self._messages.put((kind, content))
+
+    def _start_worker(self, task, *args):
+        """Run a task on a worker thread, unless one is already running.
+
+        Whether the task finished, was cancelled or failed (with its
+        traceback) is posted back to the interface when it ends.
+        """
+        if self._worker is not None and self._worker.is_alive():
+            print "Already tracking, cancel first"
+            return
+        def work():
+            try:
+                task(*args)
+                self._post('cancelled' if self._cancel.is_set() else 'done')
+            except Exception:
+                self._post('error', traceback.format_exc())
+        self._cancel.clear()
+        self._worker = threading.Thread(target=work)
+        self._worker.daemon = True
+        self._worker.start()
+        self.after(self.refresh_interval, self._poll)
+
+    def _poll(self):
+        """Act on the worker's messages, showing only the latest preview.
+
+        This runs on the Tk thread every refresh_interval while the worker
+        is busy, so the display is refreshed at that rate at most, and any
+        previews which arrived in between are dropped.
+        """
+        preview, progress = None, None
+        while True:
+            try:
+                kind, content = self._messages.get_nowait()
+            except Queue.Empty:
+                break
+            if kind == 'preview':
+                preview = content
+            elif kind == 'progress':
+                progress = content
+            elif kind == 'done':
+                progress = "Done"
+            elif kind == 'cancelled':
+                progress = "Cancelled"
+            elif kind == 'error':
+                print content
+                progress = "Failed, see console"
+        if preview is not None:
+            shape, detections = preview
+            self.image_f.update_image(
+                self.contour.image_from_detections(detections, shape))
+        if progress is not None:
+            self.progress_label.configure(text=progress)
+        if self._worker.is_alive() or not self._messages.empty():
+            self.after(self.refresh_interval, self._poll)
+
     def run_file(self, filename):
-        """Take a passed filename, and get process it."""
+        """Take a passed filename, and start processing it in the background.
+
+        The paths found end up in self.paths once tracking is done, and
+        the objects found in each frame in self.contour_log. Stages whose
+        settings haven't changed since a file was last tracked are read
+        from self.cache rather than worked out again.
+        """
+        self.filename = filename
+        self._start_worker(self._track_file, filename)
+
+    def _track_file(self, filename):
+        """Track a file, posting progress and previews. Runs on the worker."""
         vid = video.open_video_file(filename)
-        bkg = background.create_background_object(vid)
-        # For testing
-        self.image_f.update_image(bkg.subtract_background(100))
-        print "updated?"
-        # End for testing
-        contour_log = []
-        for img in bkg.subtracted_frames():
-            #self.image_f.update_image(img)
-            seg = self.segment.segment(img)
-            con = self.contour.contour_and_filter(seg)
-            self.image_f.update_image(self.contour.image_from_contours(
-                                                        con, img.shape))
-            contour_log.append(con)
-            paths = self.path.contours_to_paths(contour_log)
-        return paths
+        length = int(vid.length)
+        vid.release()
+        if self.contour_log is not None:
+            self.contour_log.close()
+        self.contour_log = contourlog.ContourLog(window=self.log_window)
+        self.path.forget_paths()
+        frames = stagecache.cached_detect_frames(self.cache, filename,
+                                                 self.segment, self.contour)
+        for frame_ind, shape, con in frames:
+            if self._cancel.is_set():
+                frames.close()
+                return None
+            self.contour_log.append(con)
+            self.path.add_frame(con, frame_ind)
+            self._post('preview', (shape, con))
+            self._post('progress', "Frame %i of %i"%(frame_ind+1, length))
+        self.paths = self.path.finalize()
+        return self.paths
 
 
 def main():
@@ -365,6 +507,8 @@ def main():
     #root.geometry("350x100+300+300")
     app = Interface(root)
     root.mainloop()  
+    if app.contour_log is not None:
+        app.contour_log.close()  # removing its spilled frames
 
 
 if __name__ == '__main__':
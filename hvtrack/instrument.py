@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" instrument.py
+
+instrument.py times the stages of tracking and counts what they get up to,
+so that a slow run can be pinned on decoding, background subtraction,
+segmentation, contouring or path matching. The stages are wrapped with
+timed, and call count or observe for things like the number of contours
+found, both of which do nothing more than check a flag until enable is
+called. Once enabled, each call to a stage has its latency put into a
+histogram with logarithmic bins, and each stage call can also be kept as
+an event for a Chrome trace (load it at chrome://tracing).
+
+Only the process enable is called in is recorded, so with detection done
+in worker processes it is just the path matching that shows up.
+"""
+
+import os
+import math
+import json
+import time
+import threading
+import functools
+
+
+BINS_PER_OCTAVE = 4  # histogram bins per doubling of value
+
+enabled = False  # whether anything is being recorded, see enable
+_tracing = False
+_lock = threading.Lock()
+_origin = time.time()
+_timings = {}   # stage name -> Histogram of seconds
+_counters = {}  # counter name -> total
+_values = {}    # value name -> Histogram of observed values
+_events = []    # trace events, if tracing
+
+
+class Histogram(object):
+    """Count values into logarithmically spaced bins, keeping a summary.
+
+    Bins are a quarter of a doubling wide, so a percentile read from them is
+    at most a fifth above the true value.
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.bins = {}  # bin index -> count, None holding zeros and below
+
+    @staticmethod
+    def _bin(value):
+        """Give the index of the bin a value falls in."""
+        if value <= 0:
+            return None
+        return int(math.ceil(math.log(value, 2)*BINS_PER_OCTAVE))
+
+    @staticmethod
+    def upper_edge(index):
+        """Give the largest value which falls in a bin."""
+        return 0.0 if index is None else 2**(float(index)/BINS_PER_OCTAVE)
+
+    def add(self, value):
+        """Count a value."""
+        self.count += 1
+        self.total += value
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+        index = self._bin(value)
+        self.bins[index] = self.bins.get(index, 0) + 1
+
+    def _sorted_bins(self):
+        """Give (index, count) of each bin in order of value."""
+        return sorted(self.bins.items(),
+                      key=lambda item: -1e9 if item[0] is None else item[0])
+
+    def percentile(self, percent):
+        """Give the upper edge of the bin holding a percentile."""
+        if self.count == 0:
+            return None
+        needed, seen = percent/100.0*self.count, 0
+        for index, count in self._sorted_bins():
+            seen += count
+            if seen >= needed:
+                return min(self.upper_edge(index), self.maximum)
+        return self.maximum
+
+    def summary(self, scale=1.0):
+        """Give a dict summing up the histogram, with values times scale.
+
+        Takes:
+            scale - multiplier for the values given, 1000 for seconds to
+                    milliseconds say (1.0)
+        Gives:
+            summary - dict of count, total, mean, min, max, p50, p90 and p99
+                      along with the bins as [upper edge, count] pairs
+        """
+        scaled = lambda value: None if value is None else value*scale
+        return {'count': self.count,
+                'total': scaled(self.total),
+                'mean': scaled(self.total/self.count) if self.count else None,
+                'min': scaled(self.minimum),
+                'max': scaled(self.maximum),
+                'p50': scaled(self.percentile(50)),
+                'p90': scaled(self.percentile(90)),
+                'p99': scaled(self.percentile(99)),
+                'bins': [[scaled(self.upper_edge(index)), count]
+                         for index, count in self._sorted_bins()]}
+
+
+def enable(trace=False):
+    """Start recording, forgetting anything recorded before.
+
+    Takes:
+        trace - whether to keep every stage call as a trace event as well,
+                which costs memory in proportion to the length of the run
+    """
+    global enabled, _tracing
+    reset()
+    _tracing = trace
+    enabled = True
+
+
+def disable():
+    """Stop recording, keeping what was recorded."""
+    global enabled, _tracing
+    enabled, _tracing = False, False
+
+
+def reset():
+    """Forget everything recorded so far."""
+    global _origin
+    with _lock:
+        _origin = time.time()
+        _timings.clear()
+        _counters.clear()
+        _values.clear()
+        del _events[:]
+
+
+def _event(name, phase, start, **fields):
+    """Keep a trace event, taking the lock is left to the caller."""
+    event = {'name': name, 'ph': phase, 'ts': (start-_origin)*1e6,
+             'pid': os.getpid(), 'tid': threading.current_thread().ident}
+    event.update(fields)
+    _events.append(event)
+
+
+def timed(name):
+    """Decorate a function so each call to it is timed as a stage, by name.
+
+    When recording is off this costs one check of a flag per call.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def timed_call(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                took = time.time()-start
+                with _lock:
+                    _timings.setdefault(name, Histogram()).add(took)
+                    if _tracing:
+                        _event(name, 'X', start, dur=took*1e6)
+        return timed_call
+    return decorate
+
+
+def count(name, number=1):
+    """Add number to a named counter, if recording."""
+    if not enabled:
+        return
+    with _lock:
+        total = _counters.get(name, 0) + number
+        _counters[name] = total
+        if _tracing:
+            _event(name, 'C', time.time(), args={name: total})
+
+
+def observe(name, value):
+    """Put a value, such as the number of live paths, into a histogram."""
+    if not enabled:
+        return
+    with _lock:
+        _values.setdefault(name, Histogram()).add(value)
+        if _tracing:
+            _event(name, 'C', time.time(), args={name: value})
+
+
+def summary():
+    """Give a dict of stage latencies in ms, counters and observed values."""
+    with _lock:
+        return {'seconds_recorded': time.time()-_origin,
+                'stages_ms': dict((name, hist.summary(1000.0))
+                                  for name, hist in _timings.items()),
+                'counters': dict(_counters),
+                'values': dict((name, hist.summary())
+                               for name, hist in _values.items())}
+
+
+def save_summary(filename):
+    """Write the summary out as JSON."""
+    with open(filename, 'w') as summary_file:
+        json.dump(summary(), summary_file, indent=2, sort_keys=True)
+
+
+def save_trace(filename):
+    """Write the trace events out in the Chrome trace event format."""
+    with _lock:
+        events = list(_events)
+    with open(filename, 'w') as trace_file:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'},
+                  trace_file)
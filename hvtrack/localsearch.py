@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" localsearch.py
+
+localsearch.py spares segmentation and contouring the parts of a frame far
+from any animal already being tracked. Each live path's next position is
+predicted from its last two centers, by Path.predicted_centers, and only a
+window around each prediction is segmented and contoured, overlapping
+windows being merged into one. A window spans the object's last box and
+its predicted box, and reaches past both by as far again as the object last
+moved, so an animal that stops, turns back or speeds up is still found;
+a path of one point, whose motion isn't known yet, is searched for as far
+as the Path would match it. Windows reach further again, by the margin, to
+give the adaptive threshold and opening the surroundings they look at.
+Objects cut by the edge of a window are left out, as their measurements
+would be wrong. Once the windows would cover more than max_fraction of the
+frame, the frame is searched in full instead, as windows would save little.
+
+New animals only turn up in a full frame search, so the whole frame is
+searched every redetect_every frames, whenever there are no live paths and
+whenever a window search leaves a live path of at least established points
+without a match, that is, when a track is lost. Younger paths are mostly
+speckle, which is lost all the time and shouldn't cost a full search.
+"""
+
+import numpy as np
+import cv2
+# Local imports
+import contour
+import instrument
+
+
+def create_search_object():
+    """Create a local search with default parameters."""
+    return LocalSearch()
+
+
+class LocalSearch(object):
+    """Detect objects only in windows around where paths are expected."""
+    def __init__(self, redetect_every=None, margin=None, established=None,
+                 max_fraction=None):
+        """Initialize the values we will use to search.
+
+        Takes:
+            redetect_every - frames between full frame searches, counted
+                             from the first frame of the video
+            margin - pixels searched past the reach of an object's box and
+                     motion, the reach of segmentation if None
+            established - points a path needs before losing it calls for
+                          a full frame search
+            max_fraction - the most of a frame the windows may cover before
+                           the frame is searched in full instead
+        Gives:
+            None
+        """
+        # Default values
+        self._redetect_every_default = 50
+        self._established_default = 3
+        self._max_fraction_default = 0.5
+        # Set current values from passed values
+        default_if_none = lambda val, de: de if val is None else val
+        self.redetect_every = default_if_none(redetect_every,
+                                              self._redetect_every_default)
+        self.margin = margin
+        self.established = default_if_none(established,
+                                           self._established_default)
+        self.max_fraction = default_if_none(max_fraction,
+                                            self._max_fraction_default)
+        self.reset()
+
+    def reset(self):
+        """Forget the counts so far, ready for a new run."""
+        self._frames = 0
+        self._full = 0
+        self._searched = 0  # pixels searched
+        self._pixels = 0    # pixels in the frames searched
+
+    def counts(self):
+        """Give the frames searched, how many in full, and the pixels.
+
+        Gives:
+            frames - the number of frames searched
+            full - how many of those were searched in full
+            searched - the number of pixels segmented, over all frames
+            pixels - the number of pixels in all frames searched
+        """
+        return self._frames, self._full, self._searched, self._pixels
+
+    def _margin(self, seg_obj):
+        """Give the pixels to search past each object's box and motion."""
+        if self.margin is not None:
+            return self.margin
+        return int(seg_obj.thresh_area)//2 + max(seg_obj.open_kernel_x,
+                                                  seg_obj.open_kernel_y)
+
+    @staticmethod
+    def _motion(path_obj, path, frame_ind):
+        """Give how far a path's object may have moved by a frame.
+
+        That is its last step, per frame, times the frames since; the
+        Path's near for a path without a step to go on.
+        """
+        last_time = path[-1][0]
+        if len(path) < 2 or path[-2][0] == last_time:
+            return float(path_obj.near)
+        last = path_obj._center(path[-1][1])
+        prior = path_obj._center(path[-2][1])
+        step = (np.hypot(last[0]-prior[0], last[1]-prior[1]) /
+                (last_time-path[-2][0]))
+        return step*max(1, frame_ind-last_time)
+
+    @staticmethod
+    def _box(found):
+        """Give the width and height of a detection record or contour."""
+        if isinstance(found, np.void):
+            return found['width'], found['height']
+        return cv2.boundingRect(found)[2:]
+
+    @staticmethod
+    def merge_windows(windows):
+        """Merge overlapping windows until none overlap.
+
+        Takes:
+            windows - list of (left, top, right, bottom) windows
+        Gives:
+            windows - list of windows, each the bounds of those merged
+        """
+        windows = list(windows)
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(windows)):
+                for j in range(i+1, len(windows)):
+                    a, b = windows[i], windows[j]
+                    if (a[0] < b[2] and b[0] < a[2] and
+                            a[1] < b[3] and b[1] < a[3]):
+                        windows[i] = (min(a[0], b[0]), min(a[1], b[1]),
+                                      max(a[2], b[2]), max(a[3], b[3]))
+                        del windows[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return windows
+
+    def windows(self, path_obj, frame_ind, shape, margin, scale=1):
+        """Give the windows to search for each live path in a frame.
+
+        Takes:
+            path_obj - the Path being tracked into
+            frame_ind - the frame to be searched
+            shape - the frame's shape
+            margin - pixels to search past each object's box and motion
+            scale - the Segment's scale, which window corners are put on
+                    multiples of so shrinking lines up with the full frame
+        Gives:
+            windows - list of (left, top, right, bottom) windows, merged and
+                      within the frame
+        """
+        height, width = shape[:2]
+        windows = []
+        for path, center in zip(path_obj.active_paths(),
+                                path_obj.predicted_centers(frame_ind)):
+            last = path_obj._center(path[-1][1])
+            box_width, box_height = self._box(path[-1][1])
+            motion = self._motion(path_obj, path, frame_ind)
+            reach_x = box_width/2.0 + motion + margin
+            reach_y = box_height/2.0 + motion + margin
+            round_up = lambda val: -(-int(np.ceil(val))//scale)*scale
+            left = max(0, int(min(last[0], center[0])-reach_x)//scale*scale)
+            top = max(0, int(min(last[1], center[1])-reach_y)//scale*scale)
+            right = min(width, round_up(max(last[0], center[0])+reach_x))
+            bottom = min(height, round_up(max(last[1], center[1])+reach_y))
+            if right > left and bottom > top:
+                windows.append((left, top, right, bottom))
+        return self.merge_windows(windows)
+
+    @staticmethod
+    def _detect_in_window(img, window, seg_obj, con_obj):
+        """Detect the whole objects in a window, in full frame coordinates."""
+        left, top, right, bottom = window
+        crop = np.ascontiguousarray(img[top:bottom, left:right])
+        found = con_obj.detect(seg_obj.segment(crop), seg_obj.scale)
+        if seg_obj.refine and seg_obj.scale > 1:
+            con_obj.refine_centers(found, crop)
+        records = found.records
+        height, width = img.shape[:2]
+        whole = np.ones(len(records), bool)
+        if left > 0:
+            whole &= records['left'] > 0
+        if top > 0:
+            whole &= records['top'] > 0
+        if right < width:
+            whole &= records['left']+records['width'] < right-left
+        if bottom < height:
+            whole &= records['top']+records['height'] < bottom-top
+        found = found.select(whole)
+        found.records['x'] += left
+        found.records['y'] += top
+        found.records['left'] += left
+        found.records['top'] += top
+        if found.contours is not None:
+            found.contours = [outline + (left, top)
+                              for outline in found.contours]
+        return found
+
+    def _lost(self, path_obj, found):
+        """True if an established path has no detection near enough."""
+        for path in path_obj.active_paths():
+            if len(path) < self.established:
+                continue
+            end = path_obj._center(path[-1][1])
+            distances = np.hypot(found.records['x']-end[0],
+                                 found.records['y']-end[1])
+            if not (distances < path_obj.near).any():
+                return True
+        return False
+
+    @instrument.timed('localsearch.search')
+    def search(self, img, seg_obj, con_obj, path_obj, frame_ind):
+        """Detect objects in windows about the live paths of a frame.
+
+        Takes:
+            img - the background subtracted frame
+            seg_obj - the Segment to segment each window with
+            con_obj - the Contour to detect objects in each window with
+            path_obj - the Path being tracked into, up to the frame before
+            frame_ind - the frame number
+        Gives:
+            detections - a Detections of the objects found in the windows,
+                         or None when the whole frame should be searched
+        """
+        self._frames += 1
+        self._pixels += img.shape[0]*img.shape[1]
+        full = (len(path_obj.active_paths()) == 0 or
+                (self.redetect_every > 0 and
+                 frame_ind % self.redetect_every == 0))
+        found = None
+        if not full:
+            windows = self.windows(path_obj, frame_ind, img.shape,
+                                   self._margin(seg_obj), seg_obj.scale)
+            area = sum((right-left)*(bottom-top) for
+                       left, top, right, bottom in windows)
+            # None left, as every path has left the frame, or so many that
+            # the full frame costs little more
+            full = (len(windows) == 0 or
+                    area > self.max_fraction*img.shape[0]*img.shape[1])
+        if not full:
+            by_window = [self._detect_in_window(img, window, seg_obj,
+                                                con_obj)
+                         for window in windows]
+            self._searched += area
+            contours = None
+            if all(one.contours is not None for one in by_window):
+                contours = [outline for one in by_window
+                            for outline in one.contours]
+            found = contour.Detections(
+                np.concatenate([one.records for one in by_window]),
+                contours)
+            full = self._lost(path_obj, found)
+        if full:
+            self._full += 1
+            self._searched += img.shape[0]*img.shape[1]
+            instrument.count('full frame searches')
+            return None
+        return found
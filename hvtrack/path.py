@@ -9,6 +9,13 @@ object, creating its path.
 
 import cv2
 import numpy as np
+# Local imports
+import instrument
+import trackstore
+
+
+# Antialiased lines, named as in OpenCV 3 on, or as in 2.4
+_LINE_AA = getattr(cv2, 'LINE_AA', getattr(cv2, 'CV_AA', None))
 
 
 def create_path_object():
@@ -16,6 +23,57 @@ def create_path_object():
     return Path()
 
 
+class _EndpointGrid(object):
+    """Bucket the end points of live paths into square cells.
+
+    With cells as wide as the nearness radius, any end point within that
+    radius of a contour lies in the contour's cell or one of its eight
+    neighbours, so finding a home for a contour only looks at paths which
+    end nearby rather than at every live path.
+    """
+    def __init__(self, cell):
+        """Start with an empty grid of cells, cell pixels on a side."""
+        self.cell = cell
+        self._cells = {}  # cell index -> {id(path): path}
+        self._ends = {}   # id(path) -> (cell index, end point)
+
+    def _index(self, point):
+        """Give the index of the cell holding a point."""
+        return (int(point[0]//self.cell), int(point[1]//self.cell))
+
+    def move(self, path, point):
+        """Record (or update) the end point of a path."""
+        self.remove(path)
+        index = self._index(point)
+        self._cells.setdefault(index, {})[id(path)] = path
+        self._ends[id(path)] = (index, point)
+
+    def remove(self, path):
+        """Forget a path, if we know about it."""
+        entry = self._ends.pop(id(path), None)
+        if entry is not None:
+            bucket = self._cells[entry[0]]
+            del bucket[id(path)]
+            if len(bucket) == 0:
+                del self._cells[entry[0]]
+
+    def nearest(self, point, radius):
+        """Give the path ending closest to point within radius, or None."""
+        closest, closest_distance = None, radius
+        compared = 0
+        i, j = self._index(point)
+        for ci in (i-1, i, i+1):
+            for cj in (j-1, j, j+1):
+                for path in self._cells.get((ci, cj), {}).itervalues():
+                    end = self._ends[id(path)][1]
+                    distance = np.hypot(point[0]-end[0], point[1]-end[1])
+                    compared += 1
+                    if distance < closest_distance:
+                        closest, closest_distance = path, distance
+        instrument.count('candidate comparisons', compared)
+        return closest
+
+
 class Path(object):
     """Match contour center points over frames, making a path.
     The basic order:
@@ -29,6 +87,13 @@ class Path(object):
     Contours fed in should be a list of contours at each time point (frame)
     Each path produced is in the format [[frame num, contour], [frame num,
     contour], ... ]
+    Detection records from Contour.detect can be fed in place of contours,
+    in which case their precomputed centers are used.
+    If frames were cropped to a region of interest, set offset to the
+    region's offset and saved or drawn paths are put back in full frame
+    coordinates.
+    Contours can be fed in all at once with contours_to_paths, or a frame at
+    a time with add_frame followed by finalize once the video is done.
     """
     def __init__(self, near=None, min_length=None):
         """Initialize the values needed for path tracking.
@@ -48,8 +113,11 @@ class Path(object):
         self.near = default_if_none(near, self.near_default)
         self.min_length = default_if_none(min_length, self.min_length_default)
         # Initialize path storages
+        self.offset = (0, 0)  # where cropped frames sit in the full frame
         self.paths = []
         self.dead_paths = []
+        self._time = 0  # the next frame number expected by add_frame
+        self._grid = None  # live path end points, built when first needed
 
     @staticmethod
     def _passed_to_int(passed):
@@ -74,39 +142,72 @@ class Path(object):
         """Set the minimum length we'll accept for a path."""
         self.min_length = self._passed_to_int(length)
 
+    def set_offset(self, offset):
+        """Set the full frame position of the origin of cropped frames."""
+        self.offset = (0, 0) if offset is None else tuple(offset)
+
     def forget_paths(self):
         """Forget current traces to prepare for a new video."""
         self.paths = []
         self.dead_paths = []
+        self._time = 0
+        self._grid = None
+
+    @staticmethod
+    def _pack_path(path):
+        """Give a path as an array of frames and an array of its records.
+
+        Paths of raw contours keep them as a list rather than an array.
+        """
+        times = np.array([time for time, _ in path], np.int64)
+        contours = [contour for _, contour in path]
+        if isinstance(contours[0], np.void):
+            contours = np.array(contours, contours[0].dtype)
+        return times, contours
+
+    def state(self):
+        """Give the tracking state, compactly, so it can be saved and restored.
+
+        The paths keep their detection records, or contours, but not the
+        grid of end points, which is rebuilt when tracking carries on.
+        Takes:
+            Nothing
+        Gives:
+            state - dict of the next frame expected, and the live and
+                    ended paths, each as a tuple of arrays
+        """
+        return {'time': self._time,
+                'offset': self.offset,
+                'paths': [self._pack_path(path) for path in self.paths],
+                'dead_paths': [self._pack_path(path)
+                               for path in self.dead_paths]}
+
+    def restore(self, state):
+        """Carry on tracking from a state given by the state method."""
+        unpack = lambda packed: [[int(time), contour]
+                                 for time, contour in zip(*packed)]
+        self.paths = [unpack(packed) for packed in state['paths']]
+        self.dead_paths = [unpack(packed) for packed in state['dead_paths']]
+        self.offset = tuple(state['offset'])
+        self._time = state['time']
+        self._grid = None
+
+    def _full_frame_center(self, contour):
+        """Return the center of a contour in full frame coordinates."""
+        center = self._center(contour)
+        return (center[0]+self.offset[0], center[1]+self.offset[1])
 
     @staticmethod
     def _center(contour):
-        """Return the center of a single contour."""
+        """Return the center of a single contour or detection record."""
+        if isinstance(contour, np.void):  # a detection record, already known
+            return contour['x'], contour['y']
         cm = cv2.moments(contour)
         if cm['m00'] == 0:  # occurs with tiny contours
             return contour.mean(0).flatten()
         center = (cm['m10']/cm['m00'], cm['m01']/cm['m00'])
         return center
 
-    def _nearby(self, path, contour):
-        """True if a contour is nearby the end point of a current path.
-
-        Takes:
-            path - a path to check the last point of for nearness
-            contour - the contour to check against the path
-        Gives:
-            close - True if the contour is closer to the last point than
-                    self.near, False otherwise
-        """
-        c_cent = self._center(contour)
-        p_cent = self._center(path[-1][1])
-        distance = np.hypot(c_cent[0]-p_cent[0], c_cent[1]-p_cent[1])
-        close = distance < self.near
-        if close:
-            return True
-        else:
-            return False
-
     def _sacrifice_dead_paths(self, time):
         """Kill off the old ones, paths for the path god.
 
@@ -117,20 +218,39 @@ class Path(object):
         Gives:
             None
         """
-        for i in range(len(self.paths)):
-            path = self.paths.pop(0)
+        live = []
+        for path in self.paths:
             if path[-1][0]+1 < time:
                 self.dead_paths.append(path)
+                if self._grid is not None:
+                    self._grid.remove(path)
             else:
-                self.paths.append(path)
+                live.append(path)
+        self.paths = live
         return
 
+    def _endpoint_grid(self):
+        """Give the grid of live path end points, (re)building it if needed.
+
+        The grid is rebuilt if the nearness has changed since it was made.
+        Gives None if nearness isn't set, as then nothing is ever near.
+        """
+        if not self.near or self.near <= 0:
+            return None
+        if self._grid is None or self._grid.cell != self.near:
+            self._grid = _EndpointGrid(self.near)
+            for path in self.paths:
+                self._grid.move(path, self._center(path[-1][1]))
+        return self._grid
+
     def _find_a_contour_a_home(self, contour, time):
         """Contours gotta live somewhere: in an existing path or in a new one.
 
         Check if a contour is a good fit to be appended to the ends of any of
-        the existing paths. If it is, append it, if it isn't create a new path
-        for it to sit in.
+        the existing paths. If it is, append it to the path whose end is
+        closest, if it isn't create a new path for it to sit in. Candidate
+        paths are found through a grid of path end points, so only those
+        ending nearby are compared.
 
         Note: We're deliberately not checking to see if a path has already had
         something appended to it this time step. This means that if a speckle
@@ -143,16 +263,16 @@ class Path(object):
         Gives:
             None
         """
-        for i in range(len(self.paths)):
-            path = self.paths.pop(0)
-            if self._nearby(path, contour):
-                path.append([time, contour])
-                self.paths.append(path)
-                break
-            else:
-                self.paths.append(path)
+        center = self._center(contour)
+        grid = self._endpoint_grid()
+        path = None if grid is None else grid.nearest(center, self.near)
+        if path is not None:
+            path.append([time, contour])
         else:
-            self.paths.append([[time, contour]])
+            path = [[time, contour]]
+            self.paths.append(path)
+        if grid is not None:
+            grid.move(path, center)
         return
 
     def path_meets_filters(self, path):
@@ -162,6 +282,87 @@ class Path(object):
         """
         return len(path) >= self.min_length
 
+    @instrument.timed('path.add_frame')
+    def add_frame(self, contours, time=None):
+        """Track the contours found in a single frame.
+
+        The cost of this depends only on the number of current contours and
+        live paths, not on how many frames have gone before.
+        Takes:
+            contours - list of contours found in the frame
+            time - the frame number, the one after the last added if None
+        Gives:
+            None
+        """
+        if time is None:
+            time = self._time
+        self._sacrifice_dead_paths(time)
+        for contour in contours:
+            self._find_a_contour_a_home(contour, time)
+        self._time = time + 1
+        instrument.observe('live paths', len(self.paths))
+        return
+
+    def active_paths(self):
+        """Give the paths that are still being added to."""
+        return self.paths
+
+    def predicted_centers(self, time=None):
+        """Give where each live path is expected to be at a frame.
+
+        The last two points of a path give its velocity, which is carried on
+        in a straight line; a path of a single point, or whose last two
+        points are of the same frame, is expected to stay put.
+        Takes:
+            time - the frame to predict for, the next expected if None
+        Gives:
+            centers - list of the (x, y) expected of each of active_paths,
+                      in the coordinates of the frames fed in
+        """
+        if time is None:
+            time = self._time
+        centers = []
+        for path in self.paths:
+            last_time, last = path[-1][0], self._center(path[-1][1])
+            if len(path) < 2 or path[-2][0] == last_time:
+                centers.append((last[0], last[1]))
+                continue
+            prior_time, prior = path[-2][0], self._center(path[-2][1])
+            ahead = float(time-last_time)/(last_time-prior_time)
+            centers.append((last[0] + ahead*(last[0]-prior[0]),
+                            last[1] + ahead*(last[1]-prior[1])))
+        return centers
+
+    def finished_paths(self):
+        """Give the paths that have ended so far, unfiltered."""
+        return self.dead_paths
+
+    def pop_finished_paths(self):
+        """Give, and forget, the paths that have ended so far and meet filters.
+
+        Use this to write paths out as they end, so that they needn't be
+        kept in memory. Paths given here won't be given again by finalize.
+        """
+        finished = filter(self.path_meets_filters, self.dead_paths)
+        self.dead_paths = []
+        return finished
+
+    def finalize(self):
+        """End all live paths and filter the lot.
+
+        Call this once the last frame has been added.
+        Takes:
+            Nothing
+        Gives:
+            dead_paths: a list of all the completed paths that meet filters
+        """
+        for path in self.paths:
+            self.dead_paths.append(path)
+        self.paths = []
+        self._grid = None
+        self.dead_paths = filter(self.path_meets_filters, self.dead_paths)
+        return self.dead_paths
+
     def contours_to_paths(self, contour_log):
         """Parse a contour log into paths.
 
@@ -174,15 +375,9 @@ class Path(object):
         Give:
             dead_paths: a list of all the completed paths
         """
-        for time in range(len(contour_log)):
-            current_contours = contour_log[time]
-            self._sacrifice_dead_paths(time)
-            for contour in current_contours:
-                self._find_a_contour_a_home(contour, time)
-        for path in self.paths:
-            self.dead_paths.append(path)
-        self.dead_paths = filter(self.path_meets_filters, self.dead_paths)
-        return self.dead_paths
+        for time, current_contours in enumerate(contour_log):
+            self.add_frame(current_contours, time)
+        return self.finalize()
 
     def image_from_paths(self, paths, img_size):
         """Draw path centers onto a blank image.
@@ -198,12 +393,41 @@ class Path(object):
         img = np.zeros(img_size)
         rndint = lambda flt: int(round(flt))
         for path in paths:
-            centers = [tuple(map(rndint, self._center(c[1]))) for c in path]   
+            centers = [tuple(map(rndint, self._full_frame_center(c[1])))
+                       for c in path]   
             for ind in range(len(centers)-1):
                 cv2.line(img, centers[ind], centers[ind+1], 
-                         (128,128,128), 2, cv2.CV_AA)
+                         (128,128,128), 2, _LINE_AA)
         return img
         
+    def path_table(self, path):
+        """Tabulate a path's frames, centers, areas and perimeters.
+
+        Each contour's moments are found just once, giving both its center
+        and its area; detection records have all of these already.
+        Takes:
+            path - the path to tabulate
+        Gives:
+            rows - array of trackstore.TRACK_DTYPE, a row for each point of
+                   the path in full frame coordinates, path_id left at 0
+        """
+        rows = np.zeros(len(path), trackstore.TRACK_DTYPE)
+        for row, (time, contour) in zip(rows, path):
+            row['frame'] = time
+            if isinstance(contour, np.void):  # a detection record
+                x, y = contour['x'], contour['y']
+                row['area'], row['perim'] = contour['area'], contour['perim']
+            else:
+                cm = cv2.moments(contour)
+                if cm['m00'] == 0:  # occurs with tiny contours
+                    x, y = contour.mean(0).flatten()
+                else:
+                    x, y = cm['m10']/cm['m00'], cm['m01']/cm['m00']
+                row['area'] = abs(cm['m00'])
+                row['perim'] = cv2.arcLength(contour, True)
+            row['x'], row['y'] = x+self.offset[0], y+self.offset[1]
+        return rows
+
     def save_path_centers(self, filename, path):
         """Write a path out as an array of frame numbers and center points.
 
@@ -215,7 +439,4 @@ class Path(object):
         Gives:
             None
         """
-        time_and_center = lambda c: (c[0], self._center(c[1])[0],
-                                     self._center(c[1])[1])
-        centers = np.array([time_and_center(c) for c in path])
-        np.savetxt(filename, centers, '%.8e', ',')
+        trackstore.write_path_csv(filename, self.path_table(path))
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" roi.py
+
+roi.py describes the region of interest within video frames, the part of the
+sensor the arena actually fills. Frames are cropped to the region's bounding
+rectangle straight after decoding, so every later stage works on fewer
+pixels, and an optional polygon masks out whatever else lies within that
+rectangle. Points found in the cropped frames are mapped back to full frame
+coordinates with the region's offset.
+"""
+
+import numpy as np
+import cv2
+
+
+def parse_roi(rect=None, polygon=None):
+    """Create a region from comma separated strings or sequences of numbers.
+
+    Takes:
+        rect - "left,top,width,height", or None
+        polygon - "x1,y1,x2,y2,...", or [[x1, y1], [x2, y2], ...], or None
+    Gives:
+        roi - an ROI, or None if neither was given
+    """
+    to_numbers = lambda val: [int(round(float(num))) for num in
+                              (val.split(',') if isinstance(val, basestring)
+                               else np.ravel(val))]
+    if rect is None and polygon is None:
+        return None
+    if rect is not None:
+        rect = to_numbers(rect)
+    if polygon is not None:
+        polygon = np.reshape(to_numbers(polygon), (-1, 2))
+    return ROI(rect, polygon)
+
+
+class ROI(object):
+    """A rectangular, or polygonal, region of interest in video frames."""
+    def __init__(self, rect=None, polygon=None):
+        """Remember the region.
+
+        Takes:
+            rect - (left, top, width, height) of the region, in pixels of the
+                   full frame; the polygon's bounding box if None (None)
+            polygon - sequence of (x, y) full frame points outlining the
+                      region, None to use the whole rectangle (None)
+        """
+        if rect is None and polygon is None:
+            raise ValueError("A region needs a rectangle or a polygon")
+        if polygon is not None:
+            polygon = np.array(polygon, np.int32).reshape(-1, 2)
+            if rect is None:
+                rect = cv2.boundingRect(polygon.reshape(-1, 1, 2))
+        self.left, self.top, self.width, self.height = [int(v) for v in rect]
+        if self.width <= 0 or self.height <= 0:
+            raise ValueError("A region needs a positive width and height")
+        self.polygon = polygon
+        self._outside = None  # pixels of the rectangle outside the polygon
+        if polygon is not None:
+            inside = np.zeros((self.height, self.width), np.uint8)
+            cv2.fillPoly(inside, [polygon - (self.left, self.top)], 1)
+            self._outside = inside == 0
+
+    @property
+    def offset(self):
+        """The full frame position of the cropped frames' origin."""
+        return (self.left, self.top)
+
+    def fits(self, width, height):
+        """True if the region's rectangle lies within a frame of that size."""
+        return (self.left >= 0 and self.top >= 0 and
+                self.left+self.width <= width and
+                self.top+self.height <= height)
+
+    def crop(self, frame):
+        """Give a view of the region's rectangle in a full frame."""
+        return frame[self.top:self.top+self.height,
+                     self.left:self.left+self.width]
+
+    def apply_mask(self, frame):
+        """Zero, in place, any part of a cropped frame outside the polygon."""
+        if self._outside is not None:
+            frame[self._outside] = 0
+        return frame
+
+    def to_full_frame(self, x, y):
+        """Map a point in a cropped frame to full frame coordinates."""
+        return x+self.left, y+self.top
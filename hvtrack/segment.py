@@ -9,6 +9,8 @@ tracks them over time.
 
 import numpy as np
 import cv2
+# Local imports
+import instrument
 
 
 def create_segment_object():
@@ -19,12 +21,16 @@ def create_segment_object():
 class Segment(object):
     """Detect foreground objects, generate tracks of them over time.
     The basic order:
+        - optionally, shrink the image down a pyramid of halvings
         - perform a threshold on the background subtracted image
         - erode and dilate the image to remove smaller speckles
         - provide a resulting final binary image
+    When shrinking, the threshold area and opening kernel are shrunk to
+    match, and the binary image is at the reduced size; scale gives the
+    number of full size pixels across each of its pixels.
     """
     def __init__(self, min_thresh=None, thresh_area=None,
-                 open_x=None, open_y=None):
+                 open_x=None, open_y=None, levels=None, refine=None):
         """Initialize the values we will use during segmentation.
 
         Takes:
@@ -32,6 +38,9 @@ class Segment(object):
             thresh_area - the area to consider when adaptively thresholding
             open_x - the x scale of object to select for in opening, in pix
             open_y - the y scale of object to select for in opening, in pix
+            levels - how many times to halve the image before segmenting
+            refine - whether object centers found in a halved image should
+                     be refined against the full size image
         Gives:
             None
         """
@@ -40,12 +49,17 @@ class Segment(object):
         self._t_area_default = 101
         self._open_x_default = 10
         self._open_y_default = 10
+        self._levels_default = 0
+        self._refine_default = False
         # Set current values from passed values
         default_if_none = lambda val, de: de if val is None else val
         self.min_thresh = default_if_none(min_thresh, self._min_t_default)
         self.thresh_area = default_if_none(thresh_area, self._t_area_default)
         self.open_kernel_x = default_if_none(open_x, self._open_x_default)
         self.open_kernel_y = default_if_none(open_y, self._open_y_default)
+        self.pyramid_levels = default_if_none(levels, self._levels_default)
+        self.refine = default_if_none(refine, self._refine_default)
+        self._kernels = {}  # opening kernels, by their (y, x) size
 
     @staticmethod
     def _passed_to_int(passed):
@@ -62,6 +76,32 @@ class Segment(object):
         elif type(passed) is int:
             return passed
 
+    @staticmethod
+    def _as_uint8(img, out=None, scratch=None):
+        """Round an image to uint8 for OpenCV, unless it already is.
+
+        Takes:
+            img - the image to convert
+            out - uint8 array to write the result into, new if None (None)
+            scratch - array of img's type to round in, new if None (None)
+        Gives:
+            img - the image as uint8
+        """
+        if img.dtype == np.uint8:
+            return img
+        if out is None:
+            return np.uint8(img.round())
+        np.copyto(out, np.around(img, out=scratch), casting='unsafe')
+        return out
+
+    def _kernel(self, ok_x, ok_y):
+        """Give the opening kernel of a size, made once and kept."""
+        kernel = self._kernels.get((ok_y, ok_x))
+        if kernel is None:
+            kernel = np.ones((ok_y, ok_x), np.uint8)
+            self._kernels[(ok_y, ok_x)] = kernel
+        return kernel
+
     def set_min_thresh(self, min_thresh):
         """Set the minimum threshold for non-adaptive thresholding."""
         self.thresh_area = self._passed_to_int(min_thresh)
@@ -78,7 +118,38 @@ class Segment(object):
         """Set the morphological opening kernel y dimension."""
         self.open_kernel_y = self._passed_to_int(open_kernel_y)
 
-    def abs_thresh(self, img, min_thresh=None, invert=False):
+    def set_pyramid_levels(self, levels):
+        """Set how many times the image is halved before segmenting."""
+        levels = self._passed_to_int(levels)
+        self.pyramid_levels = 0 if levels is None else levels
+
+    @property
+    def scale(self):
+        """Full size pixels across each pixel of a segmented image."""
+        return 2**self.pyramid_levels
+
+    def shrink(self, img, levels=None, buffers=None):
+        """Halve the passed image, with smoothing, once per pyramid level.
+
+        Takes:
+            img - the image to shrink
+            levels - the number of halvings, self.pyramid_levels if None
+            buffers - a FrameBuffers to shrink through, None for new arrays
+        Gives:
+            img - the shrunken image, as uint8
+        """
+        if levels is None:
+            levels = self.pyramid_levels
+        img = self._as_uint8(img)
+        for level in range(levels):
+            dst = None
+            if buffers is not None:
+                shape = ((img.shape[0]+1)//2, (img.shape[1]+1)//2)
+                dst = buffers.get('pyramid%i'%level, shape, np.uint8)
+            img = cv2.pyrDown(img, dst=dst)
+        return img
+
+    def abs_thresh(self, img, min_thresh=None, invert=False, dst=None):
         """Perform an absolute threshold on the passed image.
 
         More documentation on the absolute threshold and its arguments is
@@ -88,23 +159,25 @@ class Segment(object):
             min_thresh - the minimum intensity of the threshold
             invert - if True, then areas above the threshold are set to zero
                      and areas below it are set to the max value (False)
+            dst - uint8 array to write the result into, new if None (None)
         Gives:
             img - the thresholded image
         """
         if min_thresh is None:
             min_thresh = self.min_thresh
         if invert:
-            thresh_type = cv2.cv.CV_THRESH_BINARY_INV
+            thresh_type = cv2.THRESH_BINARY_INV
         else:
-            thresh_type = cv2.cv.CV_THRESH_BINARY
+            thresh_type = cv2.THRESH_BINARY
         img = cv2.threshold(
-            np.uint8(img.round()),  # must convert to uint8
+            self._as_uint8(img),    # must convert to uint8
             min_thresh,             # threshold value
             255,                    # value to assign to matched pix
-            thresh_type)[1]         # inverted or not, return only the image
+            thresh_type,            # inverted or not
+            dst=dst)[1]             # return only the image
         return img
 
-    def thresh(self, img, area=None, invert=False):
+    def thresh(self, img, area=None, invert=False, dst=None):
         """Perform an adaptive threshold on the passed image.
 
         Documentation on the adaptive threshold and its arguments is located
@@ -114,26 +187,28 @@ class Segment(object):
             area - pixel area to average over for determining the threshold
             invert - if True, then areas above the threshold are set to zero
                      and areas below it are set to the max value (False)
+            dst - uint8 array to write the result into, new if None (None)
         Gives:
             img - the thresholded image
         """
         if area is None:
             area = self.thresh_area
-        adaptive_method = cv2.cv.CV_ADAPTIVE_THRESH_GAUSSIAN_C
+        adaptive_method = cv2.ADAPTIVE_THRESH_GAUSSIAN_C
         if invert:
-            threshold_type = cv2.cv.CV_THRESH_BINARY_INV
+            threshold_type = cv2.THRESH_BINARY_INV
         else:
-            threshold_type = cv2.cv.CV_THRESH_BINARY
+            threshold_type = cv2.THRESH_BINARY
         img = cv2.adaptiveThreshold(
-            np.uint8(img.round()),  # must convert to uint8
+            self._as_uint8(img),    # must convert to uint8
             255,                    # value to assign to matched pix
             adaptive_method,        # Gaussian or mean
             threshold_type,         # binary or binary inverted
-            self.thresh_area,       # area to consider
-            0)                      # blocksize
+            area,                   # area to consider
+            0,                      # blocksize
+            dst=dst)
         return img
 
-    def open(self, img, ok_x=None, ok_y=None):
+    def open(self, img, ok_x=None, ok_y=None, dst=None, scratch=None):
         """Perform a morphological open on the passed image.
 
         This uses the predefined opening kernels to reduce speckle.
@@ -142,6 +217,8 @@ class Segment(object):
             img - the image to open
             ok_x - the x distance to open over
             ok_y - the y distance to open over
+            dst - array to write the result into, new if None (None)
+            scratch - array to erode into on the way, new if None (None)
         Gives:
             img - the opened image
         """
@@ -149,17 +226,38 @@ class Segment(object):
             ok_x = self.open_kernel_x
         if ok_y is None:
             ok_y = self.open_kernel_y
-        k = np.ones((ok_y, ok_x))
-        return cv2.dilate(cv2.erode(img, k), k)
+        k = self._kernel(ok_x, ok_y)
+        return cv2.dilate(cv2.erode(img, k, dst=scratch), k, dst=dst)
 
-    def segment(self, img):
+    @instrument.timed('segment.segment')
+    def segment(self, img, buffers=None):
         """Perform the default segmentation (threshold then open).
 
         Using the passed image and the current values for threshold area and
         opening kernel, perform a segmentation.
         Takes:
             img - the image to segment
+            buffers - a FrameBuffers to segment through, so that no new
+                      frame sized arrays are made, None for new arrays (None)
         Gives:
-            seg_img - the segmented image
+            seg_img - the segmented image, shrunk by scale if using levels
         """
-        return self.open(self.thresh(img))
+        area, ok_x, ok_y = self.thresh_area, None, None
+        if self.pyramid_levels > 0:
+            scale = self.scale
+            area = max(3, (int(self.thresh_area)//scale) | 1)  # odd, >1
+            ok_x = max(1, int(round(float(self.open_kernel_x)/scale)))
+            ok_y = max(1, int(round(float(self.open_kernel_y)/scale)))
+        if buffers is None:
+            if self.pyramid_levels > 0:
+                img = self.shrink(img)
+            return self.open(self.thresh(img, area), ok_x, ok_y)
+        get = lambda name, shape: buffers.get(name, shape, np.uint8)
+        if img.dtype != np.uint8:
+            img = self._as_uint8(img, get('uint8', img.shape),
+                                 buffers.get('rounded', img.shape, img.dtype))
+        if self.pyramid_levels > 0:
+            img = self.shrink(img, buffers=buffers)
+        img = self.thresh(img, area, dst=get('thresholded', img.shape))
+        return self.open(img, ok_x, ok_y, dst=get('segmented', img.shape),
+                         scratch=get('eroded', img.shape))
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" stagecache.py
+
+stagecache.py keeps the output of each tracking stage on disk, so that
+tracking a video again after changing a downstream setting only redoes the
+stages from that setting on. Three stages are kept:
+    background - the background model, as a .npy
+    masks - the segmented image of every frame, bit packed along each row,
+            as a single .npy of (frame, row, packed column) read by memmap
+    detections - the detection records of every frame, as a .npz
+Each entry is named by a hash of the video's fingerprint, the stage and the
+settings of that stage and every stage before it, so the Contour settings
+don't touch the masks' name but the Segment settings touch both. Entries
+are only moved into place once complete. The cache is held under a size cap
+by removing the least recently used entries, going by modification time,
+which is brought up to date whenever an entry is used. An entry bigger than
+the cap on its own, such as the masks of a long high resolution video, is
+not cached at all; the masks' size is worked out before any are written.
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+from numpy.lib.format import open_memmap
+# Local imports
+import video
+import background
+import contour
+import checkpoint
+import fileutil
+import buffers as buffers_module
+
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser('~'), '.hvtrack_cache')
+DEFAULT_MAX_BYTES = 2*1024**3
+
+# The settings, from checkpoint.run_settings, each stage depends on
+_UPSTREAM = {'background': ('roi', 'compact'),
+             'masks': ('roi', 'compact', 'segment'),
+             'detections': ('roi', 'compact', 'segment', 'contour')}
+_EXTENSIONS = {'background': '.npy', 'masks': '.npy', 'detections': '.npz'}
+
+
+def pack_mask(mask):
+    """Pack a binary image to bits, eight pixels to a byte along each row."""
+    return np.packbits(mask > 0, axis=-1)
+
+
+def unpack_mask(packed):
+    """Unpack a mask to a binary uint8 image of 0 and 255.
+
+    The image is padded with background out to a whole number of bytes
+    across, which changes no contour or component found in it.
+    """
+    return np.unpackbits(packed, axis=-1)*np.uint8(255)
+
+
+class StageCache(object):
+    """A directory of stage outputs, held under a size cap."""
+    def __init__(self, directory=None, max_bytes=None):
+        """Open, or start, a cache.
+
+        Takes:
+            directory - where to keep the cache, made if needed,
+                        DEFAULT_DIRECTORY if None (None)
+            max_bytes - the size to hold the cache under,
+                        DEFAULT_MAX_BYTES if None (None)
+        """
+        self.directory = DEFAULT_DIRECTORY if directory is None else directory
+        self.max_bytes = DEFAULT_MAX_BYTES if max_bytes is None else max_bytes
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def filename(self, stage, fingerprint, settings):
+        """Give the file holding a stage's output for a video and settings.
+
+        Takes:
+            stage - 'background', 'masks' or 'detections'
+            fingerprint - the video's video.file_fingerprint
+            settings - the run's settings, from checkpoint.run_settings
+        Gives:
+            filename - where the entry is, or would be, kept
+        """
+        keyed = [stage, fingerprint] + [[name, settings[name]]
+                                        for name in _UPSTREAM[stage]]
+        key = hashlib.sha1(json.dumps(keyed, sort_keys=True)).hexdigest()
+        return os.path.join(self.directory, stage+'_'+key+_EXTENSIONS[stage])
+
+    def get(self, filename):
+        """Give filename if it is in the cache, marking it used, else None."""
+        if not os.path.exists(filename):
+            return None
+        os.utime(filename, None)
+        return filename
+
+    def fits(self, nbytes):
+        """True if an entry of nbytes can be cached under the size cap."""
+        return nbytes <= self.max_bytes
+
+    def add(self, partial, filename):
+        """Move a completed entry into place, then trim the cache.
+
+        An entry too big for the cache is thrown away instead.
+        Takes:
+            partial - the file the entry was written to
+            filename - its name in the cache
+        Gives:
+            added - whether the entry was cached
+        """
+        if not self.fits(os.path.getsize(partial)):
+            os.remove(partial)
+            return False
+        fileutil.replace_file(partial, filename)
+        self.trim(keep=filename)
+        return True
+
+    def trim(self, keep=None):
+        """Remove least recently used entries until under the size cap.
+
+        The entry named keep is never removed, nor are unfinished entries.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            full = os.path.join(self.directory, name)
+            if name.endswith('.partial') or not os.path.isfile(full):
+                continue
+            stat = os.stat(full)
+            entries.append((stat.st_mtime, stat.st_size, full))
+        total = sum(size for _, size, _ in entries)
+        for _, size, full in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if full != keep:
+                os.remove(full)
+                total -= size
+
+    def load_background(self, filename):
+        """Give a cached background model, or None."""
+        if self.get(filename) is None:
+            return None
+        return np.load(filename)
+
+    def save_background(self, filename, model):
+        """Cache a background model."""
+        partial = filename+'.partial'
+        with open(partial, 'wb') as model_file:
+            np.save(model_file, model)
+        self.add(partial, filename)
+
+    def load_masks(self, filename):
+        """Give cached masks as a read-only memory map, or None."""
+        if self.get(filename) is None:
+            return None
+        return np.load(filename, mmap_mode='r')
+
+    def load_detections(self, filename):
+        """Give a list of the cached Detections of each frame, or None."""
+        if self.get(filename) is None:
+            return None
+        saved = np.load(filename)
+        records, counts = saved['records'], saved['counts']
+        saved.close()
+        return [contour.Detections(records[end-count:end])
+                for end, count in zip(np.cumsum(counts), counts)]
+
+    def save_detections(self, filename, log):
+        """Cache a list of the Detections of each frame."""
+        partial = filename+'.partial'
+        records = [detections.records for detections in log]
+        with open(partial, 'wb') as log_file:
+            np.savez(log_file,
+                     records=np.concatenate(records) if records else
+                     np.zeros(0, contour.DETECTION_DTYPE),
+                     counts=np.array([len(rec) for rec in records], np.int64))
+        self.add(partial, filename)
+
+
+def cached_detect_frames(cache, filename, seg_obj, con_obj, roi=None,
+                         compact=False):
+    """Generate the detections in each frame, reusing whatever is cached.
+
+    Detections are given straight from the cache if there, otherwise they
+    are found in the cached masks if those are there and the Segment needn't
+    refine centers against the full frame, otherwise the video is tracked
+    from the start. Stages that are worked out are cached, once the last
+    frame is reached; stopping early caches nothing but the background.
+    Takes:
+        cache - the StageCache
+        filename - the full path to the video
+        seg_obj - the Segment to segment each frame with
+        con_obj - the Contour to detect objects in each segmented frame with
+        roi - an roi.ROI to detect within, the whole frame if None (None)
+        compact - whether to keep frames in the video's native type (False)
+    Gives:
+        frame_ind - the frame number
+        shape - the shape of the frames detections were made in
+        detections - a Detections of the objects found in the frame
+    """
+    fingerprint = video.file_fingerprint(filename)
+    settings = checkpoint.run_settings(seg_obj, con_obj, None, roi, compact)
+    names = dict((stage, cache.filename(stage, fingerprint, settings))
+                 for stage in _UPSTREAM)
+    vid = video.open_video_file(filename, compact=compact)
+    vid.set_roi(roi)
+    model = cache.load_background(names['background'])
+    if model is None:
+        model = background.create_background_object(vid).background_image()
+        cache.save_background(names['background'], model)
+    shape = model.shape
+    log = cache.load_detections(names['detections'])
+    if log is not None:
+        vid.release()
+        for frame_ind, detections in enumerate(log):
+            yield frame_ind, shape, detections
+        return
+    masks = None
+    if not (seg_obj.refine and seg_obj.scale > 1):
+        masks = cache.load_masks(names['masks'])
+    log = []
+    if masks is not None:
+        vid.release()
+        for frame_ind, packed in enumerate(masks):
+            detections = con_obj.detect(unpack_mask(packed), seg_obj.scale)
+            log.append(contour.Detections(detections.records))
+            yield frame_ind, shape, detections
+        cache.save_detections(names['detections'], log)
+        return
+    bkg = background.create_background_object(vid, model)
+    partial = names['masks']+'.partial'
+    writer, finished, cached_masks = None, False, False
+    buffers = buffers_module.FrameBuffers()
+    try:
+        for frame_ind, img in enumerate(bkg.subtracted_frames(
+                buffers=buffers)):
+            seg_img = seg_obj.segment(img, buffers)
+            if frame_ind == 0:
+                mask_shape = (int(vid.length),) + pack_mask(seg_img).shape
+                if cache.fits(int(np.prod(mask_shape))):
+                    writer = open_memmap(partial, 'w+', np.uint8, mask_shape)
+            if writer is not None:
+                writer[frame_ind] = pack_mask(seg_img)  # before contouring
+            detections = con_obj.detect(seg_img, seg_obj.scale)
+            if seg_obj.refine and seg_obj.scale > 1:
+                con_obj.refine_centers(detections, img)
+            log.append(contour.Detections(detections.records))
+            yield frame_ind, shape, detections
+        finished = len(log) == int(vid.length)
+        cached_masks = finished and writer is not None
+    finally:
+        vid.release()
+        del writer  # closing the map
+        if not cached_masks and os.path.exists(partial):
+            os.remove(partial)
+    if finished:
+        if cached_masks:
+            cache.add(partial, names['masks'])
+        cache.save_detections(names['detections'], log)
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" sweep.py
+
+sweep.py tracks a video with every combination of a grid of Segment,
+Contour and Path settings in a single pass, for tuning. Each frame is
+decoded and background subtracted once and handed to every segmentation
+variant. Each segmented image is contoured and measured once per detection
+backend, unfiltered, and only the filtering is done per Contour variant, as
+that is all they differ in. Each Path variant is fed the detections of its
+upstream variants. Frames are split into ranges worked on by a pool of
+processes, as in track.parallel_detections, and a summary of the paths
+found with each combination comes back at the end.
+
+Run from the command line with a JSON grid file such as
+    {"segment": {"thresh_area": [51, 101], "open_x": [5, 10]},
+     "contour": {"area_min": [10, 40]},
+     "path": {"near": [20, 50]}}
+where each setting maps to a list of values to try.
+"""
+
+import json
+import itertools
+import argparse
+import multiprocessing
+import numpy as np
+# Local imports
+import video
+import segment
+import contour
+import path
+import track
+import buffers as buffers_module
+
+
+def parameter_grid(grid):
+    """Give every combination of the values in a grid, as keyword dicts.
+
+    Takes:
+        grid - dict of setting name to list of values, or None
+    Gives:
+        combinations - list of dicts of setting name to value, in a fixed
+                       order; a single empty dict for an empty grid
+    """
+    if not grid:
+        return [{}]
+    names = sorted(grid)
+    return [dict(zip(names, values))
+            for values in itertools.product(*[grid[name] for name in names])]
+
+
+def _measurers(con_objs):
+    """Make an unfiltered Contour for each backend the variants use.
+
+    A components measurer traces perimeters only if some variant of it
+    filters on them, just as the variants themselves would.
+    """
+    measurers = {}
+    for con_obj in con_objs:
+        if con_obj.backend not in measurers:
+            measurer = contour.Contour(backend=con_obj.backend)
+            for limit in ('area_min', 'area_max', 'perim_min', 'perim_max',
+                          'ratio_min', 'ratio_max'):
+                setattr(measurer, limit, None)
+            measurers[con_obj.backend] = measurer
+        if any(getattr(con_obj, limit) is not None for limit in
+               ('perim_min', 'perim_max', 'ratio_min', 'ratio_max')):
+            measurers[con_obj.backend].perim_min = -1  # traced, never cut
+    return measurers
+
+
+def detect_variants(img, seg_objs, con_objs, measurers, buffers=None):
+    """Detect objects in a frame with every Segment and Contour variant.
+
+    Takes:
+        img - the background subtracted frame
+        seg_objs - list of the Segment variants
+        con_objs - list of the Contour variants
+        measurers - dict of backend to unfiltered Contour, from _measurers
+        buffers - list of a FrameBuffers for each Segment, or None (None)
+    Gives:
+        records - list, by Segment, of lists, by Contour, of the records of
+                  the detections of each combination
+    """
+    records = []
+    for seg_ind, seg_obj in enumerate(seg_objs):
+        seg_img = seg_obj.segment(
+            img, None if buffers is None else buffers[seg_ind])
+        measured = {}
+        for backend, measurer in measurers.items():
+            source = seg_img if len(measurers) == 1 else seg_img.copy()
+            found = measurer.detect(source, seg_obj.scale)
+            if seg_obj.refine and seg_obj.scale > 1:
+                measurer.refine_centers(found, img)
+            measured[backend] = found
+        records.append([con_obj.filter_detections(
+            measured[con_obj.backend]).records for con_obj in con_objs])
+    return records
+
+
+def _sweep_chunk(args):
+    """Detect with every variant in a range of frames, in a worker process.
+
+    Takes:
+        args - tuple of filename, the Segment and Contour variants, start
+               and stop frames and region of interest
+    Gives:
+        start - the first frame of the range
+        log - list, by frame, of the records from detect_variants
+    """
+    filename, seg_objs, con_objs, start, stop, roi = args
+    vid, bkg = track.open_for_tracking(filename, roi)
+    measurers = _measurers(con_objs)
+    buffers = [buffers_module.FrameBuffers() for seg_obj in seg_objs]
+    frame_buffers = buffers_module.FrameBuffers()
+    log = [detect_variants(img, seg_objs, con_objs, measurers, buffers)
+           for img in bkg.subtracted_frames(start=start, stop=stop,
+                                            buffers=frame_buffers)]
+    vid.release()
+    return start, log
+
+
+def _sweep_detections(filename, seg_objs, con_objs, processes=None,
+                      chunk_length=None, roi=None):
+    """Generate, in frame order, the records of every variant's detections.
+
+    Gives:
+        frame_ind - the frame number
+        records - the frame's records, as from detect_variants
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    vid = video.open_video_file(filename)
+    length = int(vid.length)
+    vid.release()
+    jobs = [(filename, seg_objs, con_objs, start, stop, roi) for start, stop
+            in track.frame_chunks(length, processes, chunk_length)]
+    if processes == 1:
+        results = itertools.imap(_sweep_chunk, jobs)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap(_sweep_chunk, jobs)
+    try:
+        for start, log in results:
+            for offset, records in enumerate(log):
+                yield start+offset, records
+        if pool is not None:
+            pool.close()
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.join()
+
+
+def _length_summary(lengths):
+    """Sum up a list of path lengths, in frames."""
+    if len(lengths) == 0:
+        return {'min': None, 'p10': None, 'median': None, 'mean': None,
+                'p90': None, 'max': None}
+    lengths = np.array(lengths)
+    return {'min': int(lengths.min()),
+            'p10': float(np.percentile(lengths, 10)),
+            'median': float(np.median(lengths)),
+            'mean': float(lengths.mean()),
+            'p90': float(np.percentile(lengths, 90)),
+            'max': int(lengths.max())}
+
+
+def sweep(filename, segment_grid=None, contour_grid=None, path_grid=None,
+          processes=None, chunk_length=None, roi=None):
+    """Track a video with every combination of a grid of settings.
+
+    Takes:
+        filename - the full path to the video
+        segment_grid - dict of Segment keyword to list of values (None)
+        contour_grid - dict of Contour keyword to list of values (None)
+        path_grid - dict of Path keyword to list of values (None)
+        processes - number of worker processes, one per core if None (None)
+        chunk_length - frames in each range, see track.frame_chunks (None)
+        roi - an roi.ROI to track within, the whole frame if None (None)
+    Gives:
+        results - list of a dict for each combination, holding the
+                  'segment', 'contour' and 'path' settings it was run
+                  with, the number of 'paths' found and their
+                  'path_lengths', and the number of 'detections' made
+    """
+    seg_settings = parameter_grid(segment_grid)
+    con_settings = parameter_grid(contour_grid)
+    path_settings = parameter_grid(path_grid)
+    seg_objs = [segment.Segment(**settings) for settings in seg_settings]
+    con_objs = [contour.Contour(**settings) for settings in con_settings]
+    combos = list(itertools.product(range(len(seg_objs)),
+                                    range(len(con_objs)),
+                                    range(len(path_settings))))
+    path_objs, lengths = {}, {}
+    for combo in combos:
+        path_objs[combo] = path.Path(**path_settings[combo[2]])
+        path_objs[combo].set_offset(track._offset(roi))
+        lengths[combo] = []
+    detections = dict(((seg_ind, con_ind), 0) for seg_ind, con_ind, _
+                      in combos)
+    for frame_ind, records in _sweep_detections(
+            filename, seg_objs, con_objs, processes, chunk_length, roi):
+        for seg_ind, by_contour in enumerate(records):
+            for con_ind, found in enumerate(by_contour):
+                detections[(seg_ind, con_ind)] += len(found)
+                found = contour.Detections(found)
+                for path_ind in range(len(path_settings)):
+                    combo = (seg_ind, con_ind, path_ind)
+                    path_objs[combo].add_frame(found, frame_ind)
+                    lengths[combo].extend(
+                        len(one_path) for one_path
+                        in path_objs[combo].pop_finished_paths())
+    results = []
+    for combo in combos:
+        lengths[combo].extend(len(one_path) for one_path
+                              in path_objs[combo].finalize())
+        seg_ind, con_ind, path_ind = combo
+        results.append({'segment': seg_settings[seg_ind],
+                        'contour': con_settings[con_ind],
+                        'path': path_settings[path_ind],
+                        'paths': len(lengths[combo]),
+                        'path_lengths': _length_summary(lengths[combo]),
+                        'detections': detections[(seg_ind, con_ind)]})
+    return results
+
+
+def parse_arguments(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Track a video with every combination of a grid of "
+        "settings, in one pass.")
+    parser.add_argument('video', help="the video file to track")
+    parser.add_argument('grid', help="JSON file of 'segment', 'contour' and "
+                        "'path' dicts of setting name to list of values")
+    parser.add_argument('-o', '--output', help="JSON file to save results to")
+    parser.add_argument('-p', '--processes', type=int,
+                        help="worker processes, one per core if not given")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Sweep a grid of settings from the command line."""
+    args = parse_arguments(argv)
+    with open(args.grid) as grid_file:
+        grid = json.load(grid_file)
+    results = sweep(args.video, grid.get('segment'), grid.get('contour'),
+                    grid.get('path'), args.processes)
+    if args.output is not None:
+        with open(args.output, 'w') as results_file:
+            json.dump(results, results_file, indent=2, sort_keys=True)
+    for result in results:
+        settings = dict(result['segment'].items() + result['contour'].items()
+                        + result['path'].items())
+        print "%6i paths, median length %6s, from %8i detections: %s"%(
+            result['paths'], result['path_lengths']['median'],
+            result['detections'], json.dumps(settings, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
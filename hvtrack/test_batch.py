@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" test_batch.py
+
+Tests of tracking a directory of videos. Run from the package with
+    python -m unittest discover -s hvtrack -t hvtrack
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+# Local imports
+import batch
+import benchmark
+import segment
+import contour
+import path
+
+
+class CancelTest(unittest.TestCase):
+    """A cancelled batch should stop, leaving unfinished videos to redo."""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.names = ['video%i.tif'%ind for ind in range(3)]
+        for name in self.names:
+            benchmark.write_synthetic_video(
+                os.path.join(self.directory, name),
+                benchmark.synthetic_frames(160, 120, 40, blobs=3))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, True)
+
+    def process(self, cancel=None):
+        return batch.process_directory(
+            self.directory, segment.Segment(thresh_area=31, open_x=3,
+                                            open_y=3),
+            contour.Contour(area_min=5), path.Path(near=20, min_length=5),
+            processes=2, cancel=cancel)
+
+    def test_cancel_stops_the_batch(self):
+        started = time.time()
+        manifest = self.process(cancel=lambda: True)
+        self.assertLess(time.time()-started, 30)
+        for name in self.names:
+            self.assertEqual(manifest.state(name), batch.Manifest.IN_PROGRESS)
+            self.assertFalse(os.path.exists(
+                batch.store_output_name(self.directory, name)))
+
+    def test_cancelled_batch_resumes(self):
+        self.process(cancel=lambda: True)
+        manifest = self.process()
+        for name in self.names:
+            self.assertEqual(manifest.state(name), batch.Manifest.COMPLETED)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" test_checkpoint.py
+
+Tests of checkpointing and resuming a tracking run. Run from the package
+with
+    python -m unittest discover -s hvtrack -t hvtrack
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+# Local imports
+import checkpoint
+import track
+import trackstore
+import benchmark
+import segment
+import contour
+import path
+import gate
+
+
+class Crash(Exception):
+    """Raised to kill a run part way through."""
+
+
+class CrashingPath(path.Path):
+    """A Path which dies on reaching a given frame."""
+    def __init__(self, crash_at=None, **kwargs):
+        path.Path.__init__(self, **kwargs)
+        self._crash_at = crash_at
+
+    def add_frame(self, detections, frame_ind):
+        if frame_ind == self._crash_at:
+            raise Crash()
+        return path.Path.add_frame(self, detections, frame_ind)
+
+
+class CheckpointTest(unittest.TestCase):
+    """A resumed run should give just what an unbroken run gives."""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.video = os.path.join(self.directory, 'video.tif')
+        frames = [frame.copy() for frame in
+                  benchmark.synthetic_frames(160, 120, 30, blobs=3)]
+        # The animals sit still for frames 10 to 29, which a gate skips
+        benchmark.write_synthetic_video(
+            self.video, frames[:10] + [frames[10]]*20 + frames[11:])
+        self.checkpoint = os.path.join(self.directory, 'run.checkpoint')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, True)
+
+    def track(self, out, crash_at=None, gate_obj=None):
+        return track.stream_video(
+            self.video, os.path.join(self.directory, out),
+            segment.Segment(thresh_area=31, open_x=3, open_y=3),
+            contour.Contour(area_min=5),
+            CrashingPath(crash_at, near=20, min_length=5),
+            checkpoint=self.checkpoint, checkpoint_every=15, gate=gate_obj)
+
+    def rows(self, out):
+        return np.array(trackstore.TrackStore(
+            os.path.join(self.directory, out)).rows)
+
+    def test_save_and_load(self):
+        saver = checkpoint.Checkpoint(self.checkpoint, self.video,
+                                      {'setting': 1})
+        self.assertIsNone(saver.load())
+        saver.save(15, {'paths': []}, 2, 40, {'in_a_row': 3})
+        loaded = saver.load()
+        self.assertEqual((loaded['frame'], loaded['path_state'],
+                          loaded['paths_written'], loaded['store_rows'],
+                          loaded['gate_state']),
+                         (15, {'paths': []}, 2, 40, {'in_a_row': 3}))
+        other = checkpoint.Checkpoint(self.checkpoint, self.video,
+                                      {'setting': 2})
+        self.assertIsNone(other.load())
+        saver.remove()
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_resumed_run_matches(self):
+        whole = self.track('whole.tracks')
+        self.assertRaises(Crash, self.track, 'resumed.tracks', crash_at=40)
+        self.assertTrue(os.path.exists(self.checkpoint))
+        path_count, frame_count = self.track('resumed.tracks')
+        self.assertEqual(path_count, whole[0])
+        self.assertEqual(frame_count, 49-30)
+        self.assertTrue(np.array_equal(self.rows('whole.tracks'),
+                                       self.rows('resumed.tracks')))
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_resumed_gated_run_matches(self):
+        whole_gate = gate.MotionGate()
+        whole = self.track('whole.tracks', gate_obj=whole_gate)
+        self.assertEqual(whole_gate.counts(), (49, 19))
+        self.assertRaises(Crash, self.track, 'resumed.tracks', crash_at=20,
+                          gate_obj=gate.MotionGate())
+        resumed_gate = gate.MotionGate()
+        self.assertEqual(self.track('resumed.tracks', gate_obj=resumed_gate),
+                         (whole[0], 49-15))
+        # Frame 15 is still static against frame 10, from before the crash
+        self.assertEqual(resumed_gate.counts(), (34, 15))
+        self.assertTrue(np.array_equal(self.rows('whole.tracks'),
+                                       self.rows('resumed.tracks')))
+
+
+if __name__ == '__main__':
+    unittest.main()
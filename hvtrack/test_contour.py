@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" test_contour.py
+
+Tests of detecting and measuring objects. Run from the package with
+    python -m unittest discover -s hvtrack -t hvtrack
+"""
+
+import unittest
+import numpy as np
+import cv2
+# Local imports
+import contour
+
+
+def blob_mask():
+    """Give a mask of separate rectangles and discs of several sizes."""
+    mask = np.zeros((120, 160), np.uint8)
+    mask[10:20, 10:30] = 255
+    mask[40:41, 5:25] = 255
+    mask[70:101, 12:19] = 255
+    mask[5:8, 60:63] = 255
+    for center, radius in (((90, 40), 9), ((120, 80), 14), ((60, 100), 4)):
+        cv2.circle(mask, center, radius, 255, -1)
+    return mask
+
+
+def by_box(detections):
+    """Give the records of a Detections sorted by bounding box."""
+    records = detections.records
+    return records[np.lexsort((records['top'], records['left']))]
+
+
+class BackendTest(unittest.TestCase):
+    """The components backend should measure as the contours one does."""
+    def contour_object(self, backend, **limits):
+        """Give a Contour filtering by just the limits given."""
+        con_obj = contour.Contour(backend=backend)
+        for name in ('area_min', 'area_max', 'perim_min', 'perim_max',
+                     'ratio_min', 'ratio_max'):
+            setattr(con_obj, name, limits.get(name))
+        return con_obj
+
+    def detect(self, backend, **limits):
+        return by_box(self.contour_object(backend, **limits)
+                      .detect(blob_mask()))
+
+    def test_records_match(self):
+        traced = self.detect('contours', perim_min=0)
+        labelled = self.detect('components', perim_min=0)
+        self.assertEqual(len(labelled), 7)
+        self.assertEqual(len(labelled), len(traced))
+        for name in ('left', 'top', 'width', 'height'):
+            self.assertTrue(np.array_equal(labelled[name], traced[name]))
+        self.assertTrue(np.allclose(labelled['perim'], traced['perim']))
+        # Symmetric blobs have the same center either way
+        self.assertTrue(np.allclose(labelled['x'], traced['x'], atol=0.05))
+        self.assertTrue(np.allclose(labelled['y'], traced['y'], atol=0.05))
+        # Pixel counts, by Pick's theorem, are the polygon areas plus half
+        # the boundary and one, the boundary being the perimeter for blobs
+        # with straight sides
+        square = np.in1d(labelled['left'], (5, 10, 12, 60))
+        self.assertEqual(square.sum(), 4)
+        self.assertTrue(np.allclose(
+            labelled['area'][square],
+            traced['area'][square] + traced['perim'][square]/2 + 1))
+        self.assertTrue((labelled['area'] > traced['area']).all())
+
+    def test_filters_keep_the_same_objects(self):
+        # Set clear of where the backends' areas differ
+        limits = dict(area_min=30, area_max=2000, perim_min=20,
+                      perim_max=200)
+        traced = self.detect('contours', **limits)
+        labelled = self.detect('components', **limits)
+        self.assertTrue(0 < len(labelled) < 7)
+        self.assertTrue(np.array_equal(labelled[['left', 'top']],
+                                       traced[['left', 'top']]))
+
+    def test_perimeter_is_nan_without_a_perimeter_filter(self):
+        self.assertTrue(np.isnan(self.detect('components')['perim']).all())
+        self.assertTrue(np.isnan(
+            self.detect('components', area_min=10)['perim']).all())
+        for limits in (dict(perim_max=1000), dict(ratio_min=0)):
+            self.assertFalse(np.isnan(
+                self.detect('components', **limits)['perim']).any())
+
+    def test_scaled_records(self):
+        traced = self.detect('contours')
+        mask = cv2.resize(blob_mask(), (80, 60),
+                          interpolation=cv2.INTER_NEAREST)
+        labelled = by_box(self.contour_object('components')
+                          .detect(mask, scale=2))
+        self.assertEqual(len(labelled), len(traced))
+        self.assertTrue((np.abs(labelled['x'] - traced['x']) < 2).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" test_contourlog.py
+
+Tests of the contour log and its spilling to disk. Run from the package
+with
+    python -m unittest discover -s hvtrack -t hvtrack
+"""
+
+import unittest
+import numpy as np
+# Local imports
+import contourlog
+import contour
+
+
+def blob_masks(length=12, shape=(60, 80)):
+    """Give masks with a changing number of square blobs, some with none."""
+    masks = []
+    for frame_ind in range(length):
+        mask = np.zeros(shape, np.uint8)
+        for blob in range(frame_ind % 4):
+            left = 5 + 20*blob + frame_ind
+            mask[10+5*blob:20+5*blob, left:left+8] = 255
+        masks.append(mask)
+    return masks
+
+
+class ContourLogTest(unittest.TestCase):
+    """Frames read back from disk should match those logged."""
+    def logged(self, backend):
+        """Give the Detections of each mask and a log holding them."""
+        con_obj = contour.Contour(backend=backend)
+        detected = [con_obj.detect(mask) for mask in blob_masks()]
+        log = contourlog.ContourLog(window=3)
+        for detections in detected:
+            log.append(detections)
+        self.addCleanup(log.close)
+        return detected, log
+
+    def assertSameDetections(self, read, expected):
+        self.assertTrue(np.array_equal(read.records, expected.records))
+        if expected.contours is None:
+            self.assertIsNone(read.contours)
+        else:
+            self.assertEqual(len(read.contours), len(expected.contours))
+            for outline, expected_outline in zip(read.contours,
+                                                 expected.contours):
+                self.assertTrue(np.array_equal(outline, expected_outline))
+
+    def test_spilled_frames_read_back(self):
+        for backend in ('contours', 'components'):
+            detected, log = self.logged(backend)
+            self.assertEqual(len(log), len(detected))
+            for read, expected in zip(log, detected):
+                self.assertSameDetections(read, expected)
+            self.assertSameDetections(log[-1], detected[-1])
+            self.assertSameDetections(log[0], detected[0])
+
+    def test_empty_frames(self):
+        detected, log = self.logged('contours')
+        self.assertEqual(len(log[0]), 0)
+        self.assertEqual(len(log[4]), 0)
+        self.assertEqual(len(log[3]), 3)
+
+    def test_slices(self):
+        detected, log = self.logged('contours')
+        for read, expected in zip(log[2:9], detected[2:9]):
+            self.assertSameDetections(read, expected)
+        self.assertEqual(len(log[-2:]), 2)
+        self.assertEqual(len(log.frames(0, 12)), 12)
+
+    def test_frames_out_of_range(self):
+        detected, log = self.logged('contours')
+        self.assertRaises(IndexError, log.__getitem__, len(detected))
+        self.assertRaises(IndexError, log.__getitem__, -len(detected)-1)
+
+    def test_raw_contours_are_measured(self):
+        log = contourlog.ContourLog(window=1)
+        self.addCleanup(log.close)
+        outline = np.array([[[0, 0]], [[0, 9]], [[9, 9]], [[9, 0]]],
+                           np.int32)
+        log.append([outline])
+        log.append([])
+        self.assertEqual(len(log[0]), 1)
+        self.assertAlmostEqual(log[0].records['x'][0], 4.5)
+        self.assertTrue(np.array_equal(log[0].contours[0], outline))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" test_gate.py
+
+Tests of the motion gate. Run from the package with
+    python -m unittest discover -s hvtrack -t hvtrack
+"""
+
+import unittest
+import numpy as np
+# Local imports
+import gate
+import contour
+
+
+class MotionGateTest(unittest.TestCase):
+    """The gate should skip static frames, but never the first."""
+    def gated(self, gate_obj, frames):
+        """Give whether each frame was skipped."""
+        skipped = []
+        for frame in frames:
+            found = gate_obj.static_detections(frame)
+            skipped.append(found is not None)
+            if found is None:
+                gate_obj.remember(contour.Detections())
+        return skipped
+
+    def test_first_frame_is_detected_in(self):
+        frames = [np.zeros((64, 64), np.uint8)]*5
+        for measure in ('difference', 'energy'):
+            gate_obj = gate.MotionGate(measure=measure)
+            self.assertEqual(self.gated(gate_obj, frames),
+                             [False, True, True, True, True])
+            self.assertEqual(gate_obj.counts(), (5, 4))
+
+    def test_a_small_mover_is_not_skipped(self):
+        frames = [np.zeros((64, 64), np.uint8) for ind in range(3)]
+        frames[2][10:14, 40:44] = 200
+        gate_obj = gate.MotionGate()
+        self.assertEqual(self.gated(gate_obj, frames), [False, True, False])
+
+    def test_small_matches_for_each_type(self):
+        frame = np.random.RandomState(0).randint(0, 200, (64, 48))
+        block_means = frame.reshape(8, 8, 6, 8).mean(3).mean(1)
+        gate_obj = gate.MotionGate()
+        for dtype in (np.uint8, np.int16, np.uint16, np.int32, np.float32,
+                      np.float64):
+            small = gate_obj.small(frame.astype(dtype))
+            self.assertEqual(small.dtype, np.float32)
+            self.assertLessEqual(np.abs(small-block_means).max(), 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" test_localsearch.py
+
+Tests of searching windows about live paths. Run from the package with
+    python -m unittest discover -s hvtrack -t hvtrack
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+# Local imports
+import localsearch
+import track
+import benchmark
+import segment
+import contour
+import path
+
+
+class LocalSearchTest(unittest.TestCase):
+    """Searching windows should find the paths a full search finds."""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.video = os.path.join(self.directory, 'video.tif')
+        benchmark.write_synthetic_video(
+            self.video, benchmark.synthetic_frames(320, 240, 60, blobs=3))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, True)
+
+    def track(self, search=None):
+        paths = track.track_video(
+            self.video, segment.Segment(thresh_area=31, open_x=3, open_y=3),
+            contour.Contour(area_min=5), path.Path(near=20, min_length=5),
+            search=search)
+        return [(np.array([time for time, _ in one_path]),
+                 np.array([record for _, record in one_path]))
+                for one_path in paths]
+
+    def assertSamePaths(self, paths, expected):
+        """Paths should match, centers to within rounding of the shift."""
+        self.assertEqual(len(paths), len(expected))
+        for (times, records), (expected_times, expected_records) in zip(
+                paths, expected):
+            self.assertTrue(np.array_equal(times, expected_times))
+            for name in records.dtype.names:
+                self.assertTrue(np.allclose(records[name],
+                                            expected_records[name]))
+
+    def test_paths_match_full_search(self):
+        search = localsearch.LocalSearch()
+        self.assertSamePaths(self.track(search), self.track())
+        self.assertGreater(len(self.track()), 0)
+
+    def test_windows_search_less_than_the_frames(self):
+        search = localsearch.LocalSearch()
+        self.track(search)
+        frames, full, searched, pixels = search.counts()
+        self.assertEqual(frames, 60)
+        self.assertLess(full, 10)
+        self.assertLess(searched, 0.5*pixels)
+
+    def test_crowded_frames_are_searched_in_full(self):
+        search = localsearch.LocalSearch(max_fraction=0.01)
+        self.assertSamePaths(self.track(search), self.track())
+        frames, full, searched, pixels = search.counts()
+        self.assertEqual((full, searched), (frames, pixels))
+
+    def test_windows_cover_a_turn(self):
+        path_obj = path.Path(near=20)
+        records = np.zeros(2, contour.DETECTION_DTYPE)
+        records['x'] = (100, 104)
+        records['y'] = 50
+        records['width'] = records['height'] = 6
+        path_obj.add_frame(contour.Detections(records[:1]), 0)
+        path_obj.add_frame(contour.Detections(records[1:]), 1)
+        search = localsearch.LocalSearch()
+        (left, top, right, bottom), = search.windows(path_obj, 2, (240, 320),
+                                                     0)
+        # Reaching back to where it would be having turned round, at 100
+        self.assertLessEqual(left, 100-3)
+        self.assertGreaterEqual(right, 108+3)
+        self.assertLess(right-left, 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" test_path.py
+
+Tests of matching detections into paths. Run from the package with
+    python -m unittest discover -s hvtrack -t hvtrack
+"""
+
+import unittest
+import numpy as np
+# Local imports
+import path
+import contour
+
+
+def detections_at(centers):
+    """Give a Detections of records centered at each of a list of points."""
+    records = np.zeros(len(centers), contour.DETECTION_DTYPE)
+    if len(centers):
+        records['x'], records['y'] = np.transpose(centers)
+    return contour.Detections(records)
+
+
+def brute_force_paths(frames, near):
+    """Pair centers into paths by comparing each with every live path end.
+
+    This is the matching Path does, without the grid: a center joins the
+    path ending nearest it, if nearer than near, and a path is dropped
+    once a frame goes by without anything joining it.
+    """
+    live, dead = [], []
+    for time, centers in enumerate(frames):
+        dead.extend(one for one in live if one[-1][0]+1 < time)
+        live = [one for one in live if one[-1][0]+1 >= time]
+        for x, y in centers:
+            closest, closest_distance = None, near
+            for one in live:
+                distance = np.hypot(x-one[-1][1], y-one[-1][2])
+                if distance < closest_distance:
+                    closest, closest_distance = one, distance
+            if closest is None:
+                live.append([(time, x, y)])
+            else:
+                closest.append((time, x, y))
+    return sorted(dead + live)
+
+
+def grid_paths(frames, near):
+    """Pair centers into paths through Path, as (time, x, y) points."""
+    path_obj = path.Path(near=near, min_length=1)
+    for time, centers in enumerate(frames):
+        path_obj.add_frame(detections_at(centers), time)
+    return sorted([(time, record['x'], record['y'])
+                   for time, record in one]
+                  for one in path_obj.paths + path_obj.dead_paths)
+
+
+class EndpointGridTest(unittest.TestCase):
+    """The grid should pair detections just as comparing them all does."""
+    near = 20
+
+    def assertSamePairing(self, frames):
+        self.assertEqual(grid_paths(frames, self.near),
+                         brute_force_paths(frames, self.near))
+
+    def test_exactly_near_is_not_near(self):
+        frames = [[(40.0, 10.0), (100.0, 100.0)],
+                  [(60.0, 10.0), (100.0, 119.99)]]
+        self.assertSamePairing(frames)
+        self.assertEqual(len(grid_paths(frames, self.near)), 3)
+
+    def test_across_cell_borders(self):
+        # Each step crosses from one cell into the next, or the one beyond
+        frames = [[(39.9, 39.9), (80.1, 20.0)],
+                  [(40.1, 40.1), (61.0, 20.0)],
+                  [(58.0, 58.0), (59.9, 38.1)],
+                  [(60.1, 60.1), (60.1, 60.0)]]
+        self.assertSamePairing(frames)
+
+    def test_random_walkers_near_borders(self):
+        rand = np.random.RandomState(1)
+        for trial in range(20):
+            # Start on cell corners, then move up to past near each frame
+            position = (rand.randint(0, 10, (15, 2))*self.near +
+                        rand.uniform(-0.5, 0.5, (15, 2)))
+            frames = []
+            for time in range(12):
+                angle = rand.uniform(0, 2*np.pi, 15)
+                step = rand.uniform(0, 1.2*self.near, 15)
+                position += step[:, None]*np.column_stack((np.cos(angle),
+                                                           np.sin(angle)))
+                seen = rand.rand(15) > 0.2
+                frames.append([tuple(point) for point in position[seen]])
+            self.assertSamePairing(frames)
+
+
+if __name__ == '__main__':
+    unittest.main()
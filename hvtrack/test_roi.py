@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" test_roi.py
+
+Tests of tracking within a region of interest. Run from the package with
+    python -m unittest discover -s hvtrack -t hvtrack
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+# Local imports
+import roi
+import track
+import video
+import benchmark
+import segment
+import contour
+import path
+
+
+class ROITest(unittest.TestCase):
+    """A region should crop what a full frame run sees, and fit the frame."""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.video = os.path.join(self.directory, 'video.tif')
+        benchmark.write_synthetic_video(
+            self.video, benchmark.synthetic_frames(160, 120, 30, blobs=3))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, True)
+
+    def track(self, filename, region=None):
+        path_obj = path.Path(near=20, min_length=5)
+        paths = track.track_video(
+            filename, segment.Segment(thresh_area=31, open_x=3, open_y=3),
+            contour.Contour(area_min=5), path_obj, roi=region)
+        return [path_obj.path_table(one_path) for one_path in paths]
+
+    def test_frames_are_cropped(self):
+        region = roi.ROI((20, 10, 100, 80))
+        whole, bkg_whole = track.open_for_tracking(self.video)
+        cropped, bkg_cropped = track.open_for_tracking(self.video, region)
+        for ind in (0, 7, 29):
+            self.assertTrue(np.array_equal(
+                bkg_cropped.subtract_background(ind),
+                region.crop(bkg_whole.subtract_background(ind))))
+        whole.release()
+        cropped.release()
+
+    def test_region_matches_full_frame(self):
+        # The same video with a border about it, cropped off by the region
+        padded = os.path.join(self.directory, 'padded.tif')
+        benchmark.write_synthetic_video(padded, (
+            np.pad(frame, ((6, 4), (10, 5)), 'edge') for frame in
+            benchmark.synthetic_frames(160, 120, 30, blobs=3)))
+        expected = self.track(self.video)
+        paths = self.track(padded, roi.ROI((10, 6, 160, 120)))
+        self.assertEqual(len(paths), len(expected))
+        for rows, expected_rows in zip(paths, expected):
+            self.assertTrue(np.array_equal(rows['frame'],
+                                           expected_rows['frame']))
+            self.assertTrue(np.allclose(rows['x'], expected_rows['x']+10))
+            self.assertTrue(np.allclose(rows['y'], expected_rows['y']+6))
+            self.assertTrue(np.array_equal(rows['area'],
+                                           expected_rows['area']))
+
+    def test_polygon_masks_outside(self):
+        region = roi.ROI(polygon=[(20, 10), (120, 10), (20, 90)])
+        vid, bkg = track.open_for_tracking(self.video, region)
+        frame = bkg.subtract_background(3)
+        self.assertEqual(frame.shape, (region.height, region.width))
+        self.assertTrue((frame[-1, -1:] == 0).all())
+        vid.release()
+
+    def test_regions_outside_the_frame_are_refused(self):
+        vid = video.open_video_file(self.video)
+        for rect in ((100, 10, 61, 50), (10, 100, 50, 21), (-5, 0, 50, 50),
+                     (0, -1, 50, 50)):
+            self.assertRaises(ValueError, vid.set_roi, roi.ROI(rect))
+        self.assertRaises(ValueError, track.open_for_tracking, self.video,
+                          roi.ROI((150, 0, 20, 20)))
+        self.assertRaises(ValueError, roi.ROI, (0, 0, 0, 10))
+        vid.set_roi(roi.ROI((100, 70, 60, 50)))
+        self.assertEqual(vid.next().shape, (50, 60))
+        vid.release()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" test_stagecache.py
+
+Tests of the stage cache. Run from the package with
+    python -m unittest discover -s hvtrack -t hvtrack
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+# Local imports
+import stagecache
+import benchmark
+import segment
+import contour
+import track
+
+
+class StageCacheTest(unittest.TestCase):
+    """Cached stages should give what working them out again gives."""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.video = os.path.join(self.directory, 'video.tif')
+        benchmark.write_synthetic_video(
+            self.video, benchmark.synthetic_frames(160, 120, 30, blobs=3))
+        self.segment = segment.Segment(thresh_area=31, open_x=3, open_y=3)
+        self.contour = contour.Contour(area_min=5)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, True)
+
+    def detect(self, cache):
+        return [detections.records.copy() for _, _, detections in
+                stagecache.cached_detect_frames(cache, self.video,
+                                                self.segment, self.contour)]
+
+    def entries(self, cache):
+        return sorted(name.split('_')[0] for name
+                      in os.listdir(cache.directory))
+
+    def assert_same(self, found, expected):
+        self.assertEqual(len(found), len(expected))
+        for one, other in zip(found, expected):
+            np.testing.assert_array_equal(one, other)
+
+    def test_reuse_matches_detection(self):
+        vid, bkg = track.open_for_tracking(self.video)
+        expected = [detections.records.copy() for _, _, detections
+                    in track.detect_frames(bkg, self.segment, self.contour)]
+        vid.release()
+        cache = stagecache.StageCache(os.path.join(self.directory, 'cache'))
+        self.assert_same(self.detect(cache), expected)
+        self.assertEqual(self.entries(cache),
+                         ['background', 'detections', 'masks'])
+        self.assert_same(self.detect(cache), expected)  # from detections
+        self.contour.area_min = 6
+        self.detect(cache)  # from masks
+        self.assertEqual(self.entries(cache),
+                         ['background', 'detections', 'detections', 'masks'])
+
+    def test_entries_too_big_are_not_cached(self):
+        packed = 30*120*160//8  # the masks' bytes, less the .npy header
+        cache = stagecache.StageCache(os.path.join(self.directory, 'cache'),
+                                      max_bytes=packed-1)
+        self.detect(cache)
+        self.assertEqual(self.entries(cache), ['detections'])
+        self.assertEqual([name for name in os.listdir(cache.directory)
+                          if name.endswith('.partial')], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
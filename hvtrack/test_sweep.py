@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" test_sweep.py
+
+Tests of sweeping a grid of tracking settings. Run from the package with
+    python -m unittest discover -s hvtrack -t hvtrack
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+# Local imports
+import sweep
+import track
+import benchmark
+import segment
+import contour
+import path
+
+
+class SweepTest(unittest.TestCase):
+    """Each combination of a sweep should find what tracking it alone does."""
+    segment_grid = {'thresh_area': [31, 51], 'open_x': [3], 'open_y': [3]}
+    contour_grid = {'area_min': [5, 150],
+                    'backend': ['contours', 'components']}
+    path_grid = {'near': [10, 20], 'min_length': [5]}
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.video = os.path.join(self.directory, 'video.tif')
+        benchmark.write_synthetic_video(
+            self.video, benchmark.synthetic_frames(160, 120, 30, blobs=3))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, True)
+
+    def test_parameter_grid(self):
+        self.assertEqual(sweep.parameter_grid(None), [{}])
+        self.assertEqual(sweep.parameter_grid({'b': [1, 2], 'a': [3]}),
+                         [{'a': 3, 'b': 1}, {'a': 3, 'b': 2}])
+
+    def test_sweep_matches_separate_runs(self):
+        for processes in (1, 2):
+            results = sweep.sweep(self.video, self.segment_grid,
+                                  self.contour_grid, self.path_grid,
+                                  processes=processes, chunk_length=7)
+            self.assertEqual(len(results), 16)
+            counts = set()
+            for result in results:
+                paths = track.track_video(
+                    self.video, segment.Segment(**result['segment']),
+                    contour.Contour(**result['contour']),
+                    path.Path(**result['path']))
+                self.assertEqual(result['paths'], len(paths))
+                if paths:
+                    lengths = [len(one_path) for one_path in paths]
+                    self.assertEqual(result['path_lengths']['min'],
+                                     min(lengths))
+                    self.assertEqual(result['path_lengths']['max'],
+                                     max(lengths))
+                counts.add(result['paths'])
+            # The grid should make a difference to what is found
+            self.assertGreater(len(counts), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" test_tiffstack.py
+
+Tests of writing and mapping uncompressed TIFF stacks. Run from the package
+with
+    python -m unittest discover -s hvtrack -t hvtrack
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+# Local imports
+import tiffstack
+
+
+def random_frames(shape, dtype, length=5):
+    """Give frames of random values of a type, the same every time."""
+    values = np.random.RandomState(0).uniform(0, 200, (length,)+shape)
+    return [frame.astype(dtype) for frame in values]
+
+
+class TiffStackTest(unittest.TestCase):
+    """What write_tiff_stack writes, TiffStack should read back."""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'stack.tif')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, True)
+
+    def round_trip(self, frames):
+        self.assertEqual(tiffstack.write_tiff_stack(self.filename,
+                                                    iter(frames)),
+                         len(frames))
+        stack = tiffstack.open_tiff_stack(self.filename)
+        self.assertIsNotNone(stack)
+        self.assertEqual(stack.length, len(frames))
+        self.assertEqual(stack.frame_shape, frames[0].shape)
+        self.assertEqual(stack.shape, frames[0].shape[1::-1])
+        self.assertEqual(stack.dtype.newbyteorder('='), frames[0].dtype)
+        return stack
+
+    def test_round_trip_each_type(self):
+        for dtype in (np.uint8, np.uint16, np.int16, np.int32, np.float32,
+                      np.float64):
+            frames = random_frames((6, 8), dtype)
+            stack = self.round_trip(frames)
+            for ind, frame in enumerate(frames):
+                self.assertTrue(np.array_equal(stack.find_and_read(ind),
+                                               frame))
+            del stack
+
+    def test_round_trip_colour(self):
+        frames = random_frames((6, 8, 3), np.uint8)
+        stack = self.round_trip(frames)
+        self.assertTrue(np.array_equal(stack.find_and_read(4), frames[4]))
+
+    def test_sequential_and_seek(self):
+        frames = random_frames((6, 8), np.uint8)
+        stack = self.round_trip(frames)
+        read = list(stack)
+        self.assertEqual(len(read), len(frames))
+        for frame, expected in zip(read, frames):
+            self.assertTrue(np.array_equal(frame, expected))
+        stack.seek(3)
+        self.assertTrue(np.array_equal(stack.next(), frames[3]))
+
+    def test_frames_are_read_only_views(self):
+        stack = self.round_trip(random_frames((6, 8), np.uint8))
+        frame = stack.find_and_read(0)
+        self.assertFalse(frame.flags.writeable)
+
+    def test_mismatched_frames_are_refused(self):
+        frames = [np.zeros((6, 8), np.uint8), np.zeros((6, 9), np.uint8)]
+        self.assertRaises(ValueError, tiffstack.write_tiff_stack,
+                          self.filename, frames)
+        self.assertRaises(ValueError, tiffstack.write_tiff_stack,
+                          self.filename, [])
+
+    def test_compressed_tiff_is_not_mapped(self):
+        from PIL import Image
+        pages = [Image.fromarray(frame)
+                 for frame in random_frames((6, 8), np.uint8)]
+        pages[0].save(self.filename, save_all=True, append_images=pages[1:],
+                      compression='tiff_deflate')
+        self.assertIsNone(tiffstack.open_tiff_stack(self.filename))
+
+    def test_other_files_are_not_mapped(self):
+        with open(self.filename, 'wb') as not_tiff:
+            not_tiff.write('not a tiff at all')
+        self.assertIsNone(tiffstack.open_tiff_stack(self.filename))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" test_track.py
+
+Tests of the tracking drivers. Run from the package with
+    python -m unittest discover -s hvtrack -t hvtrack
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+# Local imports
+import track
+import benchmark
+import segment
+import contour
+import path
+
+
+class ParallelTest(unittest.TestCase):
+    """Tracking on several processes should give the serial paths."""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filenames = [os.path.join(self.directory, name)
+                          for name in ('video.tif', 'video.avi')]
+        for filename in self.filenames:
+            benchmark.write_synthetic_video(
+                filename, benchmark.synthetic_frames(160, 120, 30, blobs=3))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, True)
+
+    def objects(self):
+        return (segment.Segment(thresh_area=31, open_x=3, open_y=3),
+                contour.Contour(area_min=5),
+                path.Path(near=20, min_length=5))
+
+    def test_frame_chunks(self):
+        self.assertEqual(track.frame_chunks(30, 2, 7),
+                         [(0, 7), (7, 14), (14, 21), (21, 28), (28, 30)])
+        self.assertEqual(track.frame_chunks(30, 2, 7, first=10),
+                         [(10, 17), (17, 24), (24, 30)])
+        chunks = track.frame_chunks(30, 2)
+        self.assertEqual(len(chunks), 8)
+        self.assertEqual((chunks[0][0], chunks[-1][1]), (0, 30))
+
+    def test_parallel_matches_serial(self):
+        for filename in self.filenames:
+            seg_obj, con_obj, path_obj = self.objects()
+            serial = [path_obj.path_table(one_path) for one_path in
+                      track.track_video(filename, seg_obj, con_obj, path_obj)]
+            parallel = [path_obj.path_table(one_path) for one_path in
+                        track.track_video_parallel(
+                            filename, seg_obj, con_obj, path_obj,
+                            processes=2, chunk_length=7)]
+            # Some path runs on across the boundary of the first ranges
+            self.assertTrue(any(6 in rows['frame'] and 7 in rows['frame']
+                                for rows in serial))
+            self.assertEqual(len(parallel), len(serial))
+            for rows, expected in zip(parallel, serial):
+                self.assertTrue(np.array_equal(rows, expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
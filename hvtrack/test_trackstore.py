@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" test_trackstore.py
+
+Tests of writing and reading track store files. Run from the package with
+    python -m unittest discover -s hvtrack -t hvtrack
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+# Local imports
+import trackstore
+
+
+def path_rows(first_frame, length, x=0.0):
+    """Give the rows of a path moving one pixel right each frame."""
+    rows = np.zeros(length, trackstore.TRACK_DTYPE)
+    rows['frame'] = np.arange(first_frame, first_frame+length)
+    rows['x'] = x + np.arange(length)
+    rows['y'] = 2*rows['frame']
+    rows['area'] = 10
+    rows['perim'] = 12
+    return rows
+
+
+class TrackStoreTest(unittest.TestCase):
+    """What TrackStoreWriter writes, TrackStore should read back."""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'paths.tracks')
+        self.paths = [path_rows(0, 5), path_rows(3, 4, 50.0),
+                      path_rows(10, 2, 90.0)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, True)
+
+    def write(self, paths, append=False, keep=None):
+        with trackstore.TrackStoreWriter(self.filename, append,
+                                         keep) as store:
+            return [store.append(rows) for rows in paths]
+
+    def test_round_trip(self):
+        self.assertEqual(self.write(self.paths), [0, 1, 2])
+        store = trackstore.TrackStore(self.filename)
+        self.assertEqual(len(store), 11)
+        self.assertEqual(list(store.path_ids()), [0, 1, 2])
+        for path_id, rows in enumerate(self.paths):
+            read = store.path(path_id)
+            self.assertTrue((read['path_id'] == path_id).all())
+            for name in ('frame', 'x', 'y', 'area', 'perim'):
+                self.assertTrue(np.array_equal(read[name], rows[name]))
+        self.assertEqual([len(rows) for rows in store.paths()], [5, 4, 2])
+
+    def test_frames(self):
+        self.write(self.paths)
+        store = trackstore.TrackStore(self.filename)
+        rows = store.frames(3, 5)
+        self.assertEqual(list(rows['frame']), [3, 3, 4, 4])
+        self.assertEqual(sorted(rows['path_id']), [0, 0, 1, 1])
+        self.assertEqual(list(store.frames(10)['path_id']), [2])
+        self.assertEqual(len(store.frames(20)), 0)
+
+    def test_export_csv(self):
+        self.write(self.paths)
+        out_dir = os.path.join(self.directory, 'csv')
+        self.assertEqual(
+            trackstore.TrackStore(self.filename).export_csv(out_dir), 3)
+        centers = np.loadtxt(os.path.join(out_dir, 'path_0001.csv'),
+                             delimiter=',')
+        rows = self.paths[1]
+        self.assertTrue(np.array_equal(
+            centers, np.column_stack((rows['frame'], rows['x'], rows['y']))))
+
+    def test_append_keeps_ids_going(self):
+        self.write(self.paths[:2])
+        self.assertEqual(self.write(self.paths[2:], append=True), [2])
+        self.assertEqual(list(trackstore.TrackStore(self.filename)
+                              .path_ids()), [0, 1, 2])
+
+    def test_append_cuts_off_rows_after_keep(self):
+        self.write(self.paths)
+        self.assertEqual(self.write(self.paths[1:], append=True, keep=5),
+                         [1, 2])
+        store = trackstore.TrackStore(self.filename)
+        self.assertEqual(len(store), 11)
+        self.assertEqual(list(store.path_ids()), [0, 1, 2])
+        self.assertRaises(ValueError, self.write, [], True, 12)
+
+    def test_partly_written_row_is_ignored(self):
+        self.write(self.paths)
+        with open(self.filename, 'ab') as store_file:
+            store_file.write('\0'*(trackstore.TRACK_DTYPE.itemsize//2))
+        store = trackstore.TrackStore(self.filename)
+        self.assertEqual(len(store), 11)
+        self.assertEqual(self.write([path_rows(0, 1)], append=True), [3])
+        self.assertEqual(len(trackstore.TrackStore(self.filename)), 12)
+
+    def test_empty_store(self):
+        self.write([])
+        store = trackstore.TrackStore(self.filename)
+        self.assertEqual(len(store), 0)
+        self.assertEqual(len(store.path_ids()), 0)
+        self.assertEqual(len(store.frames(0, 10)), 0)
+
+    def test_other_files_are_refused(self):
+        with open(self.filename, 'wb') as other:
+            other.write('not a track store, but long enough')
+        self.assertRaises(ValueError, trackstore.TrackStore, self.filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
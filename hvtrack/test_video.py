@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" test_video.py
+
+Tests of frame access through the Video class. Run from the package with
+    python -m unittest discover -s hvtrack -t hvtrack
+"""
+
+import os
+import sys
+import copy
+import shutil
+import subprocess
+import tempfile
+import unittest
+import numpy as np
+# Local imports
+import video
+import tiffstack
+import background
+import benchmark
+
+
+def numbered_frames(length=12, shape=(6, 8)):
+    """Give frames each filled with their own frame number."""
+    return [np.full(shape, ind, np.uint8) for ind in range(length)]
+
+
+def write_compressed_tiff(filename, frames):
+    """Write a deflate compressed TIFF, which only TiffCapture reads."""
+    from PIL import Image
+    pages = [Image.fromarray(frame) for frame in frames]
+    pages[0].save(filename, save_all=True, append_images=pages[1:],
+                  compression='tiff_deflate')
+
+
+class TiffReadersTest(unittest.TestCase):
+    """Both TIFF readers should give the same frame for the same number."""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.frames = numbered_frames()
+        self.mapped = os.path.join(self.directory, 'mapped.tif')
+        tiffstack.write_tiff_stack(self.mapped, self.frames)
+        self.compressed = os.path.join(self.directory, 'compressed.tif')
+        write_compressed_tiff(self.compressed, self.frames)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, True)
+
+    def readers(self):
+        """Give a Video on each reader, checking which reader it has."""
+        mapped = video.open_video_file(self.mapped)
+        self.assertIsInstance(mapped.video, tiffstack.TiffStack)
+        compressed = video.open_video_file(self.compressed)
+        self.assertNotIsInstance(compressed.video, tiffstack.TiffStack)
+        return mapped, compressed
+
+    def test_sequential_matches_random_access(self):
+        for vid in self.readers():
+            sequential = [int(frame[0, 0]) for frame in vid]
+            random = [int(vid.find_and_read(ind)[0, 0])
+                      for ind in range(int(vid.length))]
+            self.assertEqual(sequential, range(len(self.frames)))
+            self.assertEqual(random, range(len(self.frames)))
+            vid.release()
+
+    def test_seek_then_next(self):
+        for vid in self.readers():
+            vid.seek(5)
+            self.assertEqual(vid.next()[0, 0], 5)
+            self.assertEqual(vid.next()[0, 0], 6)
+            vid.seek(0)
+            self.assertEqual(vid.next()[0, 0], 0)
+            vid.release()
+
+    def test_random_access_while_prefetching(self):
+        for vid in self.readers():
+            vid.prefetch = 4
+            self.assertEqual([vid.next()[0, 0] for ind in range(3)],
+                             [0, 1, 2])
+            self.assertEqual(vid.find_and_read(8)[0, 0], 8)
+            self.assertEqual([int(frame[0, 0]) for frame in vid],
+                             range(3, len(self.frames)))
+            vid.release()
+
+    def test_seek_while_prefetching(self):
+        for vid in self.readers():
+            vid.prefetch = 4
+            vid.next()
+            vid.seek(7)
+            self.assertEqual(vid.next()[0, 0], 7)
+            vid.release()
+
+
+class OpenCVReaderTest(unittest.TestCase):
+    """Frames found at random in an AVI should be those read in turn."""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'video.avi')
+        frames = [np.full((48, 64), 8*ind, np.uint8) for ind in range(30)]
+        benchmark.write_synthetic_video(self.filename, frames)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, True)
+
+    def test_find_and_read_matches_sequential(self):
+        vid = video.open_video_file(self.filename)
+        sequential = [frame.copy() for frame in vid]
+        self.assertEqual(len(sequential), 30)
+        for ind in (0, 5, 12, 3, 29):
+            self.assertTrue(np.array_equal(vid.find_and_read(ind),
+                                           sequential[ind]))
+        vid.release()
+
+    def test_find_and_read_leaves_next_alone(self):
+        vid = video.open_video_file(self.filename)
+        sequential = [frame.copy() for frame in vid]
+        vid.seek(0)
+        vid.next()
+        vid.find_and_read(20)
+        self.assertTrue(np.array_equal(vid.next(), sequential[1]))
+        vid.release()
+
+
+class CopyTest(unittest.TestCase):
+    """A Background seeking in its copy shouldn't upset the original."""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.frames = numbered_frames(20, (48, 64))
+        self.filenames = [os.path.join(self.directory, name)
+                          for name in ('video.tif', 'video.avi')]
+        for filename in self.filenames:
+            benchmark.write_synthetic_video(filename, self.frames)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, True)
+
+    def test_background_seeks_while_prefetching(self):
+        for filename in self.filenames:
+            expected = [frame.copy() for frame in
+                        video.open_video_file(filename)]
+            vid = video.open_video_file(filename, prefetch=3)
+            read = [vid.next().copy() for ind in range(5)]
+            bkg = background.Background(vid)
+            for ind in (15, 2, 9):
+                bkg.subtract_background(ind)
+                read.append(vid.next().copy())
+            read.extend(frame.copy() for frame in vid)
+            self.assertEqual(len(read), len(expected))
+            for frame, expected_frame in zip(read, expected):
+                self.assertTrue(np.array_equal(frame, expected_frame))
+            vid.release()
+
+    def test_copy_starts_where_the_original_is(self):
+        for filename in self.filenames:
+            vid = video.open_video_file(filename, prefetch=3)
+            vid.next()
+            vid.next()
+            other = copy.copy(vid)
+            self.assertTrue(np.array_equal(other.next(), vid.next()))
+            self.assertIsNot(other.video, vid.video)
+            vid.release()
+            other.release()
+
+
+class HeadlessImportTest(unittest.TestCase):
+    """Headless tracking shouldn't need a display's libraries."""
+    def test_track_imports_no_gui_libraries(self):
+        loaded = subprocess.check_output(
+            [sys.executable, '-c', "import sys, track; print sorted("
+             "name for name in ('PIL', 'Tkinter', 'tiffcapture') "
+             "if name in sys.modules)"],
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(loaded.strip(), '[]')
+
+
+if __name__ == '__main__':
+    unittest.main()
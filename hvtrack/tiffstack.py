@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" tiffstack.py
+
+tiffstack.py serves the frames of uncompressed multi-page TIFF files straight
+out of a memory map. The page offsets are parsed once on opening, after which
+any frame is a read-only view into the file, with no decoding or copying and
+with the OS page cache doing the remembering for us. Compressed or otherwise
+awkward files aren't handled here; open_tiff_stack gives None for them so the
+caller can fall back to a general purpose reader. write_tiff_stack writes
+frames out in the same simple layout, so anything it writes can be mapped.
+"""
+
+import struct
+import numpy as np
+
+
+# TIFF tags we care about
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+PHOTOMETRIC = 262
+STRIP_OFFSETS = 273
+SAMPLES_PER_PIXEL = 277
+STRIP_BYTE_COUNTS = 279
+ROWS_PER_STRIP = 278
+PLANAR_CONFIG = 284
+TILE_WIDTH = 322
+SAMPLE_FORMAT = 339
+
+# Sizes and struct codes of the field types, by TIFF type number
+_FIELD_TYPES = {1: (1, 'B'), 2: (1, 'B'), 3: (2, 'H'), 4: (4, 'I'),
+                6: (1, 'b'), 7: (1, 'B'), 8: (2, 'h'), 9: (4, 'i'),
+                11: (4, 'f'), 12: (8, 'd')}
+
+# Numpy kinds for the SampleFormat tag values
+_SAMPLE_KINDS = {1: 'u', 2: 'i', 3: 'f'}
+
+
+def open_tiff_stack(filename):
+    """Open a TIFF as a memory mapped stack, or give None if we can't."""
+    try:
+        return TiffStack(filename)
+    except (ValueError, IOError, struct.error):
+        return None
+
+
+def write_tiff_stack(filename, frames):
+    """Write frames to an uncompressed, little-endian, multi-page TIFF.
+
+    Each page is its directory followed by its pixels as a single strip.
+    Frames may come from a generator, so long videos needn't be held in
+    memory, but must all share the shape and type of the first.
+    Takes:
+        filename - the file to write
+        frames - iterable of (height, width) or (height, width, samples)
+                 arrays, of unsigned or signed integer or float type
+    Gives:
+        length - the number of pages written
+    """
+    kinds = dict((kind, code) for code, kind in _SAMPLE_KINDS.items())
+    shape, dtype, length = None, None, 0
+    with open(filename, 'wb') as tiff:
+        tiff.write(struct.pack('<2sHI', 'II', 42, 8))
+        for frame in frames:
+            if shape is None:
+                shape, dtype = frame.shape, frame.dtype
+                samples = 1 if len(shape) == 2 else shape[2]
+                bits = [dtype.itemsize*8]*samples
+                nbytes = int(np.prod(shape))*dtype.itemsize
+            elif frame.shape != shape or frame.dtype != dtype:
+                raise ValueError("Frames differ in shape or type")
+            page = tiff.tell()
+            n_tags = 10
+            bits_at = page + 2 + 12*n_tags + 4
+            data_at = bits_at + (2*samples if samples > 2 else 0)
+            bits_value = (struct.pack('<'+'H'*samples, *bits) if samples < 3
+                          else struct.pack('<I', bits_at))
+            entry = lambda tag, kind, count, value: struct.pack(
+                '<HHI', tag, kind, count) + value.ljust(4, '\0')
+            short = lambda value: struct.pack('<H', value)
+            long_ = lambda value: struct.pack('<I', value)
+            tiff.write(short(n_tags) + ''.join([
+                entry(IMAGE_WIDTH, 4, 1, long_(shape[1])),
+                entry(IMAGE_LENGTH, 4, 1, long_(shape[0])),
+                entry(BITS_PER_SAMPLE, 3, samples, bits_value),
+                entry(COMPRESSION, 3, 1, short(1)),
+                entry(PHOTOMETRIC, 3, 1, short(1 if samples < 3 else 2)),
+                entry(STRIP_OFFSETS, 4, 1, long_(data_at)),
+                entry(SAMPLES_PER_PIXEL, 3, 1, short(samples)),
+                entry(ROWS_PER_STRIP, 4, 1, long_(shape[0])),
+                entry(STRIP_BYTE_COUNTS, 4, 1, long_(nbytes)),
+                entry(SAMPLE_FORMAT, 3, 1, short(kinds[dtype.kind]))]))
+            tiff.write(long_(data_at + nbytes))  # where the next page goes
+            if samples > 2:
+                tiff.write(struct.pack('<'+'H'*samples, *bits))
+            tiff.write(np.ascontiguousarray(frame, dtype.newbyteorder('<'))
+                       .tostring())
+            length += 1
+        if length == 0:
+            raise ValueError("No frames to write")
+        tiff.seek(page + 2 + 12*n_tags)
+        tiff.write(long_(0))  # the last page has no next
+    return length
+
+
+def _read_ifd(tiff, offset, order):
+    """Read the image file directory at offset into a dict of tag values.
+
+    Takes:
+        tiff - the open file
+        offset - where in the file the directory starts
+        order - the struct byte order character, '<' or '>'
+    Gives:
+        tags - dict of tag number to tuple of values
+        next_offset - where the next directory starts, 0 if there isn't one
+    """
+    tiff.seek(offset)
+    n_entries = struct.unpack(order+'H', tiff.read(2))[0]
+    entries = tiff.read(12*n_entries)
+    next_offset = struct.unpack(order+'I', tiff.read(4))[0]
+    tags = {}
+    for i in range(n_entries):
+        tag, kind, count, value = struct.unpack(
+            order+'HHI4s', entries[12*i:12*i+12])
+        if kind not in _FIELD_TYPES:
+            continue  # rationals and the like, nothing we need
+        size, code = _FIELD_TYPES[kind]
+        if size*count > 4:
+            here = tiff.tell()
+            tiff.seek(struct.unpack(order+'I', value)[0])
+            value = tiff.read(size*count)
+            tiff.seek(here)
+        tags[tag] = struct.unpack(order+code*count, value[:size*count])
+    return tags, next_offset
+
+
+def _page_layout(tags, order):
+    """Find the data offset, shape and dtype of a page, if it is mappable.
+
+    A page is mappable if it is uncompressed, untiled and its strips sit
+    one after another in the file. Anything else raises a ValueError.
+    """
+    get = lambda tag, default: tags.get(tag, (default,))
+    width, height = get(IMAGE_WIDTH, 0)[0], get(IMAGE_LENGTH, 0)[0]
+    samples = get(SAMPLES_PER_PIXEL, 1)[0]
+    bits = set(get(BITS_PER_SAMPLE, 1))
+    kinds = set(get(SAMPLE_FORMAT, 1))
+    if get(COMPRESSION, 1)[0] != 1:
+        raise ValueError("Compressed page")
+    if TILE_WIDTH in tags:
+        raise ValueError("Tiled page")
+    if get(PHOTOMETRIC, 1)[0] == 0:
+        raise ValueError("WhiteIsZero page")
+    if samples > 1 and get(PLANAR_CONFIG, 1)[0] != 1:
+        raise ValueError("Planar page")
+    if len(bits) != 1 or len(kinds) != 1:
+        raise ValueError("Mixed sample types")
+    bits, kind = bits.pop(), kinds.pop()
+    if bits not in (8, 16, 32, 64) or kind not in _SAMPLE_KINDS:
+        raise ValueError("Unsupported sample type")
+    offsets = get(STRIP_OFFSETS, None)
+    counts = get(STRIP_BYTE_COUNTS, None)
+    if None in offsets or None in counts or len(offsets) != len(counts):
+        raise ValueError("No strips")
+    for i in range(len(offsets)-1):
+        if offsets[i]+counts[i] != offsets[i+1]:
+            raise ValueError("Scattered strips")
+    dtype = np.dtype(order + _SAMPLE_KINDS[kind] + str(bits/8))
+    shape = (height, width) if samples == 1 else (height, width, samples)
+    if sum(counts) < np.prod(shape)*dtype.itemsize:
+        raise ValueError("Short strips")
+    return offsets[0], shape, dtype
+
+
+class TiffStack(object):
+    """Read-only, zero copy access to the pages of an uncompressed TIFF.
+
+    This follows the reading interface of TiffCapture, so the Video class
+    can use either without caring which it has.
+    """
+    def __init__(self, filename):
+        """Parse the page offsets and map the file.
+
+        Raises a ValueError if the file isn't a TIFF we can map.
+        """
+        self.filename = filename
+        with open(filename, 'rb') as tiff:
+            header = tiff.read(8)
+            order = {'II': '<', 'MM': '>'}.get(header[:2])
+            if order is None:
+                raise ValueError("Not a TIFF")
+            magic, offset = struct.unpack(order+'HI', header[2:8])
+            if magic != 42:
+                raise ValueError("Not a classic TIFF")
+            layouts = []
+            while offset != 0:
+                tags, offset = _read_ifd(tiff, offset, order)
+                layouts.append(_page_layout(tags, order))
+        if len(layouts) == 0:
+            raise ValueError("No pages")
+        if len(set((shape, dtype) for _, shape, dtype in layouts)) != 1:
+            raise ValueError("Pages differ in shape or type")
+        self._offsets = [offset for offset, _, _ in layouts]
+        self.frame_shape, self.dtype = layouts[0][1], layouts[0][2]
+        self._nbytes = int(np.prod(self.frame_shape))*self.dtype.itemsize
+        self._map = np.memmap(filename, dtype=np.uint8, mode='r')
+        self.length = len(self._offsets)
+        self.shape = (self.frame_shape[1], self.frame_shape[0])
+        self._curr = 0
+
+    def __iter__(self):
+        return self
+
+    def find_and_read(self, i):
+        """Give a read-only view of frame i."""
+        start = self._offsets[i]
+        page = self._map[start:start+self._nbytes]
+        return page.view(self.dtype).reshape(self.frame_shape)
+
+    def seek(self, i):
+        """Set a given frame as the current."""
+        self._curr = i
+
+    def next(self):
+        """Give the current frame and move on, stopping at the end."""
+        if self._curr >= self.length:
+            raise StopIteration()
+        frame = self.find_and_read(self._curr)
+        self._curr += 1
+        return frame
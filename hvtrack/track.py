@@ -0,0 +1,560 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" track.py
+
+track.py chains the video, background, segment, contour and path stages
+together to track a whole video without the GUI, either serially or by
+splitting the video into frame ranges which are worked on in parallel.
+A gate.MotionGate can be put between background subtraction and
+segmentation to skip the frames in which nothing moves, and a
+localsearch.LocalSearch can limit segmentation to windows about the paths
+being tracked.
+Run from the command line it tracks a video headlessly, writing each path
+out to a track store as soon as it ends; see main or run with --help for
+the options.
+"""
+
+import os
+import json
+import argparse
+import multiprocessing
+# Local imports
+import video
+import background
+import segment
+import contour
+import path
+import gate as gate_module
+import localsearch
+import roi as roi_module
+import buffers as buffers_module
+import instrument
+import trackstore
+import checkpoint as checkpoint_module
+
+
+def open_for_tracking(filename, roi=None, prefetch=None, compact=False):
+    """Open a video, cropped to any region of interest, and its background.
+
+    Takes:
+        filename - the full path to the video
+        roi - an roi.ROI to crop frames to, or None for whole frames (None)
+        prefetch - frames to decode ahead on a background thread (None)
+        compact - whether to keep frames in the video's native type (False)
+    Gives:
+        vid - the opened Video
+        bkg - a Background for it
+    """
+    vid = video.open_video_file(filename, prefetch, compact)
+    vid.set_roi(roi)
+    return vid, background.create_background_object(vid)
+
+
+def _offset(roi):
+    """Give the offset paths need for a region of interest, or None."""
+    return None if roi is None else roi.offset
+
+
+def detect_in_frame(img, seg_obj, con_obj, buffers=None):
+    """Segment a background subtracted frame and detect the objects in it.
+
+    Segmentation at a reduced size is scaled back up, with centers refined
+    against the full size frame if the Segment asks for it. Segmentation
+    works through buffers, a FrameBuffers, if one is given.
+    """
+    detections = con_obj.detect(seg_obj.segment(img, buffers), seg_obj.scale)
+    if seg_obj.refine and seg_obj.scale > 1:
+        con_obj.refine_centers(detections, img)
+    return detections
+
+
+def detect_frames(bkg, seg_obj, con_obj, start=0, stop=None, gate=None,
+                  gate_state=None):
+    """Generate the detections in each frame of a video in turn.
+
+    Every frame is worked through the same set of buffers, so the image
+    given with each frame is overwritten by the next; copy it to keep it.
+    Takes:
+        bkg - a Background for the video to be tracked
+        seg_obj - the Segment to segment each frame with
+        con_obj - the Contour to detect objects in each segmented frame with
+        start - the first frame to detect in (0)
+        stop - the frame to stop before, the video end if None (None)
+        gate - a gate.MotionGate to skip static frames with, it is reset
+               first and counts the frames it skips; None for none (None)
+        gate_state - a state of the gate, from MotionGate.state, to carry
+                     on from once it is reset (None)
+    Gives:
+        frame_ind - the frame number
+        img - the background subtracted frame
+        detections - a Detections of the objects found in the frame
+    """
+    buffers = buffers_module.FrameBuffers()
+    if gate is not None:
+        gate.reset()
+        if gate_state is not None:
+            gate.restore(gate_state)
+    frame_ind = start
+    for img in bkg.subtracted_frames(start=start, stop=stop, buffers=buffers):
+        detections = None if gate is None else gate.static_detections(img)
+        if detections is None:
+            detections = detect_in_frame(img, seg_obj, con_obj, buffers)
+            if gate is not None:
+                gate.remember(detections)
+        yield frame_ind, img, detections
+        frame_ind += 1
+
+
+def search_frames(bkg, seg_obj, con_obj, path_obj, search, start=0,
+                  stop=None, gate=None, gate_state=None):
+    """Generate the detections in each frame, searching about live paths.
+
+    Like detect_frames, but with a localsearch.LocalSearch choosing where
+    in each frame to look from the paths the Path is tracking. The caller
+    must add each frame's detections to path_obj before asking for the
+    next, so frames are detected, and paths tracked, strictly in order.
+    Takes:
+        bkg - a Background for the video to be tracked
+        seg_obj - the Segment to segment each frame with
+        con_obj - the Contour to detect objects in each segmented frame with
+        path_obj - the Path the detections are being added to
+        search - the LocalSearch, it is reset first and counts the frames
+                 and pixels it searches
+        start - the first frame to detect in (0)
+        stop - the frame to stop before, the video end if None (None)
+        gate - a gate.MotionGate to skip static frames with, or None (None)
+        gate_state - a state of the gate to carry on from, see
+                     detect_frames (None)
+    Gives:
+        frame_ind - the frame number
+        img - the background subtracted frame
+        detections - a Detections of the objects found in the frame
+    """
+    buffers = buffers_module.FrameBuffers()
+    search.reset()
+    if gate is not None:
+        gate.reset()
+        if gate_state is not None:
+            gate.restore(gate_state)
+    frame_ind = start
+    for img in bkg.subtracted_frames(start=start, stop=stop, buffers=buffers):
+        detections = None if gate is None else gate.static_detections(img)
+        if detections is None:
+            detections = search.search(img, seg_obj, con_obj, path_obj,
+                                       frame_ind)
+            if detections is None:
+                detections = detect_in_frame(img, seg_obj, con_obj, buffers)
+            if gate is not None:
+                gate.remember(detections)
+        yield frame_ind, img, detections
+        frame_ind += 1
+
+
+def track_video(filename, seg_obj=None, con_obj=None, path_obj=None,
+                roi=None, gate=None, search=None, cancel=None):
+    """Track a video file on a single core.
+
+    Takes:
+        filename - the full path to the video
+        seg_obj - Segment to use, defaults if None (None)
+        con_obj - Contour to use, defaults if None (None)
+        path_obj - Path to use, defaults if None (None)
+        roi - an roi.ROI to track within, the whole frame if None (None)
+        gate - a gate.MotionGate to skip static frames with, or None (None)
+        search - a localsearch.LocalSearch to search about live paths
+                 with, or None to search every frame in full (None)
+        cancel - a callable, asked before each frame, which stops tracking
+                 when it gives True; None to never stop early (None)
+    Gives:
+        paths - a list of all the completed paths that meet filters, or
+                None if tracking was cancelled
+    """
+    seg_obj = segment.create_segment_object() if seg_obj is None else seg_obj
+    con_obj = contour.create_contour_object() if con_obj is None else con_obj
+    path_obj = path.create_path_object() if path_obj is None else path_obj
+    vid, bkg = open_for_tracking(filename, roi)
+    path_obj.forget_paths()
+    path_obj.set_offset(_offset(roi))
+    if search is None:
+        frames = detect_frames(bkg, seg_obj, con_obj, gate=gate)
+    else:
+        frames = search_frames(bkg, seg_obj, con_obj, path_obj, search,
+                               gate=gate)
+    for frame_ind, img, detections in frames:
+        if cancel is not None and cancel():
+            vid.release()
+            return None
+        path_obj.add_frame(detections, frame_ind)
+    vid.release()
+    return path_obj.finalize()
+
+
+def _detect_chunk(args):
+    """Detect objects in a range of frames, in a worker process.
+
+    Only the detection records are sent back, not the raw contours.
+    Takes:
+        args - tuple of filename, Segment, Contour, start and stop frames,
+               region of interest and MotionGate or None
+    Gives:
+        start - the first frame of the range
+        log - list of the Detections in each frame of the range
+        counts - the gate's counts of frames checked and skipped, or None
+    """
+    filename, seg_obj, con_obj, start, stop, roi, gate = args
+    vid, bkg = open_for_tracking(filename, roi)
+    log = [contour.Detections(detections.records) for _, _, detections
+           in detect_frames(bkg, seg_obj, con_obj, start, stop, gate)]
+    vid.release()
+    return start, log, None if gate is None else gate.counts()
+
+
+def frame_chunks(length, processes, chunk_length=None, first=0):
+    """Split a video's frames into ranges to be worked on separately.
+
+    Takes:
+        length - the number of frames in the video
+        processes - the number of worker processes
+        chunk_length - frames in each range, four ranges per worker if None
+        first - the first frame to split from (0)
+    Gives:
+        chunks - list of (start, stop) frame ranges
+    """
+    if chunk_length is None:
+        chunk_length = max(1, -(-(length-first)//(4*processes)))
+    return [(start, min(start+chunk_length, length))
+            for start in range(first, length, chunk_length)]
+
+
+def parallel_detections(filename, seg_obj, con_obj, processes=None,
+                        chunk_length=None, roi=None, first=0, gate=None):
+    """Generate the detections in each frame, found on several cores.
+
+    The video is split into frame ranges and the background subtraction,
+    segmentation and contouring of each range is done in a pool of worker
+    processes. The background model comes from the start of the video
+    whichever range is being worked on, so each frame's detections are the
+    same as they would be in a serial run. Not every codec seeks to an
+    exact frame; if yours doesn't, detect serially or convert the video to
+    TIFF first. Each range is gated separately, so with a gate the first
+    frame of every range is detected in.
+    Takes:
+        filename - the full path to the video
+        seg_obj - the Segment to segment each frame with
+        con_obj - the Contour to detect objects in each segmented frame with
+        processes - number of worker processes, one per core if None (None)
+        chunk_length - frames in each range, see frame_chunks (None)
+        roi - an roi.ROI to detect within, the whole frame if None (None)
+        first - the first frame to detect in (0)
+        gate - a gate.MotionGate to skip static frames with, it is reset
+               first and the workers' counts are added to it (None)
+    Gives:
+        frame_ind - the frame number, in order
+        detections - a Detections of the objects found in the frame
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    vid = video.open_video_file(filename)
+    length = int(vid.length)
+    vid.release()
+    if gate is not None:
+        gate.reset()
+    jobs = [(filename, seg_obj, con_obj, start, stop, roi, gate)
+            for start, stop in frame_chunks(length, processes, chunk_length,
+                                            first)]
+    pool = multiprocessing.Pool(processes)
+    try:
+        for start, log, counts in pool.imap(_detect_chunk, jobs):
+            if counts is not None:
+                gate.add_counts(*counts)
+            for offset, detections in enumerate(log):
+                yield start+offset, detections
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def track_video_parallel(filename, seg_obj=None, con_obj=None, path_obj=None,
+                         processes=None, chunk_length=None, roi=None,
+                         gate=None):
+    """Track a video file, detecting objects on several cores at once.
+
+    Detection is split across worker processes by parallel_detections and
+    the detections are fed into the path matching, here, in frame order as
+    each range comes back. This stitches paths across range boundaries
+    without any overlap and gives the same paths as track_video.
+    Takes:
+        filename - the full path to the video
+        seg_obj - Segment to use, defaults if None (None)
+        con_obj - Contour to use, defaults if None (None)
+        path_obj - Path to use, defaults if None (None)
+        processes - number of worker processes, one per core if None (None)
+        chunk_length - frames in each range, see frame_chunks (None)
+        roi - an roi.ROI to track within, the whole frame if None (None)
+        gate - a gate.MotionGate to skip static frames with, or None (None)
+    Gives:
+        paths - a list of all the completed paths that meet filters
+    """
+    seg_obj = segment.create_segment_object() if seg_obj is None else seg_obj
+    con_obj = contour.create_contour_object() if con_obj is None else con_obj
+    path_obj = path.create_path_object() if path_obj is None else path_obj
+    path_obj.forget_paths()
+    path_obj.set_offset(_offset(roi))
+    for frame_ind, detections in parallel_detections(
+            filename, seg_obj, con_obj, processes, chunk_length, roi,
+            gate=gate):
+        path_obj.add_frame(detections, frame_ind)
+    return path_obj.finalize()
+
+
+def stream_video(filename, out, seg_obj=None, con_obj=None,
+                 path_obj=None, processes=1, compact=False, prefetch=None,
+                 roi=None, csv=False, checkpoint=None, checkpoint_every=1000,
+                 gate=None, search=None):
+    """Track a video, writing each path out to file as soon as it ends.
+
+    Only the live paths are held in memory, so memory use stays flat no
+    matter how long the video is. Paths are appended to a single track
+    store file, see trackstore.py, or with csv are written one to a file,
+    as out/path_NNNN.csv in the format of Path.save_path_centers.
+    With a checkpoint file the state of the run is saved every so often,
+    and a run finding a checkpoint left by an earlier, unfinished, run of
+    the same video and settings carries on from it. The checkpoint is
+    removed once the run is done. A gated run on several processes gates
+    each range of frames afresh, so what its gate knew can't be carried
+    on from and it never resumes.
+    Takes:
+        filename - the full path to the video
+        out - the track store file to write, or with csv the directory to
+              write paths to, made if needed
+        seg_obj - Segment to use, defaults if None (None)
+        con_obj - Contour to use, defaults if None (None)
+        path_obj - Path to use, defaults if None (None)
+        processes - number of processes to detect objects with (1)
+        compact - whether to keep frames in the video's native type (False)
+        prefetch - frames to decode ahead on a background thread (None)
+        roi - an roi.ROI to track within, the whole frame if None (None)
+        csv - whether to write a CSV file per path rather than a track
+              store (False)
+        checkpoint - the file to checkpoint to, None not to (None)
+        checkpoint_every - frames between checkpoints (1000)
+        gate - a gate.MotionGate to skip static frames with, which is left
+               holding the counts of frames it checked and skipped (None)
+        search - a localsearch.LocalSearch to search about live paths with,
+                 which needs processes to be 1 (None)
+    Gives:
+        path_count - the number of paths written
+        frame_count - the number of frames tracked, by this run
+    """
+    if search is not None and processes > 1:
+        raise ValueError("Searching about live paths needs the frames to be "
+                         "tracked in order, by a single process")
+    seg_obj = segment.create_segment_object() if seg_obj is None else seg_obj
+    con_obj = contour.create_contour_object() if con_obj is None else con_obj
+    path_obj = path.create_path_object() if path_obj is None else path_obj
+    path_obj.forget_paths()
+    path_obj.set_offset(_offset(roi))
+    saver, resume = None, None
+    if checkpoint is not None:
+        saver = checkpoint_module.Checkpoint(
+            checkpoint, filename, checkpoint_module.run_settings(
+                seg_obj, con_obj, path_obj, roi, compact, gate, search))
+        resume = saver.load()
+    if gate is not None and processes > 1:
+        resume = None
+    first, path_count, store_rows, gate_state = 0, 0, None, None
+    if resume is not None:
+        path_obj.restore(resume['path_state'])
+        gate_state = resume['gate_state']
+        first, path_count = resume['frame'], resume['paths_written']
+        store_rows = resume['store_rows']
+    if csv:
+        if not os.path.exists(out):
+            os.makedirs(out)
+        store = None
+        write = lambda ind, one_path: path_obj.save_path_centers(
+            os.path.join(out, 'path_%04i.csv'%ind), one_path)
+    else:
+        store = trackstore.TrackStoreWriter(out, resume is not None,
+                                            store_rows)
+        write = lambda ind, one_path: store.append(
+            path_obj.path_table(one_path))
+    if processes > 1:
+        source = parallel_detections(filename, seg_obj, con_obj, processes,
+                                     roi=roi, first=first, gate=gate)
+        vid = None
+    else:
+        vid, bkg = open_for_tracking(filename, roi, prefetch, compact)
+        if search is None:
+            frames = detect_frames(bkg, seg_obj, con_obj, first, gate=gate,
+                                   gate_state=gate_state)
+        else:
+            frames = search_frames(bkg, seg_obj, con_obj, path_obj, search,
+                                   first, gate=gate, gate_state=gate_state)
+        source = ((frame_ind, detections) for frame_ind, _, detections
+                  in frames)
+    frame_count = 0
+    for frame_ind, detections in source:
+        path_obj.add_frame(detections, frame_ind)
+        for one_path in path_obj.pop_finished_paths():
+            write(path_count, one_path)
+            path_count += 1
+        frame_count += 1
+        if saver is not None and (frame_ind+1) % checkpoint_every == 0:
+            if store is not None:
+                store.flush()
+            saver.save(frame_ind+1, path_obj.state(), path_count,
+                       0 if store is None else store.length,
+                       None if gate is None else gate.state())
+    for one_path in path_obj.finalize():
+        write(path_count, one_path)
+        path_count += 1
+    if store is not None:
+        store.close()
+    if vid is not None:
+        vid.release()
+    if saver is not None:
+        saver.remove()
+    return path_count, frame_count
+
+
+# Command line options handed on to the Segment, Contour and Path
+_SEGMENT_OPTIONS = ('thresh_area', 'open_x', 'open_y', 'levels', 'refine')
+_CONTOUR_OPTIONS = ('area_min', 'area_max', 'perim_min', 'perim_max',
+                    'ratio_min', 'ratio_max', 'backend')
+_PATH_OPTIONS = ('near', 'min_length')
+_GATE_OPTIONS = {'gate_threshold': 'threshold', 'gate_factor': 'factor',
+                 'gate': 'measure', 'gate_max_skip': 'max_skip'}
+
+
+def parse_arguments(argv=None):
+    """Parse command line arguments, filling gaps from any config file.
+
+    The config file is JSON, with keys named as the long options are but
+    with underscores for dashes. Options given on the command line win.
+    """
+    parser = argparse.ArgumentParser(
+        description="Track the moving objects in a video, without a GUI.")
+    parser.add_argument('video', help="the video file to track")
+    parser.add_argument('-o', '--out', help="track store to write paths to "
+                        "(VIDEO.tracks), or directory with --csv "
+                        "(VIDEO_paths)")
+    parser.add_argument('--csv', action='store_true', default=None,
+                        help="write a CSV file per path instead")
+    parser.add_argument('-c', '--config', help="JSON file of options")
+    parser.add_argument('-p', '--processes', type=int,
+                        help="processes to detect objects with (1)")
+    parser.add_argument('--compact', action='store_true', default=None,
+                        help="keep frames in the video's native type")
+    parser.add_argument('--prefetch', type=int,
+                        help="frames to decode ahead on a background thread")
+    for name in ('thresh_area', 'open_x', 'open_y', 'area_min', 'area_max',
+                 'perim_min', 'perim_max', 'near', 'min_length'):
+        parser.add_argument('--'+name.replace('_', '-'), type=int)
+    for name in ('ratio_min', 'ratio_max'):
+        parser.add_argument('--'+name.replace('_', '-'), type=float)
+    parser.add_argument('--backend', choices=('contours', 'components'))
+    parser.add_argument('--levels', type=int,
+                        help="times to halve frames before segmenting (0)")
+    parser.add_argument('--refine', action='store_true', default=None,
+                        help="refine centers found in halved frames")
+    parser.add_argument('--roi', help="region of interest to track within, "
+                        "as LEFT,TOP,WIDTH,HEIGHT")
+    parser.add_argument('--roi-polygon', help="outline of the region of "
+                        "interest, as X1,Y1,X2,Y2,...")
+    parser.add_argument('--gate', choices=('difference', 'energy'),
+                        help="skip segmenting frames that change less than "
+                        "the gate threshold since the last one segmented, "
+                        "or whose foreground is less than it")
+    parser.add_argument('--gate-threshold', type=float, help="grey level, "
+                        "of the most changed block, below which a frame is "
+                        "static (2.0)")
+    parser.add_argument('--gate-factor', type=int, help="pixels across the "
+                        "blocks frames are averaged over for gating (8)")
+    parser.add_argument('--gate-max-skip', type=int, help="most static "
+                        "frames to skip in a row, 0 for no limit (0)")
+    parser.add_argument('--search-windows', action='store_true',
+                        default=None, help="segment only windows about the "
+                        "paths being tracked, between full frame searches")
+    parser.add_argument('--redetect-every', type=int, help="frames between "
+                        "full frame searches with --search-windows (50)")
+    parser.add_argument('--search-margin', type=int, help="pixels searched "
+                        "past each object's box and motion with "
+                        "--search-windows (the reach of segmentation)")
+    parser.add_argument('--search-fraction', type=float, help="most of a "
+                        "frame the windows may cover before it is searched "
+                        "in full with --search-windows (0.5)")
+    parser.add_argument('--established', type=int, help="points a path "
+                        "needs before losing it calls for a full frame "
+                        "search with --search-windows (3)")
+    parser.add_argument('--checkpoint', help="file to checkpoint the run "
+                        "to and resume it from (OUT.checkpoint)")
+    parser.add_argument('--checkpoint-every', type=int, help="frames "
+                        "between checkpoints, 0 for none (1000)")
+    parser.add_argument('--profile', help="JSON file to write stage timings "
+                        "and counts to, for this process only")
+    parser.add_argument('--trace', help="file to write a Chrome trace of "
+                        "each stage call to")
+    args = parser.parse_args(argv)
+    if args.config is not None:
+        with open(args.config) as config_file:
+            config = json.load(config_file)
+        for key, value in config.items():
+            if getattr(args, key, None) is None:
+                setattr(args, key, value)
+    if args.out is None:
+        args.out = os.path.splitext(args.video)[0] + \
+            ('_paths' if args.csv else '.tracks')
+    if args.checkpoint_every is None:
+        args.checkpoint_every = 1000
+    if args.checkpoint is None and args.checkpoint_every > 0:
+        args.checkpoint = args.out+'.checkpoint'
+    return args
+
+
+def main(argv=None):
+    """Track a video from the command line."""
+    args = parse_arguments(argv)
+    options = lambda names: dict((name, getattr(args, name, None))
+                                 for name in names)
+    seg_obj = segment.Segment(**options(_SEGMENT_OPTIONS))
+    con_obj = contour.Contour(**options(_CONTOUR_OPTIONS))
+    path_obj = path.Path(**options(_PATH_OPTIONS))
+    gate = None
+    if args.gate is not None:
+        gate = gate_module.MotionGate(**dict(
+            (keyword, getattr(args, name, None))
+            for name, keyword in _GATE_OPTIONS.items()))
+    search = None
+    if args.search_windows:
+        search = localsearch.LocalSearch(args.redetect_every,
+                                         args.search_margin, args.established,
+                                         args.search_fraction)
+    if args.profile is not None or args.trace is not None:
+        instrument.enable(trace=args.trace is not None)
+    path_count, frame_count = stream_video(
+        args.video, args.out, seg_obj, con_obj, path_obj,
+        args.processes or 1, bool(args.compact), args.prefetch,
+        roi_module.parse_roi(args.roi, args.roi_polygon), bool(args.csv),
+        args.checkpoint if args.checkpoint_every > 0 else None,
+        args.checkpoint_every, gate, search)
+    print "Wrote %i paths from %i frames to %s"%(path_count, frame_count,
+                                                 args.out)
+    if gate is not None:
+        print "Skipped %i of %i frames as static"%(gate.counts()[1],
+                                                   gate.counts()[0])
+    if search is not None:
+        frames, full, searched, pixels = search.counts()
+        print "Searched %i of %i frames in full, %.1f%% of pixels in all"%(
+            full, frames, 100.0*searched/max(1, pixels))
+    if args.profile is not None:
+        instrument.save_summary(args.profile)
+    if args.trace is not None:
+        instrument.save_trace(args.trace)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" trackstore.py
+
+trackstore.py keeps all the paths found in a video in one binary file, in
+place of a text file per path. The file is a short header followed by fixed
+width little-endian records of TRACK_DTYPE, one per point of each path, and
+is only ever appended to, a whole path at a time, as paths are finished.
+Being fixed width, it maps straight into numpy, so each column is a view of
+the file without any parsing; TrackStore reads it so and indexes it by path
+id and by frame.
+"""
+
+import os
+import struct
+import numpy as np
+
+
+# One row per point of a path, in full frame pixels
+TRACK_DTYPE = np.dtype([('path_id', '<i4'), ('frame', '<i4'),
+                        ('x', '<f8'), ('y', '<f8'),
+                        ('area', '<f8'), ('perim', '<f8')])
+
+MAGIC = 'HVTRACKS'
+VERSION = 1
+_HEADER = struct.Struct('<8sII')  # magic, version, bytes per record
+HEADER_SIZE = _HEADER.size
+
+
+def _check_header(header, filename):
+    """Raise a ValueError unless header is that of a track store we read."""
+    if len(header) < HEADER_SIZE:
+        raise ValueError("%s is too short to be a track store"%filename)
+    magic, version, itemsize = _HEADER.unpack(header[:HEADER_SIZE])
+    if magic != MAGIC:
+        raise ValueError("%s is not a track store"%filename)
+    if version != VERSION or itemsize != TRACK_DTYPE.itemsize:
+        raise ValueError("%s is an unknown track store version"%filename)
+
+
+class TrackStoreWriter(object):
+    """Append paths, a whole one at a time, to a track store file.
+
+    Path ids are given out in the order paths are appended, starting after
+    the largest already in the file when appending to an existing store.
+    """
+    def __init__(self, filename, append=False, keep=None):
+        """Open a store to write to.
+
+        Takes:
+            filename - the store file
+            append - whether to add to an existing store, rather than
+                     starting afresh (False)
+            keep - when appending, the number of rows to keep, those after
+                   being cut off; all whole rows if None (None)
+        """
+        self.filename = filename
+        self.next_id = 0
+        self.length = 0  # rows in the file
+        if append and os.path.exists(filename):
+            existing = TrackStore(filename)
+            self.length = len(existing) if keep is None else keep
+            if self.length > len(existing):
+                raise ValueError("%s has fewer than %i rows"%(filename, keep))
+            if self.length > 0:
+                self.next_id = int(
+                    existing.column('path_id')[:self.length].max())+1
+            del existing
+            self._file = open(filename, 'r+b')
+            self._file.truncate(HEADER_SIZE + self.length*TRACK_DTYPE.itemsize)
+            self._file.seek(0, os.SEEK_END)
+        else:
+            self._file = open(filename, 'wb')
+            self._file.write(_HEADER.pack(MAGIC, VERSION,
+                                          TRACK_DTYPE.itemsize))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, rows):
+        """Append the rows of one path, giving it the next path id.
+
+        Takes:
+            rows - array of TRACK_DTYPE, its path_id column is overwritten
+        Gives:
+            path_id - the id the path was stored under
+        """
+        path_id = self.next_id
+        rows = np.asarray(rows, TRACK_DTYPE)
+        rows['path_id'] = path_id
+        self._file.write(rows.tostring())
+        self.next_id += 1
+        self.length += len(rows)
+        return path_id
+
+    def flush(self):
+        """Push what has been appended so far out to the file, and disk."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        """Finish writing."""
+        if not self._file.closed:
+            self._file.close()
+
+
+class TrackStore(object):
+    """Read-only access to a track store, mapped into memory.
+
+    Rows are grouped by path, in order of path id, as that is the order
+    they were appended in.
+    """
+    def __init__(self, filename):
+        """Map a store. Raises a ValueError if it isn't one.
+
+        A partly written last row, left by a crash, is ignored.
+        """
+        self.filename = filename
+        with open(filename, 'rb') as store_file:
+            _check_header(store_file.read(HEADER_SIZE), filename)
+        size = os.path.getsize(filename) - HEADER_SIZE
+        length = size // TRACK_DTYPE.itemsize
+        self.nbytes = HEADER_SIZE + length*TRACK_DTYPE.itemsize
+        if length > 0:
+            self.rows = np.memmap(filename, TRACK_DTYPE, 'r', HEADER_SIZE,
+                                  (length,))
+        else:
+            self.rows = np.zeros(0, TRACK_DTYPE)
+        self._by_frame = None  # row order sorted by frame, made when needed
+        self._sorted_frames = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def column(self, name):
+        """Give a column, as a view of the file."""
+        return self.rows[name]
+
+    def path_ids(self):
+        """Give the ids of the paths in the store, in order."""
+        ids = self.rows['path_id']
+        if len(ids) == 0:
+            return ids[:0]
+        return ids[np.r_[0, np.flatnonzero(np.diff(ids))+1]]
+
+    def path(self, path_id):
+        """Give the rows of a path, as a view of the file."""
+        ids = self.rows['path_id']
+        start, stop = np.searchsorted(ids, [path_id, path_id+1])
+        return self.rows[start:stop]
+
+    def paths(self):
+        """Generate the rows of each path in turn."""
+        for path_id in self.path_ids():
+            yield self.path(path_id)
+
+    def frames(self, start, stop=None):
+        """Give the rows of any path with a frame in [start, stop), by frame.
+
+        Takes:
+            start - the first frame wanted
+            stop - the frame to stop before, just start if None (None)
+        Gives:
+            rows - TRACK_DTYPE array of the rows, sorted by frame
+        """
+        if stop is None:
+            stop = start+1
+        if self._by_frame is None:
+            self._by_frame = np.argsort(self.rows['frame'], kind='mergesort')
+            self._sorted_frames = self.rows['frame'][self._by_frame]
+        first, last = np.searchsorted(self._sorted_frames, [start, stop])
+        return self.rows[self._by_frame[first:last]]
+
+    def export_csv(self, out_dir):
+        """Write each path out as out_dir/path_NNNN.csv, NNNN its path id.
+
+        The files are as Path.save_path_centers writes them: a line of
+        frame number, x and y for each point.
+        Takes:
+            out_dir - the directory to write to, made if needed
+        Gives:
+            count - the number of files written
+        """
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        count = 0
+        for rows in self.paths():
+            write_path_csv(os.path.join(
+                out_dir, 'path_%04i.csv'%rows['path_id'][0]), rows)
+            count += 1
+        return count
+
+
+def write_path_csv(filename, rows):
+    """Write a path's frames and centers out as CSV, from TRACK_DTYPE rows."""
+    centers = np.column_stack((rows['frame'], rows['x'], rows['y']))
+    np.savetxt(filename, centers, '%.8e', ',')
@@ -8,33 +8,224 @@ for the tracker. It provides a uniform interface which abstracts away the
 details of which video file type you are dealing with.
 """
 
+import os
+import hashlib
+import threading
+import Queue
+import numpy as np
 try:
     import cv2
-    import tiffcapture as tc
 except ImportError, e:
-    raise Exception("You'll need both OpenCV and TiffCapture installed. OpenCV can be gotten with 'brew install opencv' on a Mac or from opencv.org on Windows and TiffCapture can be gotten with 'pip install tiffcapture' on any platform.")
+    raise Exception("You'll need OpenCV installed. OpenCV can be gotten with 'brew install opencv' on a Mac or from opencv.org on Windows.")
+import tiffstack
+import instrument
 
 
-def open_video_file(filename):
+# Weights to average colour channels with cv2.transform
+_CHANNEL_MEAN = np.ones((1, 3))/3
+
+
+def _cap_prop(name):
+    """Give a capture property, named as in OpenCV 3 on, or as in 2.4."""
+    if hasattr(cv2, 'CAP_PROP_'+name):
+        return getattr(cv2, 'CAP_PROP_'+name)
+    return getattr(cv2.cv, 'CV_CAP_PROP_'+name)
+
+
+def fourcc(*code):
+    """Give the four character code of a codec, as VideoWriter wants it."""
+    if hasattr(cv2, 'VideoWriter_fourcc'):
+        return cv2.VideoWriter_fourcc(*code)
+    return cv2.cv.CV_FOURCC(*code)
+
+
+def open_video_file(filename, prefetch=None, compact=False):
     """Create and return an opened video file from the passed file name."""
-    return Video(filename)
+    return Video(filename, prefetch, compact)
+
+
+def file_fingerprint(filename, sample=65536):
+    """Give a fingerprint that changes if a video file is changed.
+
+    This is the file's size and a SHA-1 of its first and last sample bytes,
+    enough to tell videos apart without reading the whole of a large file.
+    Takes:
+        filename - the video file
+        sample - bytes to hash from each end of the file (65536)
+    Gives:
+        fingerprint - a string, the same for the same file
+    """
+    size = os.path.getsize(filename)
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as video_file:
+        digest.update(video_file.read(sample))
+        video_file.seek(max(0, size-sample))
+        digest.update(video_file.read(sample))
+    return '%i:%s'%(size, digest.hexdigest())
+
+
+def _count_pages(filename, counted):
+    """Give the number of pages in a TIFF, as PIL counts them.
+
+    TiffCapture's own count, passed as counted, comes up one page short on
+    newer versions of PIL, which know the count themselves; older ones
+    don't, so counted is given back for them.
+    """
+    from PIL import Image
+    pages = Image.open(filename)
+    count = getattr(pages, 'n_frames', counted)
+    if hasattr(pages, 'close'):
+        pages.close()
+    return count
+
+
+class _Prefetcher(object):
+    """Decode frames ahead of the reader on a background thread.
+
+    Frames are decoded into a fixed ring of buffers, each allocated on its
+    first use and reused thereafter. The decoding thread blocks when every
+    buffer is full, so it never runs more than depth frames ahead. OpenCV
+    releases the GIL while decoding, so this overlaps with whatever the
+    reading thread does with each frame.
+    """
+    def __init__(self, read_frame, depth):
+        """Start decoding.
+
+        Takes:
+            read_frame - callable taking a buffer (or None) to decode the
+                         next frame into, giving the frame or None at the end
+            depth - number of frame buffers in the ring, at least two
+        Gives:
+            None
+        """
+        self._read_frame = read_frame
+        self._buffers = [None] * max(2, depth)
+        self._free = Queue.Queue()
+        self._filled = Queue.Queue()
+        for ind in range(len(self._buffers)):
+            self._free.put(ind)
+        self._held = None  # the buffer last handed to the reader
+        self._error = None
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._decode)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _decode(self):
+        """Fill free buffers with frames until the video or we are done."""
+        while not self._stopped.is_set():
+            ind = self._free.get()
+            if ind is None:
+                break
+            try:
+                frame = self._read_frame(self._buffers[ind])
+            except Exception, e:
+                self._error = e
+                frame = None
+            if frame is None:
+                self._filled.put(None)
+                break
+            self._buffers[ind] = frame
+            self._filled.put(ind)
+
+    def next(self):
+        """Give the next decoded frame.
+
+        The frame is only valid until the following call, when its buffer
+        goes back to the decoding thread. Copy it if you need to keep it.
+        """
+        if self._held is not None:
+            self._free.put(self._held)
+            self._held = None
+        ind = self._filled.get()
+        if ind is None:
+            self._filled.put(None)  # stay exhausted for later calls
+            if self._error is not None:
+                raise self._error
+            raise StopIteration()
+        self._held = ind
+        return self._buffers[ind]
+
+    def stop(self):
+        """Stop the decoding thread and wait for it to finish."""
+        self._stopped.set()
+        self._free.put(None)  # wake the thread if it is waiting on a buffer
+        self._thread.join()
+        self._filled.put(None)  # and end iteration for any later reader
+
 
 class Video(object):
     """An access class for reading video frames"""
-    def __init__(self, filename=None):
-        """Prepare yourself"""
+    def __init__(self, filename=None, prefetch=None, compact=False):
+        """Prepare yourself.
+
+        Takes:
+            filename - the full path to the video (None)
+            prefetch - if given, the number of frames to decode ahead on a
+                       background thread when reading with next (None)
+            compact - if True, frames keep the native (usually uint8) type
+                      of the video rather than becoming float64 (False)
+        """
         self._is_open = False  # Set true on opening
+        self._prefetcher = None
+        self._raw = None  # colour frame buffer reused by OpenCV decoding
+        self.prefetch = prefetch
+        self.compact = compact
+        self.roi = None  # region of interest to crop frames to, see set_roi
         self.open(filename)
     
     def __iter__(self):
         return self
+
+    def __copy__(self):
+        """Give a Video of the same file, at the same frame, reading alone.
+
+        The copy opens its own reader and doesn't share any prefetching
+        thread, so seeking one never moves, or stops, the other.
+        """
+        other = Video.__new__(Video)
+        other.__dict__.update(self.__dict__)
+        other._prefetcher = None
+        other._raw = None
+        other._is_open = False
+        if self._is_open:
+            other.open(self.filename)
+            other._curr = self._curr
+            other._place(self._curr)
+        return other
     
-    def _to_grayscale(self, img):
-        """It is a whole lot easier to deal with grayscale, so convert"""
-        if len(img.shape) > 1:
-            img = img.mean(-1)
+    def _to_grayscale(self, img, out=None):
+        """It is a whole lot easier to deal with grayscale, so convert.
+
+        If out is given colour frames are averaged into it, while frames
+        which are already grayscale are given back as they are. Compact
+        videos average colour channels in the native type of the frame,
+        which rounds each pixel to within a third of a grey level. Frames
+        are cropped to any region of interest first.
+        """
+        if self.roi is not None:
+            img = self.roi.crop(img)
+        if img.ndim > 2 and self.compact and img.shape[-1] == 3:
+            img = cv2.transform(img, _CHANNEL_MEAN, dst=out)
+        elif img.ndim > 2:  # colour, so average the channels
+            img = img.mean(-1, out=out)
         return img
     
+    def set_roi(self, roi):
+        """Crop frames to a region of interest (an roi.ROI), None for all.
+
+        Set this before making a Background from the video, so that the
+        background model is cropped to match. A region reaching outside
+        the frame raises a ValueError.
+        """
+        if roi is not None and not roi.fits(*self.shape):
+            raise ValueError(
+                "Region of interest %i,%i,%i,%i reaches outside the %ix%i "
+                "frame"%((roi.left, roi.top, roi.width, roi.height) +
+                         tuple(self.shape)))
+        self.stop_prefetch()
+        self.roi = roi
+
     def isOpened(self):
         """Return true if opened."""
         return self._is_open
@@ -50,59 +241,147 @@ class Video(object):
             self.filename = filename
             ext = filename.split('.')[-1]
             if ext in ['tiff', 'tif', 'TIF', 'TIFF']:
-                # For tiffs use tiffcapture
+                # For tiffs map uncompressed stacks, otherwise use tiffcapture
                 self.format = 'TIFF'
-                self.video = tc.opentiff(filename)
+                self.video = tiffstack.open_tiff_stack(filename)
+                if self.video is None:
+                    # Only now, as TiffCapture brings PIL in with it
+                    try:
+                        import tiffcapture as tc
+                    except ImportError, e:
+                        raise Exception(
+                            "Compressed TIFFs need TiffCapture installed, "
+                            "which can be gotten with 'pip install "
+                            "tiffcapture' on any platform.")
+                    self.video = tc.opentiff(filename)
+                    self.video.length = _count_pages(filename,
+                                                     self.video.length)
                 self._is_open = True
                 self.length = self.video.length
                 self.shape = self.video.shape
                 self._curr = 0
+                self._place(0)
             else:
                 # For other formats try opencv
                 self.format = 'CV'
                 self.video = cv2.VideoCapture(filename)
                 self._is_open = True
-                self.length = self.video.get(cv2.cv.CV_CAP_PROP_FRAME_COUNT)
+                self.length = self.video.get(_cap_prop('FRAME_COUNT'))
                 self.shape = (
-                    int(self.video.get(cv2.cv.CV_CAP_PROP_FRAME_WIDTH)),
-                    int(self.video.get(cv2.cv.CV_CAP_PROP_FRAME_HEIGHT)))
+                    int(self.video.get(_cap_prop('FRAME_WIDTH'))),
+                    int(self.video.get(_cap_prop('FRAME_HEIGHT'))))
                 self._curr = 0
         return self.isOpened()
     
-    def next(self):
-        """Grab and read the next frame, stopping iteration at file end.
-        This retrofit allows us to iterate over the files, even though OpenCV
-        doesn't support it."""
+    def _place(self, i):
+        """Put the reader where the next frame it reads is frame i.
+
+        TiffStack reads its current frame and then moves on, while
+        TiffCapture moves on and then reads, as OpenCV's grab does, so it
+        has to be put one frame back.
+        """
+        if self.format=='TIFF':
+            if isinstance(self.video, tiffstack.TiffStack):
+                self.video.seek(i)
+            else:
+                self.video.seek(i-1)
+        else:
+            self.video.set(_cap_prop('POS_FRAMES'), i)
+
+    def _next_raw(self):
+        """Grab and read the next undecorated frame, stopping at file end."""
         if self._is_open and self.format=='TIFF':
-            return self._to_grayscale(self.video.next())
+            return self.video.next()
         elif self._is_open and self.format=='CV':
             if self.video.grab() is True:
-                return self._to_grayscale(self.retrieve()[1])
+                if self._raw is not None and self._raw.ndim < 3:
+                    self._raw = None  # only colour frames are converted away
+                self._raw = self.video.retrieve(self._raw)[1]
+                return self._raw
             else:
                 raise StopIteration()
         else:
             raise StopIteration()
         return
+
+    def _read_into(self, out=None):
+        """Read the next frame into out if given, giving None at file end."""
+        try:
+            img = self._next_raw()
+        except StopIteration:
+            return None
+        return self._to_grayscale(img, out)
+
+    def start_prefetch(self, depth=None):
+        """Begin decoding frames ahead of next on a background thread.
+
+        Frames given by next while prefetching are only valid until the
+        following call to next. Seeking or random access stops prefetching.
+        Takes:
+            depth - how many frames to decode ahead (self.prefetch or 4)
+        Gives:
+            None
+        """
+        self.stop_prefetch()
+        if depth is None:
+            depth = 4 if self.prefetch is None else self.prefetch
+        self._prefetcher = _Prefetcher(self._read_into, depth)
+
+    def stop_prefetch(self):
+        """Stop any background decoding.
+
+        The decoding thread will have read ahead of the frames handed out,
+        so the reader is put back to the frame after the last one given,
+        rather than losing those decoded but never read.
+        """
+        if self._prefetcher is not None:
+            self._prefetcher.stop()
+            self._prefetcher = None
+            self._place(self._curr)
+
+    @instrument.timed('video.next')
+    def next(self, out=None):
+        """Grab and read the next frame, stopping iteration at file end.
+        This retrofit allows us to iterate over the files, even though OpenCV
+        doesn't support it. If out is given, and the frame needs converting
+        to grayscale, it is converted into out rather than a new array. When
+        prefetching, out is ignored as frames come from the prefetch buffers.
+        """
+        if self._prefetcher is None and self.prefetch and self._is_open:
+            self.start_prefetch()
+        if self._prefetcher is not None:
+            frame = self._prefetcher.next()
+        else:
+            frame = self._to_grayscale(self._next_raw(), out)
+        self._curr += 1  # the next frame to be handed out
+        return frame
     
+    @instrument.timed('video.find_and_read')
     def find_and_read(self, i):
-        """Find and return a specific frame number, i."""
+        """Find and return a specific frame number, i.
+
+        This leaves where next reads from as it was.
+        """
+        self.stop_prefetch()
         if self.format=='TIFF':
             return self._to_grayscale(self.video.find_and_read(i))
         else:
-            self.video.set(cv2.cv.CV_CAP_PROP_POS_FRAMES, i)
-            return self._to_grayscale(self.video.retrieve()[1])
+            self.video.set(_cap_prop('POS_FRAMES'), i)
+            img = self._to_grayscale(self.video.read()[1])
+            self._place(self._curr)
+            return img
         return
     
     def seek(self, i):
-        """Set a given frame as the current."""
-        if self.format=='TIFF':
-            self.video.seek()
-        else:
-            self.video.set(cv2.cv.CV_CAP_PROP_POS_FRAMES, i)
+        """Set a given frame as the current, the next one read."""
+        self.stop_prefetch()
+        self._curr = i
+        self._place(i)
         return
     
     def release(self):
         """Release the open file by severing the connection to the video."""
+        self.stop_prefetch()
         if self.isOpened() is True:
             del(self.video)
             self._is_open = False
@@ -137,9 +416,8 @@ def write_video(imgstack, filename = '/Users/dave/Desktop/videoout.avi',
     if tc is False and len(imgstack[0].shape) == 2:
         imgstack = [np.tile(i, (3,1,1)) for i in imgstack]
     fps = 12.0
-    fourcc = cv2.cv.FOURCC('I', 'Y', 'U', 'V') 
     # size = (imgstack[0].shape[1], imgstack[0].shape[0]) 
-    writer = cv2.VideoWriter(filename, fourcc, fps, size)
+    writer = cv2.VideoWriter(filename, fourcc('I', 'Y', 'U', 'V'), fps, size)
     if tc is True:
         imgstack.seek(0)
         for i in range(imgstack.length):